@@ -0,0 +1,104 @@
+"""
+自适应多轮抽取（extraction_passes）：第一轮字段齐全就提前结束
+
+说明：
+- 原来每次 lx.extract 都固定 extraction_passes=2，模型调用次数与延迟翻倍；而对三行的短评，
+  第一轮往往已经抽到了全部字段。
+- PassScheduler.run(extract_once) 先调用一轮（extract_once 内部以 extraction_passes=1 调用 langextract），
+  按预期字段（如 service_name / version_number / document_category，或 shop_name / rating / sentiment）
+  检查是否齐全；只有缺字段的文档才继续补跑，最多 max_passes 轮。
+- 多轮结果的合并与 langextract 多轮抽取的规则一致：按原文位置（char_interval）合并，先到的结果优先，
+  后续轮次只补充与已有结果不重叠的抽取；同一类别可以有多个值（如 rate_limits）。
+  没有对齐信息的抽取按 (类别, 文本) 去重。
+- stats() 给出已抽取文档数、实际调用轮数、固定轮数下应调用的轮数与节省的轮数；
+  指标开启时同时计入 extraction_passes_total / extraction_passes_saved_total（见 metrics.py）。
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from metrics import METRICS
+
+
+def _span(extraction) -> Optional[Tuple[int, int]]:
+    interval = getattr(extraction, "char_interval", None)
+    start = getattr(interval, "start_pos", None)
+    end = getattr(interval, "end_pos", None)
+    return (start, end) if start is not None and end is not None else None
+
+
+def merge_passes(merged: List, extra: List) -> List:
+    """
+    把后一轮的 extractions 并入：与已有抽取的原文区间重叠的丢弃（先到的为准），
+    没有区间信息的按 (extraction_class, extraction_text) 去重。
+    """
+    spans = [span for span in map(_span, merged) if span is not None]
+    seen = {(ex.extraction_class, ex.extraction_text) for ex in merged}
+    out = list(merged)
+    for ex in extra:
+        span = _span(ex)
+        if span is not None:
+            if any(span[0] < end and start < span[1] for start, end in spans):
+                continue
+            spans.append(span)
+        elif (ex.extraction_class, ex.extraction_text) in seen:
+            continue
+        seen.add((ex.extraction_class, ex.extraction_text))
+        out.append(ex)
+    return out
+
+
+class PassScheduler:
+    """按字段完整度决定是否继续下一轮抽取（线程安全，可在并发抽取中共享）"""
+
+    def __init__(self, required_classes: Sequence[str] = (), max_passes: int = 2,
+                 is_complete: Optional[Callable[[List], bool]] = None, pipeline: str = ""):
+        self.required_classes = tuple(required_classes)
+        self.max_passes = max_passes
+        self._is_complete = is_complete
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.passes_run = 0
+        self.passes_budget = 0
+
+    def label(self, max_passes: Optional[int] = None) -> str:
+        """写入缓存指纹的轮数配置；与固定轮数的缓存条目互不混用"""
+        return f"adaptive<={max_passes or self.max_passes}"
+
+    def missing(self, extractions: List) -> List[str]:
+        """尚未抽到的预期类别"""
+        found = {ex.extraction_class for ex in extractions}
+        return [cls for cls in self.required_classes if cls not in found]
+
+    def is_complete(self, extractions: List) -> bool:
+        if self._is_complete is not None:
+            return self._is_complete(extractions)
+        return not self.missing(extractions)
+
+    def run(self, extract_once: Callable[[], List], max_passes: Optional[int] = None) -> List:
+        """执行第一轮；结果不完整时再补跑，直到完整或达到 max_passes；返回合并后的 extractions"""
+        max_passes = max_passes or self.max_passes
+        merged = list(extract_once())
+        passes = 1
+        while passes < max_passes and not self.is_complete(merged):
+            merged = merge_passes(merged, list(extract_once()))
+            passes += 1
+        with self._lock:
+            self.documents += 1
+            self.passes_run += passes
+            self.passes_budget += max_passes
+        METRICS.inc("extraction_passes_total", passes, pipeline=self.pipeline)
+        METRICS.inc("extraction_passes_saved_total", max_passes - passes, pipeline=self.pipeline)
+        return merged
+
+    def stats(self) -> Dict:
+        with self._lock:
+            saved = self.passes_budget - self.passes_run
+            return {
+                "documents": self.documents,
+                "passes_run": self.passes_run,
+                "passes_budget": self.passes_budget,
+                "passes_saved": saved,
+                "saved_ratio": saved / self.passes_budget if self.passes_budget else 0.0,
+            }
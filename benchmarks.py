@@ -0,0 +1,297 @@
+"""
+合成语料基准测试：抽取与检索热路径
+
+说明：
+- synth_reviews(n) / synth_docs(n)：按固定随机种子生成大众点评风格的中文评论、英文技术文档，
+  同一 (n, seed) 每次生成的语料完全相同，不同提交之间的结果可以直接对比。
+- 每个规模（默认 1k / 100k / 1M）在独立子进程中运行，测量：
+  - 抽取吞吐（docs/sec）：两个 RAG 脚本的 _enhanced_regex_extraction、EnhancedOpinionExtractorV7._fallback_extract
+    （只在前 --extract-sample 条上测，避免 1M 规模时耗时过长）
+  - 建索引吞吐：SmartVectorStore.add_documents
+  - 检索延迟（毫秒，mean / p50 / p95）：SmartVectorStore.search 不带过滤、带 extract_smart_filters 过滤，
+    以及两者的 BM25 top-k 模式
+  - 峰值内存：子进程的 ru_maxrss（MB），包含语料本身
+- 结果写成 JSON（含提交号、Python 版本、CPU 数）；--compare 对比两份结果，标出变差超过阈值的指标。
+- 1M 规模需要数 GB 内存与数分钟时间。
+
+命令行：
+    python benchmarks.py --scales 1000 100000 --out bench.json
+    python benchmarks.py --compare bench_old.json bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Sequence
+
+try:
+    import resource  # Unix only
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    resource = None
+    RESOURCE_AVAILABLE = False
+
+DEFAULT_SCALES = (1000, 100000, 1000000)
+
+# ----------------------------------------------------------------------
+# 合成语料
+# ----------------------------------------------------------------------
+_SHOP_PREFIXES = ["老王", "小南", "绿茶", "海鲜", "川味", "金牌", "阿婆", "东北", "巷口", "湘里", "蜀香", "福记"]
+_SHOP_SUFFIXES = ["烧烤", "面馆", "餐厅", "一品", "火锅", "小馆", "酒楼", "大排档"]
+_POSITIVE_PHRASES = ["味道很棒", "羊肉串多汁", "环境干净", "服务态度热情", "上菜很快", "食材新鲜", "推荐给朋友",
+                     "环境雅致", "适合聚餐", "性价比高", "停车方便", "总体很满意"]
+_NEGATIVE_PHRASES = ["分量偏少", "上菜慢", "服务员不太热情", "人均偏贵", "有点失望", "桌面有油渍", "排队时间长",
+                     "味道一般", "价格明显偏高", "环境嘈杂"]
+_NEUTRAL_PHRASES = ["汤面中规中矩", "位置离地铁站有段距离", "菜品口味稳定", "装修普通", "周末人比较多"]
+_TAGS = ["环境好", "服务好", "味道棒", "味道一般", "偏贵", "食材新鲜", "上菜慢", "适合聚餐"]
+
+_SERVICES = ["Authentication API", "Storage Service", "Payment API", "Billing Service", "Search API",
+             "Notification Service", "Analytics API", "Messaging Service"]
+_TOPICS = ["OAuth 2.0 Implementation", "Pagination", "Webhooks", "Error Codes", "Pricing Tiers", "Retries",
+           "Batch Operations", "Access Control", "Regions", "SDK Setup"]
+_SENTENCES = [
+    "Send a POST request with your client credentials to obtain an access token.",
+    "Responses are returned as JSON and include a request id for tracing.",
+    "Tokens are valid for 1 hour and can be refreshed for up to 30 days.",
+    "Use exponential backoff when you receive a 429 error.",
+    "Objects larger than 5 GB must be uploaded in parts.",
+    "All endpoints require TLS 1.2 or later.",
+    "Invalid or expired credentials return a 401 Unauthorized error.",
+    "Webhook payloads are signed with your secret key.",
+]
+
+
+def synth_reviews(n: int, seed: int = 0) -> Iterator[Dict]:
+    """大众点评风格的中文评论：店名 / 评分 / 时间 / 评价 / 标签（约 70% 带标签行）"""
+    rng = random.Random(seed)
+    for i in range(n):
+        shop = rng.choice(_SHOP_PREFIXES) + rng.choice(_SHOP_SUFFIXES)
+        rating = rng.randint(1, 5)
+        pool = _POSITIVE_PHRASES if rating >= 4 else _NEGATIVE_PHRASES if rating <= 2 else _NEUTRAL_PHRASES
+        phrases = rng.sample(pool, 3) + rng.sample(_NEUTRAL_PHRASES + _POSITIVE_PHRASES + _NEGATIVE_PHRASES, 2)
+        rng.shuffle(phrases)
+        body = "，".join(phrases[:3]) + "。" + "，".join(phrases[3:]) + "。"
+        content = (f"店名：{shop}\n评分：{rating}星\n"
+                   f"时间：{rng.randint(2021, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}\n评价：{body}")
+        if rng.random() < 0.7:
+            content += "标签：" + ", ".join(rng.sample(_TAGS, 3))
+        yield {"id": f"rev_{i:07d}", "title": f"{shop} - {phrases[0]}", "content": content}
+
+
+def synth_docs(n: int, seed: int = 0) -> Iterator[Dict]:
+    """英文技术文档：Reference / Guide / Troubleshooting，含 rate limit 与 deprecated 说明"""
+    rng = random.Random(seed)
+    for i in range(n):
+        service = rng.choice(_SERVICES)
+        version = f"{rng.randint(1, 4)}.{rng.randint(0, 3)}"
+        kind = rng.random()
+        if kind < 0.6:
+            title = f"{service} Reference v{version}"
+        elif kind < 0.85:
+            title = f"{service} Guide v{version}"
+        else:
+            title = f"Troubleshooting Guide: {service} v{version} Errors"
+        sections = []
+        for topic in rng.sample(_TOPICS, 2):
+            sections.append(f"## {topic}\n" + " ".join(rng.sample(_SENTENCES, 3)))
+        sections.append("### Rate Limits\n"
+                        f"- Standard tier: {rng.choice([60, 100, 300])} requests per minute\n"
+                        f"- Premium tier: {rng.choice([1000, 3000])} req/min")
+        if rng.random() < 0.2:
+            sections.append(f"Note: This version is deprecated. Please upgrade to v{int(version[0]) + 1}.0.")
+        content = f"# {title}\n\n" + "\n\n".join(sections) + f"\n\nLast updated: {rng.choice(['January', 'March', 'April'])} 2024"
+        yield {"id": f"doc_{i:07d}", "title": title, "content": content}
+
+
+REVIEW_QUERIES = ["如何评价老王的味道？", "有哪些 5星 的推荐？", "关于上菜慢的差评有哪些？",
+                  "绿茶餐厅 环境 怎么样？", "海鲜 一品 是否 偏贵？", "服务态度 好评"]
+DOC_QUERIES = ["How do I authenticate with OAuth in version 2.0?", "What are the rate limits for authentication?",
+               "How do I troubleshoot 401 errors?", "Tell me about storage pricing", "webhooks guide", "retries"]
+
+
+# ----------------------------------------------------------------------
+# 计时工具
+# ----------------------------------------------------------------------
+def throughput(fn: Callable[[List[Dict]], object], docs: List[Dict]) -> float:
+    """fn(docs) 处理全部文档的 docs/sec"""
+    start = time.perf_counter()
+    fn(docs)
+    elapsed = time.perf_counter() - start
+    return len(docs) / elapsed if elapsed else float("inf")
+
+
+def latency(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """重复调用 fn，返回延迟统计（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+def peak_rss_mb() -> float:
+    if not RESOURCE_AVAILABLE:
+        return float("nan")
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024)
+
+
+def _search_latencies(store, queries: Sequence[str], smart_filters, repeat: int, k: int) -> Dict[str, float]:
+    metrics = {}
+    cases = {
+        "search_unfiltered": lambda q: store.search(q),
+        "search_filtered": lambda q: store.search(q, smart_filters(q)),
+        "search_topk_unfiltered": lambda q: store.search(q, k=k),
+        "search_topk_filtered": lambda q: store.search(q, smart_filters(q), k=k),
+    }
+    for name, run in cases.items():
+        per_query = [latency(lambda: run(q), repeat) for q in queries]
+        for stat in ("mean_ms", "p50_ms", "p95_ms"):
+            metrics[f"{name}_{stat}"] = statistics.fmean(r[stat] for r in per_query)
+    return metrics
+
+
+# ----------------------------------------------------------------------
+# 单个规模（在子进程中运行）
+# ----------------------------------------------------------------------
+def run_scale(corpus: str, n: int, extract_sample: int = 20000, search_repeat: int = 20,
+              k: int = 10, seed: int = 0) -> Dict:
+    with contextlib.redirect_stdout(io.StringIO()):
+        if corpus == "cn":
+            import langextract_rag_cn as rag
+            docs = list(synth_reviews(n, seed))
+            queries = REVIEW_QUERIES
+        else:
+            import langextract_rag as rag
+            docs = list(synth_docs(n, seed))
+            queries = DOC_QUERIES
+        processor = rag.FixedLangExtractProcessor()
+
+    metrics: Dict[str, float] = {"corpus_rss_mb": peak_rss_mb()}
+    sample = docs[:extract_sample]
+    metrics["regex_extraction_docs_per_sec"] = throughput(processor._enhanced_regex_extraction, sample)
+    if corpus == "cn":
+        from langextract_opinion_extraction import EnhancedOpinionExtractorV7
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            opinion = EnhancedOpinionExtractorV7(qwen_apikey="benchmark")
+        metrics["fallback_extract_docs_per_sec"] = throughput(
+            lambda batch: [opinion._fallback_extract(d["content"]) for d in batch], sample)
+
+    # 建索引用规则元数据（与无 LLM 时的入库路径一致）
+    indexed = [dict(doc, metadata=md) for doc, md in zip(docs, processor.rules.extract_batch(docs))]
+    del docs
+    store = rag.SmartVectorStore()
+    with contextlib.redirect_stdout(io.StringIO()):
+        metrics["index_docs_per_sec"] = throughput(store.add_documents, indexed)
+    metrics.update(_search_latencies(store, queries, rag.extract_smart_filters, search_repeat, k))
+    metrics["peak_rss_mb"] = peak_rss_mb()
+    return {"corpus": corpus, "scale": n, "metrics": metrics}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def run_suite(scales: Sequence[int] = DEFAULT_SCALES, corpora: Sequence[str] = ("cn", "en"), **kwargs) -> Dict:
+    """每个 (语料, 规模) 在新的子进程中运行，峰值内存互不影响"""
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": [],
+    }
+    for n in scales:
+        for corpus in corpora:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_scale, corpus, n, **kwargs).result()
+            report["results"].append(result)
+            m = result["metrics"]
+            print(f"📏 {corpus} n={n:<8d} 规则抽取 {m['regex_extraction_docs_per_sec']:,.0f} docs/s  "
+                  f"建索引 {m['index_docs_per_sec']:,.0f} docs/s  "
+                  f"检索 {m['search_unfiltered_mean_ms']:.2f}/{m['search_filtered_mean_ms']:.2f} ms（无过滤/过滤）  "
+                  f"峰值 {m['peak_rss_mb']:.0f} MB")
+    return report
+
+
+# ----------------------------------------------------------------------
+# 两次结果对比
+# ----------------------------------------------------------------------
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_sec")
+
+
+def compare(old: Dict, new: Dict, threshold: float = 0.1) -> List[Dict]:
+    """逐指标对比两份报告；变差超过 threshold（相对值）的标记为 regression"""
+    old_index = {(r["corpus"], r["scale"]): r["metrics"] for r in old["results"]}
+    rows = []
+    for r in new["results"]:
+        before = old_index.get((r["corpus"], r["scale"]))
+        if before is None:
+            continue
+        for metric, value in r["metrics"].items():
+            if metric not in before or not before[metric]:
+                continue
+            change = value / before[metric] - 1
+            worse = -change if _higher_is_better(metric) else change
+            rows.append({"corpus": r["corpus"], "scale": r["scale"], "metric": metric,
+                         "old": before[metric], "new": value, "change": change, "regression": worse > threshold})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成语料上的抽取/检索基准测试")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--corpora", nargs="+", choices=["cn", "en"], default=["cn", "en"])
+    parser.add_argument("--extract-sample", type=int, default=20000, help="抽取吞吐只在前 N 条上测量")
+    parser.add_argument("--search-repeat", type=int, default=20)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两份结果而不运行基准")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        rows = compare(old, new, args.threshold)
+        for row in rows:
+            flag = "❌" if row["regression"] else "  "
+            print(f"{flag} {row['corpus']} n={row['scale']:<8d} {row['metric']:<40s} "
+                  f"{row['old']:>12.3f} -> {row['new']:>12.3f} ({row['change']:+.1%})")
+        sys.exit(1 if any(row["regression"] for row in rows) else 0)
+
+    report = run_suite(args.scales, args.corpora, extract_sample=args.extract_sample,
+                       search_repeat=args.search_repeat)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
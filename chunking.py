@@ -0,0 +1,153 @@
+"""
+文档切块（chunking）：把长文档切成较小的检索/抽取单元
+
+说明：
+- chunk_markdown：按 Markdown 标题切节，每块记录所在的标题路径（如 "Authentication API v2.0 > Rate Limits"）；
+  只有标题、没有正文的小节并入下一节；超长的节再按段落、行切分。
+- chunk_sentences：中文评论按句切分（。！？；等），再贪心合并到不超过 max_chars；
+  开头的 "店名：xx / 评分：x星" 这类表头行并入第一块，并作为 context 附在其余各块上，使单独一块也能抽出店名与评分。
+- chunk_documents：把文档列表展开为 chunk 列表，每个 chunk 带 parent_id / chunk_index / offset，
+  content 恰为原文 content[offset:offset + len(content)]，可直接交给 extract_metadata 与 SmartVectorStore；
+  正文为空的文档产出一个空 chunk，不会从索引中消失。
+- context 只参与元数据抽取（见 extraction_text），不参与检索匹配。
+"""
+
+import re
+from typing import Callable, Dict, List, Optional, Pattern, Sequence, Tuple
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.M)
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+_LINE_RE = re.compile(r"\n")
+_SENTENCE_RE = re.compile(r"[。！？!?；;…]+[”’」』）)]*")
+_CLAUSE_RE = re.compile(r"[，,、]")
+# 表头行：短的 "键：值" 行，且不含句末标点（"评价：……。" 这类正文行不算）
+_HEADER_LINE_RE = re.compile(r"[^\s：:]{1,6}[：:][^\n。！？!?]{0,40}(?:\n|$)")
+
+
+def _trim(text: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+    """去掉 [start, end) 两端空白后的区间；全为空白时返回 None"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if start < end else None
+
+
+def _pack(text: str, start: int, end: int, separators: Sequence[Pattern], max_chars: int) -> List[Tuple[int, int]]:
+    """在 separators（由粗到细）处切分 [start, end)，再把相邻片段贪心合并为不超过 max_chars 的区间"""
+    if end - start <= max_chars:
+        return [(start, end)]
+    if not separators:
+        return [(i, min(i + max_chars, end)) for i in range(start, end, max_chars)]
+    pieces = []
+    prev = start
+    for cut in [m.end() for m in separators[0].finditer(text, start, end)] + [end]:
+        if cut > prev:
+            pieces.extend(_pack(text, prev, cut, separators[1:], max_chars))
+            prev = cut
+    merged: List[Tuple[int, int]] = []
+    for s, e in pieces:
+        if merged and e - merged[-1][0] <= max_chars:
+            merged[-1] = (merged[-1][0], e)
+        else:
+            merged.append((s, e))
+    return merged
+
+
+def chunk_markdown(text: str, max_chars: int = 1000) -> List[Dict]:
+    """按标题/段落切分 Markdown；返回 [{'text', 'start', 'heading', 'context'}, ...]"""
+    starts = [m.start() for m in _HEADING_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+
+    sections = []
+    path: List[Tuple[int, str]] = []
+    pending = None
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(text)
+        m = _HEADING_RE.match(text, start)
+        body_start = start
+        if m:
+            level = len(m.group(1))
+            path = [p for p in path if p[0] < level] + [(level, m.group(2))]
+            body_start = m.end()
+        if pending is not None:
+            start, pending = pending, None
+        if not text[body_start:end].strip() and i + 1 < len(starts):
+            # 只有标题的小节并入下一节
+            pending = start
+            continue
+        sections.append((start, end, " > ".join(title for _, title in path)))
+
+    chunks = []
+    for start, end, heading in sections:
+        for s, e in _pack(text, start, end, (_PARAGRAPH_RE, _LINE_RE), max_chars):
+            span = _trim(text, s, e)
+            if span:
+                chunks.append({"text": text[span[0]:span[1]], "start": span[0], "heading": heading, "context": heading})
+    return chunks
+
+
+def chunk_sentences(text: str, max_chars: int = 200) -> List[Dict]:
+    """按句切分中文文本；返回 [{'text', 'start', 'context'}, ...]"""
+    header_end = 0
+    while header_end < len(text):
+        m = _HEADER_LINE_RE.match(text, header_end)
+        if not m:
+            break
+        header_end = m.end()
+    header = text[:header_end].strip()
+
+    spans = []
+    for s, e in _pack(text, header_end, len(text), (_LINE_RE, _SENTENCE_RE, _CLAUSE_RE), max_chars):
+        span = _trim(text, s, e)
+        if span:
+            spans.append(span)
+    if header:
+        # 表头并入第一块，不单独成块
+        first = _trim(text, 0, header_end)
+        spans[:1] = [(first[0], spans[0][1] if spans else first[1])]
+
+    chunks = []
+    for start, end in spans:
+        # 不含表头的块，用表头作为抽取上下文
+        context = header if start >= header_end else ""
+        chunks.append({"text": text[start:end], "start": start, "context": context})
+    return chunks
+
+
+def chunk_documents(documents: List[Dict], chunker: Callable[..., List[Dict]], **kwargs) -> List[Dict]:
+    """把文档展开为 chunk 文档：id 为 "<父文档 id>#<序号>"，并带 parent_id / chunk_index / offset；
+    content 为空或全为空白的文档仍产出一个空 chunk，使其可按标题/元数据被检索到"""
+    result = []
+    for doc in documents:
+        pieces = chunker(doc["content"], **kwargs) or [{"text": "", "start": 0}]
+        for i, piece in enumerate(pieces):
+            chunk = {
+                "id": f"{doc['id']}#{i}",
+                "title": doc.get("title", ""),
+                "content": piece["text"],
+                "parent_id": doc["id"],
+                "chunk_index": i,
+                "offset": piece["start"],
+            }
+            if piece.get("heading"):
+                chunk["heading"] = piece["heading"]
+            if piece.get("context"):
+                chunk["context"] = piece["context"]
+            result.append(chunk)
+    return result
+
+
+def extraction_text(doc: Dict) -> str:
+    """交给抽取器的文本：chunk 的 context（标题路径/表头）+ 正文"""
+    context, content = doc.get("context"), doc.get("content", "")
+    return f"{context}\n{content}" if context else content
+
+
+def group_by_parent(results: List[Dict]) -> List[Tuple[str, List[Dict]]]:
+    """把检索到的 chunk 按父文档归组，父文档按其首个命中 chunk 的名次排列"""
+    groups: Dict[str, List[Dict]] = {}
+    for doc in results:
+        groups.setdefault(doc.get("parent_id", doc["id"]), []).append(doc)
+    return list(groups.items())
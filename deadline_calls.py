@@ -0,0 +1,139 @@
+"""
+带截止时间的模型调用：超时返回规则结果，可选对冲请求（hedged request）
+
+说明：
+- 交互场景（用户贴一条评论等待结果）关心的是尾延迟：模型偶尔几秒才返回，而规则抽取只要几毫秒。
+- DeadlineCaller.run(call, fallback, deadline) 把模型调用 call 放到后台线程，同时在当前线程执行 fallback；
+  deadline 秒内模型返回则采用模型结果，超时或调用失败则采用 fallback 的结果。
+- hedge=True 时，若模型调用超过"近期模型调用耗时的 p95"仍未返回，再发一个相同的请求，先返回的为准；
+  样本数不足 min_samples 时按 deadline 的一半计。对冲只针对慢请求，调用失败不会触发对冲。
+- 超时后后台请求不会被取消：它照常跑完，由 call 自己写入缓存（如 ExtractionCache），同一文本下次直接命中；
+  其耗时也照常计入 p95 统计。
+- 每个模型调用在自己的守护线程中立即发出，不经过固定大小的线程池：否则慢服务下超时/对冲的请求占满工作线程，
+  之后的请求在队列里排到截止时间也没有发出，服务恢复后仍然全部超时。
+  同时在途的后台调用数以 max_in_flight 为上限（防止服务挂起时线程无限堆积）：达到上限时不再排队，
+  直接返回 fallback 的结果（outcome 为 "saturated"），也不发对冲请求。
+- stats() 给出各结果的次数（model / hedged / deadline / error / saturated）、当前在途数与 p95；指标开启时计入
+  deadline_calls_total{outcome}（见 metrics.py）。
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from metrics import METRICS
+
+
+class LatencyTracker:
+    """最近 window 次调用耗时的滑动窗口（线程安全）"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """样本不足 min_samples 时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class DeadlineCaller:
+    """截止时间 + 对冲请求的调用器；每个模型调用一个守护线程，在途调用数不超过 max_in_flight"""
+
+    def __init__(self, max_in_flight: int = 64, window: int = 200, min_samples: int = 20, pipeline: str = ""):
+        self.max_in_flight = max_in_flight
+        self.latency = LatencyTracker(window, min_samples)
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {"model": 0, "hedged": 0, "deadline": 0, "error": 0, "saturated": 0}
+
+    def _start(self, call: Callable[[], Any]) -> Optional[Future]:
+        """在新的守护线程中立即发出 call；在途数已达上限时返回 None"""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return None
+            self._in_flight += 1
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+
+        def target():
+            start = time.perf_counter()
+            try:
+                result = call()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                self.latency.record(time.perf_counter() - start)
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+        threading.Thread(target=target, name="deadline-call", daemon=True).start()
+        return future
+
+    def hedge_delay(self, deadline: float) -> float:
+        """发出对冲请求前的等待时间：近期耗时的 p95，样本不足时取 deadline 的一半"""
+        p95 = self.latency.quantile(0.95)
+        return deadline / 2 if p95 is None else p95
+
+    def run(self, call: Callable[[], Any], fallback: Callable[[], Any], deadline: float,
+            hedge: bool = False) -> Tuple[Any, str]:
+        """
+        返回 (结果, outcome)：outcome 为 "model"（首个请求返回）、"hedged"（对冲请求先返回）、
+        "deadline"（超时，结果为 fallback 的返回值）、"error"（模型调用全部失败，结果同样来自 fallback）
+        或 "saturated"（在途调用已达 max_in_flight，没有发出请求，直接返回 fallback 的结果）。
+        """
+        start = time.perf_counter()
+        primary = self._start(call)
+        if primary is None:
+            return self._finish(fallback(), "saturated")
+        pending = {primary}
+        hedge_at = start + self.hedge_delay(deadline) if hedge else None
+        end = start + deadline
+        fallback_result = fallback()
+        result, outcome = fallback_result, "deadline"
+        while True:
+            wake = end if hedge_at is None else min(end, hedge_at)
+            done, pending = wait(pending, timeout=max(0.0, wake - time.perf_counter()),
+                                 return_when=FIRST_COMPLETED)
+            winner = next((f for f in done if f.exception() is None), None)
+            if winner is not None:
+                result, outcome = winner.result(), "model" if winner is primary else "hedged"
+                break
+            if not pending:
+                outcome = "error"
+                break
+            now = time.perf_counter()
+            if now >= end:
+                break
+            if hedge_at is not None and now >= hedge_at:
+                hedged = self._start(call)
+                if hedged is not None:
+                    pending.add(hedged)
+                hedge_at = None
+        return self._finish(result, outcome)
+
+    def _finish(self, result: Any, outcome: str) -> Tuple[Any, str]:
+        with self._lock:
+            self._stats[outcome] += 1
+        METRICS.inc("deadline_calls_total", pipeline=self.pipeline, outcome=outcome)
+        return result, outcome
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+        stats["p95_seconds"] = self.latency.quantile(0.95)
+        return stats
@@ -0,0 +1,166 @@
+"""
+LLM 抽取结果的本地持久化缓存（SQLite）
+
+说明：
+- 缓存键为 内容 + prompt + examples + model_id + extraction_passes 的 SHA-256 哈希（内容寻址），
+  任一因素变化都会得到新的键，不会读到过期结果。
+- 缓存值为 langextract 返回的 extractions（extraction_class / extraction_text / attributes），
+  命中时还原为带同名属性的轻量对象，下游的规范化/解析逻辑无需区分是否来自缓存。
+- 按条目数限制大小，超出后按最近访问时间淘汰（LRU）；条目数在内存中随写入/淘汰维护，写入时不做全表计数。
+- 读路径不提交事务：命中时的访问时间先记在内存里，攒满 TOUCH_FLUSH_EVERY 条、或下一次写入/统计/关闭时
+  再批量 UPDATE 并随同一次 commit 落盘（每次 commit 都要 fsync，逐条提交会让命中比未命中还慢）。
+  同时统计命中/未命中次数。
+- 内部加锁，可在 extract_metadata 的线程池并发模式下共享同一个实例。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Union
+
+from metrics import METRICS
+
+
+class ExtractionCache:
+    """基于 SQLite 的内容寻址 LRU 缓存"""
+
+    # 内存中累计多少条命中的访问时间后批量写回
+    TOUCH_FLUSH_EVERY = 1000
+
+    def __init__(self, path: str = ".langextract_cache.sqlite", max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 尚未写回的访问时间：key -> last_access
+        self._touched: Dict[str, float] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON extractions(last_access)")
+        self._conn.commit()
+        # 当前条目数：启动时统计一次，之后随写入/淘汰增减，写入时无需 COUNT(*) 全表计数
+        self._count = self._size()
+
+    # ------------------------------------------------------------------
+    # 键计算
+    # ------------------------------------------------------------------
+    @staticmethod
+    def config_fingerprint(prompt: str, examples, model_id: Optional[str], extraction_passes: Union[int, str]) -> str:
+        """
+        计算 prompt + examples + model_id + extraction_passes 的指纹。
+        examples 序列化开销较大，调用方应对同一配置只计算一次，再用 make_key 与每条内容组合。
+        extraction_passes 也可以是自适应轮数的标签（见 adaptive_passes.PassScheduler.label）。
+        """
+        payload = json.dumps(
+            {
+                "prompt": prompt,
+                "examples": examples,
+                "model_id": model_id or "default",
+                "extraction_passes": extraction_passes,
+            },
+            default=lambda o: getattr(o, "__dict__", str(o)),
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_key(fingerprint: str, content: str) -> str:
+        """将配置指纹与文档内容组合为最终缓存键"""
+        h = hashlib.sha256(fingerprint.encode("utf-8"))
+        h.update(b"\0")
+        h.update(content.encode("utf-8"))
+        return h.hexdigest()
+
+    # ------------------------------------------------------------------
+    # 读写
+    # ------------------------------------------------------------------
+    def get_extractions(self, key: str) -> Optional[List]:
+        """读取缓存的 extractions；未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                METRICS.inc("extraction_cache_requests_total", result="miss")
+                return None
+            self.hits += 1
+            METRICS.inc("extraction_cache_requests_total", result="hit")
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.TOUCH_FLUSH_EVERY:
+                self._flush_touched()
+                self._conn.commit()
+        return [SimpleNamespace(**item) for item in json.loads(row[0])]
+
+    def put_extractions(self, key: str, extractions) -> None:
+        """写入 extractions，必要时按 LRU 淘汰最旧的条目"""
+        value = json.dumps(
+            [
+                {
+                    "extraction_class": ex.extraction_class,
+                    "extraction_text": ex.extraction_text,
+                    "attributes": getattr(ex, "attributes", None) or {},
+                }
+                for ex in extractions
+            ],
+            ensure_ascii=False,
+        )
+        with self._lock:
+            # 先写回累计的访问时间，淘汰顺序才是准确的 LRU；与本次写入一起提交
+            self._flush_touched()
+            exists = self._conn.execute("SELECT 1 FROM extractions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, last_access) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            if exists is None:
+                self._count += 1
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                cursor = self._conn.execute(
+                    "DELETE FROM extractions WHERE key IN "
+                    "(SELECT key FROM extractions ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._count -= cursor.rowcount
+            self._conn.commit()
+
+    def _flush_touched(self) -> None:
+        """把内存中累计的访问时间写回表中（不提交，调用方需持有 _lock）"""
+        if self._touched:
+            self._conn.executemany("UPDATE extractions SET last_access = ? WHERE key = ?",
+                                   [(ts, key) for key, ts in self._touched.items()])
+            self._touched.clear()
+
+    def _size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+
+    def stats(self) -> Dict:
+        """返回命中/未命中计数与当前条目数（顺便按实际行数校正运行计数）"""
+        with self._lock:
+            if self._touched:
+                self._flush_touched()
+                self._conn.commit()
+            size = self._count = self._size()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
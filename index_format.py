@@ -0,0 +1,342 @@
+"""
+SmartVectorStore 的磁盘索引格式（版本化、mmap 加载）
+
+说明：
+- 一个索引是一个目录，manifest.json 记录格式名、版本号以及各部分的参数；其余文件都是扁平数组：
+  - 字符串表（*.str）：[条数 n][n+1 个 int64 偏移][UTF-8 拼接的内容]，文档内容、标题、词表等都用它
+  - 变长整数表（*.rag）：[行数 n][n+1 个 int64 偏移][int64 值]，倒排表的 postings 就是一行
+  - 整数均按本机字节序写入（manifest 中记录 byteorder，加载时校验）
+  - 倒排表 = 按字典序排好的 key 字符串表（*.keys.str）+ 对应的变长整数表（*.values.rag），查找用二分
+  - 向量/质心等数值矩阵用 numpy 的 .npy，以 mmap_mode='r' 打开
+- 加载时只做 mmap，不解析内容，打开耗时与索引大小无关；真正访问到的页才会被操作系统读入。
+- Layered* 容器：只读的 mmap 底座 + 内存中的增量，加载后的索引仍可以继续追加文档，
+  而无需先把整个底座读进内存。
+- 保存总是先写到同级临时目录，写完再整体换到目标路径（staged_directory）：
+  加载后的索引往往还 mmap 着目标目录里的文件，原地截断重写会破坏尚未读到的底座数据。
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import shutil
+import sys
+import uuid
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+FORMAT_NAME = "smart-vector-store"
+FORMAT_VERSION = 1
+
+_I64 = struct.Struct("=q")
+
+
+def open_mmap(path: str):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+# ----------------------------------------------------------------------
+# 字符串表
+# ----------------------------------------------------------------------
+def write_strings(path: str, strings: Iterable[str]):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = [0]
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+    with open(path, "wb") as f:
+        f.write(_I64.pack(len(encoded)))
+        f.write(array("q", offsets).tobytes())
+        for b in encoded:
+            f.write(b)
+
+
+class FrozenStrings(Sequence):
+    """mmap 上的只读字符串表，按需解码"""
+
+    def __init__(self, path: str):
+        self._buf = open_mmap(path)
+        self._n = _I64.unpack_from(self._buf, 0)[0]
+        self._offsets = self._buf[8:8 + 8 * (self._n + 1)].cast("q")
+        self._data = self._buf[8 + 8 * (self._n + 1):]
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+
+# ----------------------------------------------------------------------
+# 变长整数表
+# ----------------------------------------------------------------------
+def write_ragged(path: str, rows: Iterable[Sequence[int]]):
+    rows = list(rows)
+    offsets = [0]
+    for r in rows:
+        offsets.append(offsets[-1] + len(r))
+    with open(path, "wb") as f:
+        f.write(_I64.pack(len(rows)))
+        f.write(array("q", offsets).tobytes())
+        for r in rows:
+            f.write(array("q", r).tobytes())
+
+
+class FrozenRagged(Sequence):
+    """mmap 上的只读变长整数表；每行返回 int64 的 memoryview（零拷贝）"""
+
+    def __init__(self, path: str):
+        self._buf = open_mmap(path)
+        self._n = _I64.unpack_from(self._buf, 0)[0]
+        self._offsets = self._buf[8:8 + 8 * (self._n + 1)].cast("q")
+        self._values = self._buf[8 + 8 * (self._n + 1):].cast("q")
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i):
+        return self._values[self._offsets[i]:self._offsets[i + 1]]
+
+
+def write_ints(path: str, values: Iterable[int]):
+    write_ragged(path, [list(values)])
+
+
+def load_ints(path: str):
+    """读取 write_ints 写入的一维整数数组（memoryview）"""
+    return FrozenRagged(path)[0]
+
+
+# ----------------------------------------------------------------------
+# 倒排表
+# ----------------------------------------------------------------------
+def write_postings(prefix: str, postings):
+    keys = sorted(postings.keys())
+    write_strings(prefix + ".keys.str", keys)
+    write_ragged(prefix + ".values.rag", (postings[k] for k in keys))
+
+
+class FrozenPostings:
+    """只读倒排表：key 有序存放，二分查找；get 返回 int64 memoryview"""
+
+    def __init__(self, prefix: str):
+        self._keys = FrozenStrings(prefix + ".keys.str")
+        self._values = FrozenRagged(prefix + ".values.rag")
+
+    def _find(self, key: str) -> int:
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return -1
+
+    def get(self, key: str, default=None):
+        i = self._find(key)
+        return self._values[i] if i >= 0 else default
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(key) >= 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self._keys)
+
+
+# ----------------------------------------------------------------------
+# 底座 + 增量
+# ----------------------------------------------------------------------
+class LayeredList(Sequence):
+    """只读底座序列 + 内存追加部分；下标连续"""
+
+    def __init__(self, base: Optional[Sequence] = None):
+        self._base = base if base is not None else ()
+        self._delta: List = []
+
+    @property
+    def base(self) -> Sequence:
+        """只读底座（未加载底座时为空元组）"""
+        return self._base
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._delta)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        nb = len(self._base)
+        if i < 0:
+            i += len(self)
+        return self._base[i] if i < nb else self._delta[i - nb]
+
+    def append(self, value):
+        self._delta.append(value)
+
+    def __setitem__(self, i, value):
+        nb = len(self._base)
+        if i < nb:
+            raise TypeError("底座部分只读")
+        self._delta[i - nb] = value
+
+
+class LayeredPostings:
+    """
+    倒排表：只读底座（FrozenPostings）+ 内存增量（dict of list）。
+    doc id 单调追加，底座中的 id 总小于增量中的 id，拼接后仍保持有序。
+    """
+
+    def __init__(self, base: Optional[FrozenPostings] = None):
+        self._base = base
+        self._delta: Dict[str, List[int]] = {}
+
+    def get(self, key: str, default=()):
+        delta = self._delta.get(key)
+        base = self._base.get(key) if self._base is not None else None
+        if base is None:
+            return delta if delta is not None else default
+        if delta is None:
+            return base
+        return list(base) + delta
+
+    def append(self, key: str, value: int):
+        lst = self._delta.get(key)
+        if lst is None:
+            self._delta[key] = [value]
+        else:
+            lst.append(value)
+
+    def extend(self, key: str, values: Sequence[int]):
+        lst = self._delta.get(key)
+        if lst is None:
+            self._delta[key] = list(values)
+        else:
+            lst.extend(values)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._delta or (self._base is not None and key in self._base)
+
+    def keys(self) -> Iterator[str]:
+        if self._base is not None:
+            for k in self._base.keys():
+                yield k
+            for k in self._delta:
+                if k not in self._base:
+                    yield k
+        else:
+            yield from self._delta
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.keys())
+
+    def __getitem__(self, key: str):
+        value = self.get(key, None)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+
+# ----------------------------------------------------------------------
+# 目录替换
+# ----------------------------------------------------------------------
+@contextmanager
+def staged_directory(path: str):
+    """
+    在 path 的同级临时目录中写入，正常退出后再换到 path；出错则删除临时目录，原索引不受影响。
+    旧目录先改名再删除：已 mmap 的文件在 POSIX 上 unlink 后映射仍然有效，
+    所以正在使用旧索引的 store 可以把索引保存回自己加载的路径。
+    """
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tag = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    tmp = f"{path}.tmp-{tag}"
+    os.makedirs(tmp)
+    try:
+        yield tmp
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    old = None
+    if os.path.exists(path):
+        old = f"{path}.old-{tag}"
+        os.rename(path, old)
+    os.replace(tmp, path)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+# ----------------------------------------------------------------------
+# manifest
+# ----------------------------------------------------------------------
+def write_manifest(path: str, manifest: Dict):
+    manifest = dict(manifest, format=FORMAT_NAME, version=FORMAT_VERSION, byteorder=sys.byteorder)
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def read_manifest(path: str) -> Dict:
+    with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_NAME:
+        raise ValueError(f"不是 SmartVectorStore 索引目录: {path}")
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"不支持的索引格式版本 {manifest.get('version')}（当前支持 {FORMAT_VERSION}）")
+    if manifest.get("byteorder") != sys.byteorder:
+        raise ValueError(f"索引字节序为 {manifest.get('byteorder')}，与本机 {sys.byteorder} 不一致")
+    return manifest
+
+
+# ----------------------------------------------------------------------
+# 文档
+# ----------------------------------------------------------------------
+_DOC_FIELDS = ("id", "title", "content", "metadata")
+
+
+def write_documents(path: str, docs: Sequence[Dict]):
+    """文档拆成 id(JSON) / title / content / metadata(JSON) 四个字符串表；
+    其余字段（如 chunk 的 parent_id / offset）以 JSON 写入 docs.extra.str"""
+    write_strings(os.path.join(path, "docs.ids.str"), (json.dumps(d["id"], ensure_ascii=False) for d in docs))
+    write_strings(os.path.join(path, "docs.titles.str"), (d.get("title", "") for d in docs))
+    write_strings(os.path.join(path, "docs.content.str"), (d["content"] for d in docs))
+    write_strings(os.path.join(path, "docs.metadata.str"),
+                  (json.dumps(d.get("metadata", {}), ensure_ascii=False) for d in docs))
+    write_strings(os.path.join(path, "docs.extra.str"),
+                  (json.dumps({k: v for k, v in d.items() if k not in _DOC_FIELDS}, ensure_ascii=False)
+                   for d in docs))
+
+
+class FrozenDocuments(Sequence):
+    """按需从 mmap 字符串表还原文档 dict（不缓存，避免常驻内存）"""
+
+    def __init__(self, path: str):
+        self.ids = FrozenStrings(os.path.join(path, "docs.ids.str"))
+        self.titles = FrozenStrings(os.path.join(path, "docs.titles.str"))
+        self.contents = FrozenStrings(os.path.join(path, "docs.content.str"))
+        self.metadata = FrozenStrings(os.path.join(path, "docs.metadata.str"))
+        extra = os.path.join(path, "docs.extra.str")
+        self.extra = FrozenStrings(extra) if os.path.exists(extra) else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        doc = {
+            "id": json.loads(self.ids[i]),
+            "title": self.titles[i],
+            "content": self.contents[i],
+            "metadata": json.loads(self.metadata[i]),
+        }
+        if self.extra is not None:
+            doc.update(json.loads(self.extra[i]))
+        return doc
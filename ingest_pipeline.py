@@ -0,0 +1,270 @@
+"""
+流式入库流水线：读取 JSONL -> 抽取元数据/三元组 -> 索引
+
+说明：
+- 读取、抽取、索引三个阶段并行运行，阶段之间用有界队列（queue.Queue(maxsize)）连接，
+  数据以批（batch）为单位流转；抽取阶段可开多个工作线程（LLM 调用以等待网络为主），与索引阶段重叠执行。
+- 背压：读取端每送出一批先占用一个"在途批次"名额，索引端处理完一批才归还。名额用完时读取端阻塞，
+  因此流水线中同时存在的文档数不超过 (max_in_flight + 1) × batch_size（含读取端正在凑的一批），与输入文件大小无关
+  （SmartVectorStore 本身的索引内存除外）。
+- ordered=True（默认）时按输入顺序交给索引阶段：先完成的批次在重排缓冲中等待，缓冲大小同样受在途名额约束。
+- 任一阶段抛出异常时整条流水线停止，run() 重新抛出该异常。
+- 抽取函数以批为参数，FixedLangExtractProcessor.extract_metadata / EnhancedOpinionExtractorV7.extract_triples
+  都可直接传入；索引函数可用 SmartVectorStore.upsert，或 JsonlWriter 把结果写成 JSONL。
+
+命令行：
+    python ingest_pipeline.py reviews.jsonl --out ./review_index            # 中文点评：切块 + 抽取元数据 + 建索引并保存
+    python ingest_pipeline.py docs.jsonl --lang en --out ./doc_index        # 英文技术文档
+    python ingest_pipeline.py reviews.jsonl --triples triples.jsonl         # 抽取观点三元组并写入 JSONL
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+_DONE = object()
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    """逐行读取 JSONL，跳过空行；不会一次性读入整个文件"""
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"⚠️  跳过第 {lineno} 行（不是合法 JSON）: {e}")
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class JsonlWriter:
+    """把每批结果追加写入 JSONL 文件的 sink；可作为上下文管理器使用"""
+
+    def __init__(self, path: str):
+        self._f = open(path, "w", encoding="utf-8")
+
+    def __call__(self, items: List):
+        for item in items:
+            self._f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class IngestPipeline:
+    """
+    读取 -> 抽取 -> 索引 的三段式流水线。
+
+    - extract(batch) -> results：抽取一批文档
+    - sink(results)：索引/写出一批结果（只在一个线程中调用）
+    - expand(doc) -> docs：可选，在抽取前把一篇文档展开为多篇（如 chunking.chunk_documents 切块）
+    """
+
+    def __init__(self, extract: Callable[[List[Dict]], List], sink: Callable[[List], Any],
+                 workers: int = 4, batch_size: int = 32, queue_size: int = 8,
+                 max_in_flight: Optional[int] = None, ordered: bool = True,
+                 expand: Optional[Callable[[Dict], Iterable[Dict]]] = None):
+        self.extract = extract
+        self.sink = sink
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        # 默认让每个工作线程手上一批、两段队列各自排满
+        self.max_in_flight = max_in_flight or (self.workers + 2 * queue_size)
+        self.ordered = ordered
+        self.expand = expand
+        self.stats: Dict[str, Any] = {}
+
+    # ------------------------------------------------------------------
+    # 可中断的阻塞操作：任一阶段出错后，其余阶段不会永远卡在队列/名额上
+    # ------------------------------------------------------------------
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _acquire_slot(self) -> bool:
+        while not self._stop.is_set():
+            if self._slots.acquire(timeout=0.1):
+                return True
+        return False
+
+    def _fail(self, exc: BaseException):
+        if self._error is None:
+            self._error = exc
+        self._stop.set()
+
+    # ------------------------------------------------------------------
+    # 各阶段
+    # ------------------------------------------------------------------
+    def _read(self, source: Iterable[Dict]):
+        try:
+            docs = source
+            if self.expand is not None:
+                docs = (item for doc in source for item in self.expand(doc))
+            for seq, batch in enumerate(batched(docs, self.batch_size)):
+                if not self._acquire_slot() or not self._put(self._extract_q, (seq, batch)):
+                    return
+                self.stats["read"] += len(batch)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for _ in range(self.workers):
+                self._put(self._extract_q, _DONE)
+
+    def _work(self):
+        try:
+            while True:
+                item = self._get(self._extract_q)
+                if item is _DONE:
+                    return
+                seq, batch = item
+                if not self._put(self._index_q, (seq, self.extract(batch))):
+                    return
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(self._index_q, _DONE)
+
+    def _index(self):
+        pending: Dict[int, List] = {}
+        next_seq = 0
+        finished = 0
+        while finished < self.workers:
+            item = self._get(self._index_q)
+            if item is _DONE:
+                if self._stop.is_set():
+                    return
+                finished += 1
+                continue
+            seq, results = item
+            if not self.ordered:
+                self._emit(results)
+                continue
+            pending[seq] = results
+            while next_seq in pending:
+                self._emit(pending.pop(next_seq))
+                next_seq += 1
+
+    def _emit(self, results: List):
+        self.sink(results)
+        self.stats["indexed"] += len(results)
+        self.stats["batches"] += 1
+        self._slots.release()
+
+    def run(self, source: Iterable[Dict]) -> Dict[str, Any]:
+        """运行流水线直到 source 耗尽；返回统计信息"""
+        self._extract_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._index_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._slots = threading.Semaphore(self.max_in_flight)
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self.stats = {"read": 0, "indexed": 0, "batches": 0}
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._read, args=(source,), daemon=True)]
+        threads += [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+        # 索引阶段在调用线程中执行，sink 无需线程安全
+        try:
+            self._index()
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join()
+        if self._error is not None:
+            raise self._error
+
+        elapsed = time.perf_counter() - start
+        self.stats["seconds"] = elapsed
+        self.stats["docs_per_sec"] = self.stats["indexed"] / elapsed if elapsed else 0.0
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式读取 JSONL，抽取元数据/三元组并建立索引")
+    parser.add_argument("input", help="JSONL 文件，每行一个 {id, title, content} 文档")
+    parser.add_argument("--lang", choices=["cn", "en"], default="cn", help="cn：中文点评；en：英文技术文档")
+    parser.add_argument("--out", help="索引保存目录（SmartVectorStore.save）")
+    parser.add_argument("--triples", help="改为抽取观点三元组，写入该 JSONL 文件")
+    parser.add_argument("--api-key", default=os.getenv("QWEN_API_KEY"),
+                        help="--triples 使用的 Qwen API key（默认读取 QWEN_API_KEY；未提供时只用回退规则）")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--queue-size", type=int, default=8)
+    args = parser.parse_args()
+
+    from chunking import chunk_documents, chunk_markdown, chunk_sentences
+
+    if args.triples:
+        from langextract_opinion_extraction import EnhancedOpinionExtractorV7
+
+        if args.api_key:
+            extractor = EnhancedOpinionExtractorV7(qwen_apikey=args.api_key)
+        else:
+            # 构造函数要求非空 key：离线时用占位 key，并直接关闭模型调用，全部走回退规则
+            print("⚠️ 未提供 --api-key / QWEN_API_KEY，三元组全部使用回退规则抽取")
+            extractor = EnhancedOpinionExtractorV7(qwen_apikey="sk-offline")
+            extractor.use_langextract = False
+        with JsonlWriter(args.triples) as sink:
+            pipeline = IngestPipeline(extractor.extract_triples, sink, workers=args.workers,
+                                      batch_size=args.batch_size, queue_size=args.queue_size)
+            stats = pipeline.run(read_jsonl(args.input))
+    else:
+        if args.lang == "cn":
+            import langextract_rag_cn as rag
+            chunker = chunk_sentences
+        else:
+            import langextract_rag as rag
+            chunker = chunk_markdown
+        extractor = rag.FixedLangExtractProcessor()
+        store = rag.SmartVectorStore()
+        pipeline = IngestPipeline(extractor.extract_metadata, store.upsert, workers=args.workers,
+                                  batch_size=args.batch_size, queue_size=args.queue_size,
+                                  expand=lambda doc: chunk_documents([doc], chunker))
+        stats = pipeline.run(read_jsonl(args.input))
+        if args.out:
+            store.save(args.out)
+
+    print(f"📦 已处理 {stats['indexed']} 条，耗时 {stats['seconds']:.1f}s（{stats['docs_per_sec']:.1f} 条/秒）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Aho-Corasick 多模式匹配自动机
+
+说明：
+- 把任意多个关键词编译成一个自动机，对文本只扫描一遍即可找出全部关键词的全部出现位置（含相互重叠的情况），
+  耗时与 文本长度 + 命中次数 成正比，与关键词个数无关。
+- 构建：先建字典树（trie），再按 BFS 计算失配指针（fail），并把失配链上的输出合并到每个状态，
+  查询时每个字符最多沿失配链回退，均摊 O(1)。
+- 用于 EnhancedOpinionExtractorV7 的回退抽取：子维度关键词、情感词、否定词、程度词共用一个自动机。
+"""
+
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+class AhoCorasick:
+    """关键词集合 -> 自动机；iter(text) 依次给出 (起始下标, 结束下标, 关键词)，按结束位置升序"""
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[str, ...]] = [()]
+        for kw in dict.fromkeys(keywords):
+            if kw:
+                self._insert(kw)
+        self._build_fail()
+
+    def _insert(self, kw: str):
+        state = 0
+        for ch in kw:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] += (kw,)
+
+    def _build_fail(self):
+        goto, fail, out = self._goto, self._fail, self._out
+        q = deque(goto[0].values())
+        while q:
+            state = q.popleft()
+            for ch, nxt in goto[state].items():
+                q.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                # 失配链上的关键词也在此处结束（后缀匹配）
+                out[nxt] += out[fail[nxt]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for kw in out[state]:
+                yield i + 1 - len(kw), i + 1, kw
+
+    def first_positions(self, text: str) -> Dict[str, int]:
+        """每个出现过的关键词 -> 首次出现的起始下标（等价于 text.find(kw)）"""
+        first: Dict[str, int] = {}
+        for start, _, kw in self.iter(text):
+            if kw not in first:
+                first[kw] = start
+        return first
@@ -2,8 +2,9 @@
 增强版情感观点三元组抽取器（v7）
 
 说明：
-- 将 Qwen/OpenAI 兼容模型的构建移动到 __init__ 中，构建后的模型实例保存在 self.model（可为 None）。
-- 构造时仍然要求提供 qwen_apikey（示例：'sk-xxxx'），以便尽量在初始化阶段就准备好远程模型。
+- Qwen/OpenAI 兼容模型通过 model_providers 注册表在第一次访问 self.model 时构建（构建失败时为 None），
+  examples 也在第一次调用模型时才构建；导入模块与构造抽取器都不加载 langextract。
+- 构造时仍然要求提供 qwen_apikey（示例：'sk-xxxx'）。
 - 如果 langextract 或 OpenAILanguageModel 提供器缺失，依然支持回退启发式抽取。
 - 注释全部为中文，代码结构较 v6 更加简洁明确。
 
@@ -12,23 +13,28 @@
 import os
 import json
 import re
-from typing import List, Dict, Optional
-
-# 尝试导入 langextract（优先使用）
-try:
-    import langextract as lx  # type: ignore
-    LANGEXTRACT_AVAILABLE = True
-except Exception:
-    lx = None
-    LANGEXTRACT_AVAILABLE = False
-
-# 尝试导入 OpenAILanguageModel（用于 Qwen 兼容调用）
-try:
-    from langextract.providers.openai import OpenAILanguageModel  # type: ignore
-    OPENAI_LM_AVAILABLE = True
-except Exception:
-    OpenAILanguageModel = None  # type: ignore
-    OPENAI_LM_AVAILABLE = False
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from types import SimpleNamespace
+from typing import AsyncIterator, Iterable, Iterator, List, Dict, Optional
+
+from adaptive_passes import PassScheduler
+from deadline_calls import DeadlineCaller
+from extraction_cache import ExtractionCache
+from keyword_automaton import AhoCorasick
+from metrics import METRICS
+from review_packing import PACK_INSTRUCTION, ReviewPacker, request_overhead
+from tiered_extraction import ConfidenceRouter
+from model_gateway import ModelGateway, shared_gateway
+from model_providers import get_model, langextract_available, load_langextract
+
+# langextract 与模型提供器都按需加载：导入本模块时只检查 langextract 是否安装
+# （构造抽取器时会重新检查，以便 model_providers.set_langextract 设置的替身生效）
+LANGEXTRACT_AVAILABLE = langextract_available()
 
 # 子维度关键词字典（回退使用）
 SUBASPECT_KEYWORDS = {
@@ -78,15 +84,19 @@ class EnhancedOpinionExtractorV7:
     情感观点三元组抽取器（v7）
 
     主要变化：
-    - 在 __init__ 中尝试构建 Qwen 兼容的模型实例，并将其放入 self.model。
+    - Qwen 兼容的模型实例在第一次访问 self.model 时构建（model_providers 注册表），构造抽取器很轻量。
     - 提供简洁的 langextract 调用封装 _call_langextract，解析函数 _parse_extractions，回退函数 _fallback_extract。
     - extract_triples 使用 self.model（若存在且 use_qwen_model=True）进行抽取，并打印每条文本使用了模型还是回退规则。
     """
 
-    def __init__(self, qwen_apikey: str,model_id = 'qwen-turbo'):
+    def __init__(self, qwen_apikey: str,model_id: Optional[str] = None, cache: Optional[ExtractionCache] = None,
+                 gateway: Optional[ModelGateway] = None):
         """
         初始化抽取器，必须传入 qwen_apikey（示例：'sk-xxxx'）。
-        在构造函数中尝试构建 Qwen 模型并保存到 self.model；若无法构建，self.model 为 None。
+        Qwen 模型在第一次访问 self.model 时构建；若无法构建，self.model 为 None。
+        model_id 缺省时取环境变量 QWEN_MODEL_ID，再缺省为 qwen-turbo（见 model_providers.py）。
+        cache 为可选的 ExtractionCache，传入后 _call_langextract 会优先读取缓存。
+        gateway 为模型调用网关（限流/重试/熔断，见 model_gateway.py），缺省与其他抽取器共用同一个。
         """
         if not qwen_apikey or not isinstance(qwen_apikey, str):
             raise ValueError("必须提供 qwen_apikey，示例：'sk-xxxx'")
@@ -94,40 +104,77 @@ class EnhancedOpinionExtractorV7:
         # 保存 qwen api key
         self.qwen_apikey = qwen_apikey
 
+        # LLM 抽取结果缓存；配置指纹（prompt + examples + 模型 + passes）按需计算一次
+        self.cache = cache
+        self._cache_fingerprints = {}
+        self.gateway = gateway or shared_gateway()
+
+        # 自适应轮数：第一轮已抽到观点就不再补跑（adaptive_passes=False 时按 extraction_passes 固定轮数调用）
+        self.adaptive_passes = True
+        self.passes = PassScheduler(is_complete=lambda extractions: len(extractions) > 0, pipeline="opinion")
+        # 分级抽取（extract_triples 的 route_threshold）的分流统计
+        self.router = ConfidenceRouter(pipeline="opinion")
+        # 交互式抽取（extract_with_deadline）的截止时间 / 对冲调用器，记录模型调用耗时的 p95
+        self.deadline_caller = DeadlineCaller(pipeline="opinion")
+
         # 初始化回退资源（无论是否安装 langextract 都需要）
-        self.subaspect_keywords = SUBASPECT_KEYWORDS
-        self.pos_words = POS_WORDS
-        self.neg_words = NEG_WORDS
-        self.negation_words = NEGATION_WORDS
-        self.degree_words = DEGREE_WORDS
+        self._init_fallback((SUBASPECT_KEYWORDS, POS_WORDS, NEG_WORDS, NEGATION_WORDS, DEGREE_WORDS))
 
         # langextract 是否可用（仅表示库可用，模型是否传入另当别论）
-        self.use_langextract = LANGEXTRACT_AVAILABLE
-
-        # 如果 langextract 可用，准备示例和 prompt（示例用于模型抽取时参考）
-        if self.use_langextract:
-            self.lx = lx
+        self.use_langextract = langextract_available()
+        self.prompt = self._build_prompt()
+
+        # examples 与 Qwen/OpenAI 兼容模型都在第一次用到时构建（见 examples / model 属性）
+        self.model_id = model_id
+        self._examples = None
+        self._model = None
+        self._model_ready = False
+        self._model_lock = threading.Lock()
+
+    @classmethod
+    def from_lexicons(cls, lexicons: tuple) -> "EnhancedOpinionExtractorV7":
+        """
+        只具备规则回退抽取能力的抽取器：不需要 api key，不构建模型。
+        供 extract_triples_bulk 的工作进程使用；lexicons 的顺序同 self.lexicons。
+        """
+        extractor = cls.__new__(cls)
+        extractor._init_fallback(lexicons)
+        return extractor
+
+    @property
+    def lexicons(self) -> tuple:
+        """回退词典：(子维度关键词, 正面词, 负面词, 否定词, 程度词)"""
+        return (self.subaspect_keywords, self.pos_words, self.neg_words, self.negation_words, self.degree_words)
+
+    @property
+    def lx(self):
+        return load_langextract() if self.use_langextract else None
+
+    @property
+    def examples(self):
+        """few-shot 示例，第一次用到时构建；构建失败时为 None"""
+        if self._examples is None and self.use_langextract:
             try:
-                self.examples = self._build_examples()
+                self._examples = self._build_examples()
             except Exception:
-                self.examples = None
-            self.prompt = self._build_prompt()
-        else:
-            self.lx = None
-            self.examples = None
-            self.prompt = self._build_prompt()
-
-        # 在初始化阶段尝试构建 Qwen/OpenAI 兼容模型并赋值给 self.model
-        self.model = None
-        if OPENAI_LM_AVAILABLE:
-            try:
-                self.model = self._build_qwen_model(apikey=self.qwen_apikey,model_id = model_id)
-                print("✅ 已在 __init__ 中构建 Qwen/OpenAI 兼容模型，并保存到 self.model")
-            except Exception as e:
-                self.model = None
-                print(f"⚠️ 在 __init__ 构建 Qwen 模型失败：{e}，后续抽取将回退或使用 langextract 默认模型")
-        else:
-            print("⚠️ 未检测到 langextract.providers.openai.OpenAILanguageModel，无法构建 Qwen 模型（self.model=None）")
+                self._examples = None
+        return self._examples
+
+    @property
+    def model(self):
+        """Qwen/OpenAI 兼容模型，第一次访问时通过 model_providers 构建；无法构建时为 None"""
+        if not self._model_ready:
+            # 加锁构建：并发调用方在构建完成前不能看到 None（否则会以 model=None 调用 langextract 的默认模型）
+            with self._model_lock:
+                if not self._model_ready:
+                    try:
+                        self._model = self._build_qwen_model(apikey=self.qwen_apikey, model_id=self.model_id)
+                        print("✅ 已构建 Qwen/OpenAI 兼容模型（self.model）")
+                    except Exception as e:
+                        self._model = None
+                        print(f"⚠️ 构建 Qwen 模型失败：{e}，后续抽取将回退或使用 langextract 默认模型")
+                    self._model_ready = True
+        return self._model
 
     # 以下为内部方法：构建 prompt、构建 examples、构建 model、调用模型、解析结果与回退抽取
     def _build_prompt(self) -> str:
@@ -360,39 +407,63 @@ class EnhancedOpinionExtractorV7:
         # 返回完整示例集合
         return exs
 
-    def _build_qwen_model(self, apikey: Optional[str] = None,model_id = "qwen-turbo"):
+    def _build_qwen_model(self, apikey: Optional[str] = None,model_id: Optional[str] = None):
         """
         构建 Qwen/OpenAI 兼容的模型实例，返回可传入 lx.extract 的 model 对象。
         若无法构建则抛出异常。
         """
-        if not OPENAI_LM_AVAILABLE:
-            raise RuntimeError("缺少 OpenAILanguageModel 提供器，请安装 langextract.providers.openai")
         key = apikey or self.qwen_apikey
         if not key:
             raise RuntimeError("未提供 qwen_apikey")
-        model = OpenAILanguageModel(
-            model_id=os.getenv("QWEN_MODEL_ID", model_id),
-            base_url=os.getenv("QWEN_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
-            api_key=key
-        )
-        return model
+        return get_model("qwen", model_id=model_id, api_key=key)
 
     def _call_langextract(self, content: str, model=None, extraction_passes: int = 2):
         """
         对单条文本调用 langextract.extract，传入准备好的 prompt、examples 与可选 model。
         返回 langextract 的结果对象；若调用失败会抛出异常，由上层处理回退。
+        extraction_passes 为最多轮数；self.adaptive_passes 开启时先抽一轮，没有结果才补跑（见 adaptive_passes.py）。
         """
         if not self.use_langextract:
             raise RuntimeError("当前环境未安装 langextract")
-        res = self.lx.extract(
-            text_or_documents=content,
-            prompt_description=self.prompt,
-            examples=self.examples,
-            model=model,
-            extraction_passes=extraction_passes
-        )
+        key = self._cache_key(content, model, extraction_passes)
+        if key is not None:
+            cached = self.cache.get_extractions(key)
+            if cached is not None:
+                return SimpleNamespace(extractions=cached)
+        return self._run_langextract(content, model, extraction_passes, key)
+
+    def _run_langextract(self, content: str, model, extraction_passes: int, key: Optional[str]):
+        """实际调用模型（不查缓存），key 不为 None 时把结果写入缓存"""
+        adaptive = self.adaptive_passes and extraction_passes > 1
+        extract_once = partial(self.gateway.call, self.lx.extract, text_or_documents=content,
+                               prompt_description=self.prompt, examples=self.examples, model=model)
+        if adaptive:
+            # 先抽一轮，没有抽到观点时才补跑，最多 extraction_passes 轮
+            res = SimpleNamespace(extractions=self.passes.run(
+                lambda: extract_once(extraction_passes=1).extractions, extraction_passes))
+        else:
+            res = extract_once(extraction_passes=extraction_passes)
+        if key is not None:
+            self.cache.put_extractions(key, res.extractions)
         return res
 
+    def _cache_key(self, content: str, model, extraction_passes: int) -> Optional[str]:
+        """_call_langextract 使用的缓存键；未配置缓存时为 None"""
+        if self.cache is None:
+            return None
+        adaptive = self.adaptive_passes and extraction_passes > 1
+        passes_config = self.passes.label(extraction_passes) if adaptive else extraction_passes
+        return self.cache.make_key(self._cache_fingerprint(model, passes_config), content)
+
+    def _cache_fingerprint(self, model, extraction_passes) -> str:
+        """缓存配置指纹：同一 (model_id, extraction_passes) 只序列化一次 prompt 与 examples"""
+        model_id = getattr(model, "model_id", None)
+        fp_key = (model_id, extraction_passes)
+        if fp_key not in self._cache_fingerprints:
+            self._cache_fingerprints[fp_key] = self.cache.config_fingerprint(
+                self.prompt, self.examples, model_id, extraction_passes)
+        return self._cache_fingerprints[fp_key]
+
     def _parse_extractions(self, extractions) -> List[Dict]:
         """
         解析 langextract 返回的 Extraction 列表，将 extraction_text 中的 JSON 转为标准三元组字典。
@@ -424,6 +495,57 @@ class EnhancedOpinionExtractorV7:
                 continue
         return parsed
 
+    def _init_fallback(self, lexicons: tuple):
+        """回退抽取（_fallback_extract）依赖的全部状态在此初始化，__init__ 与 from_lexicons 共用"""
+        (self.subaspect_keywords, self.pos_words, self.neg_words,
+         self.negation_words, self.degree_words) = lexicons
+        self._build_lexicon_automaton()
+
+    def _build_lexicon_automaton(self):
+        """
+        把子维度关键词、情感词、否定词、程度词编译进同一个 Aho-Corasick 自动机，回退抽取时每句只扫描一遍。
+        每个词对应一组标签；词典中重复出现的词保留多个标签，计数结果与逐词 `kw in sent` 判断一致。
+        """
+        tags: Dict[str, List[tuple]] = {}
+        rank = 0
+        for asp, submap in self.subaspect_keywords.items():
+            for sub, kws in submap.items():
+                for kw in kws:
+                    # rank 为关键词在词典中的先后次序，用于确定 opinion 截取所围绕的关键词
+                    tags.setdefault(kw, []).append(("aspect", asp, sub, rank))
+                    rank += 1
+        for kind, words in (("pos", self.pos_words), ("neg", self.neg_words),
+                            ("negation", self.negation_words), ("degree", self.degree_words)):
+            for w in words:
+                tags.setdefault(w, []).append((kind,))
+        self._lexicon_tags = tags
+        self._negation_set = set(self.negation_words)
+        self._automaton = AhoCorasick(tags)
+
+    def _scan_lexicons(self, text: str):
+        """扫描一遍文本：返回 各词典词首次出现的位置（同 text.find），以及全部否定词出现的 (起, 止) 区间"""
+        first: Dict[str, int] = {}
+        negations = []
+        for start, end, kw in self._automaton.iter(text):
+            if kw not in first:
+                first[kw] = start
+            if kw in self._negation_set:
+                negations.append((start, end))
+        return first, negations
+
+    def _best_subaspect(self, sub_counts: Dict[tuple, int], aspect_hint: Optional[str] = None) -> str:
+        """按命中关键词数选出 sub_aspect（计数相同时取词典中靠前的）；优先在 aspect_hint 下选"""
+        if aspect_hint and aspect_hint in self.subaspect_keywords:
+            candidates = [(sub, sub_counts[(aspect_hint, sub)]) for sub in self.subaspect_keywords[aspect_hint]
+                          if (aspect_hint, sub) in sub_counts]
+            if candidates:
+                return max(candidates, key=lambda x: x[1])[0]
+        candidates = [(sub, sub_counts[(asp, sub)]) for asp, submap in self.subaspect_keywords.items()
+                      for sub in submap if (asp, sub) in sub_counts]
+        if candidates:
+            return max(candidates, key=lambda x: x[1])[0]
+        return ""
+
     def _infer_subaspect_from_text(self, text: str, aspect_hint: Optional[str] = None) -> str:
         """
         基于子维度关键词字典尝试从文本推断出最可能的 sub_aspect。
@@ -431,25 +553,13 @@ class EnhancedOpinionExtractorV7:
         """
         if not text:
             return ""
-        candidates = []
-        if aspect_hint and aspect_hint in self.subaspect_keywords:
-            submap = self.subaspect_keywords[aspect_hint]
-            for sub, kws in submap.items():
-                cnt = sum(1 for kw in kws if kw in text)
-                if cnt > 0:
-                    candidates.append((sub, cnt))
-            if candidates:
-                candidates.sort(key=lambda x: x[1], reverse=True)
-                return candidates[0][0]
-        for asp, submap in self.subaspect_keywords.items():
-            for sub, kws in submap.items():
-                cnt = sum(1 for kw in kws if kw in text)
-                if cnt > 0:
-                    candidates.append((sub, cnt))
-        if candidates:
-            candidates.sort(key=lambda x: x[1], reverse=True)
-            return candidates[0][0]
-        return ""
+        sub_counts: Dict[tuple, int] = {}
+        for kw in self._automaton.first_positions(text):
+            for tag in self._lexicon_tags[kw]:
+                if tag[0] == "aspect":
+                    key = (tag[1], tag[2])
+                    sub_counts[key] = sub_counts.get(key, 0) + 1
+        return self._best_subaspect(sub_counts, aspect_hint)
 
     def _fallback_extract(self, content: str) -> List[Dict]:
         """
@@ -458,6 +568,7 @@ class EnhancedOpinionExtractorV7:
         - 基于子维度关键词检测所属大类
         - 基于词典进行情感打分（包含否定处理与程度词放大）
         - 尝试推断 sub_aspect 并截取关键词附近短片段作为 opinion
+        每句只用 Aho-Corasick 自动机扫描一遍，上述判断都基于这一次扫描得到的命中位置。
         """
         triples = []
         sents = re.split(r'[。\n！？!?]+', content)
@@ -465,34 +576,38 @@ class EnhancedOpinionExtractorV7:
             sent = sent.strip()
             if not sent:
                 continue
-            found_aspects = set()
-            for asp, submap in self.subaspect_keywords.items():
-                for sub, subkws in submap.items():
-                    for kw in subkws:
-                        if kw in sent:
-                            found_aspects.add(asp)
-                            break
-            if not found_aspects:
-                continue
-
-            pos = sum(1 for w in self.pos_words if w in sent)
-            neg = sum(1 for w in self.neg_words if w in sent)
+            first, negations = self._scan_lexicons(sent)
 
             def neg_near(word):
-                idx = sent.find(word)
-                if idx == -1:
-                    return False
+                # 词首次出现位置之前 3 个字符内是否完整包含否定词
+                idx = first[word]
                 start = max(0, idx - 3)
-                return any(nw in sent[start:idx] for nw in self.negation_words)
-
-            for pw in self.pos_words:
-                if pw in sent and neg_near(pw):
-                    pos -= 1
-            for nw in self.neg_words:
-                if nw in sent and neg_near(nw):
-                    neg -= 1
+                return any(s >= start and e <= idx for s, e in negations)
+
+            sub_counts: Dict[tuple, int] = {}
+            first_kw: Dict[str, tuple] = {}
+            pos = neg = 0
+            has_degree = False
+            for kw in first:
+                for tag in self._lexicon_tags[kw]:
+                    kind = tag[0]
+                    if kind == "aspect":
+                        _, asp, sub, rank = tag
+                        sub_counts[(asp, sub)] = sub_counts.get((asp, sub), 0) + 1
+                        if asp not in first_kw or rank < first_kw[asp][0]:
+                            first_kw[asp] = (rank, kw)
+                    elif kind == "pos":
+                        if not neg_near(kw):
+                            pos += 1
+                    elif kind == "neg":
+                        if not neg_near(kw):
+                            neg += 1
+                    elif kind == "degree":
+                        has_degree = True
+            if not first_kw:
+                continue
 
-            if any(d in sent for d in self.degree_words):
+            if has_degree:
                 pos *= 2
 
             if pos > neg:
@@ -502,22 +617,15 @@ class EnhancedOpinionExtractorV7:
             else:
                 sentiment = "neutral"
 
-            for asp in found_aspects:
-                sub = self._infer_subaspect_from_text(sent, asp)
-                opinion = sent
-                first_kw = None
-                for subkws in self.subaspect_keywords.get(asp, {}).values():
-                    for kw in subkws:
-                        if kw in sent:
-                            first_kw = kw
-                            break
-                    if first_kw:
-                        break
-                if first_kw:
-                    idx = sent.find(first_kw)
-                    start = max(0, idx - 12)
-                    end = min(len(sent), idx + len(first_kw) + 12)
-                    opinion = sent[start:end].strip()
+            for asp in self.subaspect_keywords:
+                if asp not in first_kw:
+                    continue
+                sub = self._best_subaspect(sub_counts, asp)
+                kw = first_kw[asp][1]
+                idx = first[kw]
+                start = max(0, idx - 12)
+                end = min(len(sent), idx + len(kw) + 12)
+                opinion = sent[start:end].strip()
                 triples.append({
                     "aspect": asp,
                     "sub_aspect": sub or "",
@@ -526,41 +634,307 @@ class EnhancedOpinionExtractorV7:
                 })
         return triples
 
-    def extract_triples(self, documents: List[Dict], use_qwen_model: bool = True) -> List[Dict]:
+    def extract_triples(self, documents: List[Dict], use_qwen_model: bool = True,
+                        pack_tokens: Optional[int] = None, route_threshold: Optional[float] = None) -> List[Dict]:
         """
         对文档列表执行三元组抽取。
         - use_qwen_model=True 时，如果 self.model 存在则把 self.model 传入 langextract（否则使用 langextract 默认模型或回退）
+        - pack_tokens 不为 None 时启用打包模式：多条短评按该 token 预算合并为一次请求（见 review_packing.py）
+        - route_threshold 不为 None 时先跑回退规则，只有置信度低于阈值的文档才调用模型（见 tiered_extraction.py）
         - 返回每条文档：{"id": doc_id, "triples": [...], "used_model": True/False}
         - 同时在控制台打印每条文本使用模型还是回退规则
         """
-        results = []
-        for doc in documents:
+        if route_threshold is not None and self.use_langextract:
+            return self._extract_triples_tiered(list(documents), use_qwen_model, pack_tokens, route_threshold)
+        if pack_tokens and self.use_langextract:
+            return self._extract_triples_packed(list(documents), use_qwen_model, pack_tokens)
+        return [self._extract_doc(doc, use_qwen_model) for doc in documents]
+
+    def _extract_doc(self, doc: Dict, use_qwen_model: bool) -> Dict:
+        """单条文档的同步抽取，格式同 extract_triples 的每条结果"""
+        start = time.perf_counter()
+        used_model_flag = False
+        triples = []
+        if self.use_langextract:
+            try:
+                # 若用户希望使用 qwen 模型且 self.model 已构建，则传入 self.model
+                model_to_use = self.model if use_qwen_model and self.model else None
+                res = self._call_langextract(doc["content"], model=model_to_use, extraction_passes=2)
+                triples = self._parse_extractions(res.extractions)
+                used_model_flag = True if model_to_use else False
+            except Exception as e:
+                # 调用失败则使用回退逻辑
+                triples = self._fallback_extract(doc.get("content", ""))
+                used_model_flag = False
+                print("调用失败则使用回退逻辑",e)
+        else:
+            # langextract 不可用，全部使用回退
+            triples = self._fallback_extract(doc.get("content", ""))
             used_model_flag = False
-            triples = []
-            if self.use_langextract:
-                try:
-                    # 若用户希望使用 qwen 模型且 self.model 已构建，则传入 self.model
-                    model_to_use = self.model if use_qwen_model and self.model else None
-                    res = self._call_langextract(doc["content"], model=model_to_use, extraction_passes=2)
-                    triples = self._parse_extractions(res.extractions)
-                    used_model_flag = True if model_to_use else False
-                except Exception as e:
-                    # 调用失败则使用回退逻辑
-                    triples = self._fallback_extract(doc.get("content", ""))
-                    used_model_flag = False
-                    print("调用失败则使用回退逻辑",e)
+
+        self._report_method(doc, used_model_flag, time.perf_counter() - start)
+        return {"id": doc.get("id"), "triples": triples, "used_model": used_model_flag}
+
+    def extract_with_deadline(self, doc: Dict, deadline: float = 2.0, hedge: bool = False,
+                              use_qwen_model: bool = True) -> Dict:
+        """
+        交互场景的单条抽取：在 deadline 秒内给出结果，格式同 extract_triples 的每条结果。
+        - 缓存命中直接返回；否则模型调用在后台线程发出，同时在当前线程跑回退规则，
+          deadline 秒内模型没有返回（或调用失败）就返回回退结果（used_model=False）
+        - hedge=True 时，模型调用超过近期 p95 耗时仍未返回，再发一个相同的请求，先返回的为准
+        - 超时的模型请求在后台照常完成并写入缓存，同一评论下次直接命中（见 deadline_calls.py）
+        """
+        start = time.perf_counter()
+        content = doc.get("content", "")
+        if not self.use_langextract:
+            return self._extract_doc(doc, use_qwen_model)
+        model_to_use = self.model if use_qwen_model and self.model else None
+        key = self._cache_key(content, model_to_use, 2)
+        cached = self.cache.get_extractions(key) if key is not None else None
+        if cached is not None:
+            triples, outcome = self._parse_extractions(cached), "model"
+        else:
+            def call():
+                return self._parse_extractions(self._run_langextract(content, model_to_use, 2, key).extractions)
+
+            triples, outcome = self.deadline_caller.run(call, partial(self._fallback_extract, content),
+                                                        deadline, hedge=hedge)
+        used_model_flag = outcome in ("model", "hedged") and bool(model_to_use)
+        if outcome == "deadline":
+            print(f"⏱️ 文档 {doc.get('id')} 模型未在 {deadline:.1f}s 内返回，先使用回退规则（模型结果返回后写入缓存）")
+        self._report_method(doc, used_model_flag, time.perf_counter() - start)
+        return {"id": doc.get("id"), "triples": triples, "used_model": used_model_flag}
+
+    def _extract_triples_tiered(self, documents: List[Dict], use_qwen_model: bool, pack_tokens: Optional[int],
+                                threshold: float) -> List[Dict]:
+        """
+        分级抽取：先对全部文档跑回退规则并计算置信度，低于 threshold 的文档再走模型抽取（可与打包模式同时使用），
+        其余直接采用规则结果（used_model=False）。
+        """
+        results, confidences, seconds = [], [], []
+        for doc in documents:
+            start = time.perf_counter()
+            triples, confidence = self._fallback_with_confidence(doc.get("content", ""))
+            seconds.append(time.perf_counter() - start)
+            results.append({"id": doc.get("id"), "triples": triples, "used_model": False})
+            confidences.append(confidence)
+        to_llm = self.router.route(confidences, threshold)
+        routed = set(to_llm)
+        for i, doc in enumerate(documents):
+            if i not in routed:
+                self._report_method(doc, False, seconds[i])
+        if to_llm:
+            llm_results = self.extract_triples([documents[i] for i in to_llm], use_qwen_model, pack_tokens)
+            for i, result in zip(to_llm, llm_results):
+                results[i] = result
+
+        stats = self.router.stats()
+        print(f"分级抽取：{len(to_llm)}/{len(documents)} 条送入模型（累计调用率 {stats['llm_call_rate']:.0%}）")
+        return results
+
+    def _fallback_with_confidence(self, content: str):
+        """
+        回退抽取并给出置信度（0~1）= 评价句中命中方面关键词的比例 × 非中性三元组比例。
+        正负情感词抵消（或都没有）的句子得到 neutral，视为规则没有把握；没有抽到三元组时置信度为 0。
+        """
+        triples = self._fallback_extract(content)
+        # 店名/评分/时间/标签 等表头行不是评价内容，不计入分母
+        sents = [sent.strip() for sent in re.split(r'[。\n！？!?]+', content)
+                 if sent.strip() and not re.match(r'(店名|评分|时间|标签)[:：]', sent.strip())]
+        if not triples or not sents:
+            return triples, 0.0
+        covered = sum(
+            1 for sent in sents
+            if any(tag[0] == "aspect" for kw in self._scan_lexicons(sent)[0] for tag in self._lexicon_tags[kw])
+        )
+        decided = sum(1 for t in triples if t["sentiment"] != "neutral")
+        return triples, covered / len(sents) * decided / len(triples)
+
+    def _extract_triples_packed(self, documents: List[Dict], use_qwen_model: bool, pack_tokens: int) -> List[Dict]:
+        """
+        打包模式：按 token 预算把多条评论合并为一次 langextract 调用，抽取结果按字符偏移分回各条评论。
+        - 分回后没有任何抽取结果的评论单独走 _extract_doc；整包调用失败时这一包使用回退规则
+        - 每条评论的抽取结果以 "packed" 配置单独缓存，与逐条抽取的缓存条目互不混用
+        """
+        model_to_use = self.model if use_qwen_model and self.model else None
+        pack_prompt = self.prompt + PACK_INSTRUCTION
+        contents = [doc.get("content", "") for doc in documents]
+        results: List[Optional[Dict]] = [None] * len(documents)
+
+        pending = []
+        for i, content in enumerate(contents):
+            cached = None
+            if self.cache is not None:
+                cached = self.cache.get_extractions(
+                    self.cache.make_key(self._cache_fingerprint(model_to_use, "packed"), content))
+            if cached is not None:
+                self._report_method(documents[i], bool(model_to_use), 0.0)
+                results[i] = {"id": documents[i].get("id"), "triples": self._parse_extractions(cached),
+                              "used_model": bool(model_to_use)}
             else:
-                # langextract 不可用，全部使用回退
-                triples = self._fallback_extract(doc.get("content", ""))
+                pending.append(i)
+
+        packer = ReviewPacker(pack_tokens)
+        plan = packer.plan([contents[i] for i in pending], request_overhead(pack_prompt, self.examples))
+        for pack in ([pending[j] for j in p] for p in plan):
+            if len(pack) == 1:
+                results[pack[0]] = self._extract_doc(documents[pack[0]], use_qwen_model)
+                continue
+            start = time.perf_counter()
+            try:
+                per_doc = packer.extract(
+                    [contents[i] for i in pack],
+                    lambda text: self.gateway.call(self.lx.extract, text_or_documents=text,
+                                                   prompt_description=pack_prompt, examples=self.examples,
+                                                   model=model_to_use, extraction_passes=1,
+                                                   max_char_buffer=len(text)).extractions)
+            except Exception as e:
+                print("打包调用失败则使用回退逻辑", e)
+                per_doc = [None] * len(pack)
+            seconds = (time.perf_counter() - start) / len(pack)
+            for i, extractions in zip(pack, per_doc):
+                if extractions is not None and not extractions:
+                    results[i] = self._extract_doc(documents[i], use_qwen_model)
+                    continue
+                if extractions is None:
+                    triples, used_model_flag = self._fallback_extract(contents[i]), False
+                else:
+                    if self.cache is not None:
+                        self.cache.put_extractions(
+                            self.cache.make_key(self._cache_fingerprint(model_to_use, "packed"), contents[i]), extractions)
+                    triples, used_model_flag = self._parse_extractions(extractions), bool(model_to_use)
+                self._report_method(documents[i], used_model_flag, seconds)
+                results[i] = {"id": documents[i].get("id"), "triples": triples, "used_model": used_model_flag}
+
+        stats = packer.stats()
+        print(f"打包模式：{stats['documents']} 条评论合并为 {stats['requests']} 次请求"
+              f"（{stats['unattributed']} 条抽取无法归属，已丢弃）")
+        return results
+
+    def _report_method(self, doc: Dict, used_model_flag: bool, seconds: float):
+        """打印每条文档的抽取方式，并记录抽取耗时与方式（指标开启时）"""
+        method = "llm" if used_model_flag else "fallback"
+        METRICS.observe("extraction_seconds", seconds, pipeline="opinion", method=method)
+        METRICS.inc("extraction_documents_total", pipeline="opinion", method=method)
+        method_desc = "使用大模型(通过 langextract)" if used_model_flag else "使用回退规则"
+        print(f"文档 {doc.get('id')} 抽取方式：{method_desc}")
+
+    async def _aextract_one(self, doc: Dict, use_qwen_model: bool,
+                            semaphore: asyncio.Semaphore, executor: ThreadPoolExecutor) -> Dict:
+        """
+        单条文档的异步抽取：
+        - _call_langextract 是同步阻塞调用，放到专用线程池执行，并受 semaphore 限制同时在途的请求数
+        - 回退抽取为 CPU 计算，放到默认线程池执行，避免阻塞事件循环
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        used_model_flag = False
+        triples = []
+        if self.use_langextract:
+            model_to_use = self.model if use_qwen_model and self.model else None
+            try:
+                async with semaphore:
+                    res = await loop.run_in_executor(
+                        executor, partial(self._call_langextract, doc["content"], model=model_to_use, extraction_passes=2)
+                    )
+                triples = self._parse_extractions(res.extractions)
+                used_model_flag = True if model_to_use else False
+            except Exception as e:
+                triples = await loop.run_in_executor(None, self._fallback_extract, doc.get("content", ""))
                 used_model_flag = False
+                print("调用失败则使用回退逻辑",e)
+        else:
+            triples = await loop.run_in_executor(None, self._fallback_extract, doc.get("content", ""))
+
+        self._report_method(doc, used_model_flag, time.perf_counter() - start)
+        return {"id": doc.get("id"), "triples": triples, "used_model": used_model_flag}
 
-            # 打印每条文档的抽取方式
-            method_desc = "使用大模型(通过 langextract)" if used_model_flag else "使用回退规则"
-            print(f"文档 {doc.get('id')} 抽取方式：{method_desc}")
-            results.append({"id": doc.get("id"), "triples": triples, "used_model": used_model_flag})
+    async def aiter_triples(self, documents: List[Dict], use_qwen_model: bool = True,
+                            max_concurrency: int = 64) -> AsyncIterator[Dict]:
+        """
+        extract_triples 的异步迭代版本：并发抽取，按完成先后 yield 每条文档的结果
+        （结果中带有 id，便于调用方对应回原文档）。
+        max_concurrency 为同时在途的模型请求上限。
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        tasks = [asyncio.ensure_future(self._aextract_one(doc, use_qwen_model, semaphore, executor))
+                 for doc in documents]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            # 调用方提前结束迭代时取消剩余任务；不等待线程池，避免阻塞事件循环
+            for t in tasks:
+                t.cancel()
+            executor.shutdown(wait=False)
+
+    async def aextract_triples(self, documents: List[Dict], use_qwen_model: bool = True,
+                               max_concurrency: int = 64) -> List[Dict]:
+        """
+        extract_triples 的协程版本：最多 max_concurrency 个 _call_langextract 同时在途，
+        返回结果与输入文档顺序一致，格式同 extract_triples。
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        tasks = [asyncio.ensure_future(self._aextract_one(doc, use_qwen_model, semaphore, executor))
+                 for doc in documents]
+        try:
+            return list(await asyncio.gather(*tasks))
+        finally:
+            # 被取消或超时时同样不等待线程池中在途的调用，避免阻塞事件循环
+            for t in tasks:
+                t.cancel()
+            executor.shutdown(wait=False)
+
+    def extract_triples_bulk(self, documents: Iterable[Dict], processes: Optional[int] = None,
+                             chunksize: int = 256) -> Iterator[Dict]:
+        """
+        规则回退抽取的多进程批量模式，用于历史数据回灌（不调用模型）。
+        - 文档按 chunksize 条一组分发到进程池，摊薄进程间通信开销；词典在每个工作进程启动时只传一次
+        - 按输入顺序逐条 yield 结果（格式同 extract_triples，used_model 恒为 False）
+        - 同时在途的分组数不超过 2 × processes，documents 可以是任意长的生成器
+        """
+        processes = processes or os.cpu_count() or 1
+        window = deque()
+        with ProcessPoolExecutor(max_workers=processes, initializer=_bulk_worker_init,
+                                 initargs=(self.lexicons,)) as executor:
+            batch = []
+            for doc in documents:
+                batch.append((doc.get("id"), doc.get("content", "")))
+                if len(batch) >= chunksize:
+                    window.append(executor.submit(_bulk_worker_extract, batch))
+                    batch = []
+                    # 在途分组达到上限时先交出最早一组的结果，形成背压
+                    if len(window) >= 2 * processes:
+                        yield from self._count_bulk(window.popleft().result())
+            if batch:
+                window.append(executor.submit(_bulk_worker_extract, batch))
+            while window:
+                yield from self._count_bulk(window.popleft().result())
+
+    @staticmethod
+    def _count_bulk(results: List[Dict]) -> List[Dict]:
+        METRICS.inc("extraction_documents_total", len(results), pipeline="opinion", method="fallback")
         return results
 
 
+# -------------------------
+# extract_triples_bulk 的工作进程：只持有回退词典与自动机，不构建模型
+# -------------------------
+_bulk_extractor: Optional[EnhancedOpinionExtractorV7] = None
+
+
+def _bulk_worker_init(lexicons):
+    global _bulk_extractor
+    _bulk_extractor = EnhancedOpinionExtractorV7.from_lexicons(lexicons)
+
+
+def _bulk_worker_extract(batch: List[tuple]) -> List[Dict]:
+    return [{"id": doc_id, "triples": _bulk_extractor._fallback_extract(content), "used_model": False}
+            for doc_id, content in batch]
+
+
 # -------------------------
 # 测试用示例文档（至少 5 篇，文本较长且包含多方面观点）
 # -------------------------
@@ -601,7 +975,7 @@ if __name__ == "__main__":
     # qwen_apikey 示例（请替换为真实 key）
     example_qwen_apikey = 'sk-123456'
 
-    # 构造抽取器，构造时会在 __init__ 中尝试构建 self.model
+    # 构造抽取器；self.model 在第一次抽取时才构建
     extractor = EnhancedOpinionExtractorV7(qwen_apikey=example_qwen_apikey,model_id = 'qwen-plus')
 
     # 生成测试文档
@@ -622,7 +996,7 @@ if __name__ == "__main__":
     # qwen_apikey 示例（请替换为真实 key）
     example_qwen_apikey = 'sk-112223333'
     
-    # 构造抽取器，构造时会在 __init__ 中尝试构建 self.model
+    # 构造抽取器；self.model 在第一次抽取时才构建
     extractor = EnhancedOpinionExtractorV7(qwen_apikey=example_qwen_apikey,model_id = 'qwen-plus')
     
     content = '店名：老王烧烤\n评分：5星\n时间：2024-08-12\n评价：我们一家四口晚上去吃，羊肉串多汁非常好吃，老板还推荐了几款特色蘸料，味道很到位。服务员态度热情，上菜也很快。餐厅门口就有停车位，离地铁站步行约5分钟，非常方便。总体很满意，会再来。标签：味道棒, 服务好'
@@ -6,9 +6,25 @@ This version fixes the metadata extraction and matching issues.
 import os
 import textwrap
 import re
-from typing import List, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, List, Dict, Optional
 from dotenv import load_dotenv
 
+from adaptive_passes import PassScheduler
+from chunking import chunk_documents, chunk_markdown, extraction_text, group_by_parent
+from extraction_cache import ExtractionCache
+from dense_index import DenseIndex, HashingEmbedder, bitmap_to_mask
+from index_format import (FrozenDocuments, LayeredList, read_manifest, staged_directory, write_documents,
+                          write_manifest)
+from metrics import METRICS
+from model_gateway import ModelGateway, shared_gateway
+from model_providers import langextract_available, load_langextract
+from rule_extractor import DocRuleExtractor
+from smart_index import BM25Index, FacetIndex, InvertedIndex, word_tokens
+from tiered_extraction import ConfidenceRouter
+
 # Load environment variables
 load_dotenv()
 
@@ -96,22 +112,48 @@ Last updated: March 2024"""
 class FixedLangExtractProcessor:
     """Enhanced metadata extraction with better prompts and normalization"""
     
-    def __init__(self):
-        try:
-            import langextract as lx
-            self.lx = lx
+    MODEL_ID = "gemini-2.5-flash"
+    EXTRACTION_PASSES = 2
+    # Run one pass and only re-extract documents still missing these classes
+    # (False restores the fixed EXTRACTION_PASSES behaviour)
+    ADAPTIVE_PASSES = True
+    REQUIRED_CLASSES = ("service_name", "version_number", "document_category")
+    
+    def __init__(self, cache: Optional[ExtractionCache] = None, gateway: Optional[ModelGateway] = None):
+        # Optional on-disk cache of LLM extractions (see extraction_cache.py)
+        self.cache = cache
+        # Rate limiting, retries and circuit breaking for every LangExtract call (see model_gateway.py)
+        self.gateway = gateway or shared_gateway()
+        self.rules = DocRuleExtractor()
+        self.passes = PassScheduler(self.REQUIRED_CLASSES, self.EXTRACTION_PASSES, pipeline="rag_en")
+        self.router = ConfidenceRouter(pipeline="rag_en")
+        # Goes through model_providers so a stand-in (e.g. mock_llm.MockLangExtract) can replace it
+        if langextract_available():
+            self.lx = load_langextract()
             self.setup_complete = True
             print("✅ LangExtract initialized")
-        except ImportError:
+        else:
             print("⚠️  LangExtract not installed - using enhanced regex extraction")
             self.setup_complete = False
     
         
-    def extract_metadata(self, documents: List[Dict]) -> List[Dict]:
-        """Extract and normalize metadata"""
+    def extract_metadata(self, documents: List[Dict], max_workers: int = 1,
+                         route_threshold: Optional[float] = None) -> List[Dict]:
+        """Extract and normalize metadata
+        
+        max_workers > 1 enables concurrent mode: up to max_workers documents are
+        sent to LangExtract at the same time and results keep the input order.
+        With route_threshold set, rules run first and only documents whose rule
+        confidence is below the threshold go to LangExtract (see tiered_extraction.py).
+        """
         
         if not self.setup_complete:
-            return self._enhanced_regex_extraction(documents)
+            results = self._enhanced_regex_extraction(documents)
+            METRICS.inc("extraction_documents_total", len(results), pipeline="rag_en", method="fallback")
+            return results
+        
+        if route_threshold is not None:
+            return self._extract_tiered(list(documents), route_threshold, max_workers)
 
         # Improved extraction prompt
         prompt = """
@@ -158,35 +200,93 @@ class FixedLangExtractProcessor:
         ]
 
         
-        extracted_docs = []
+        fingerprint = None
+        if self.cache is not None:
+            fingerprint = self.cache.config_fingerprint(prompt, examples, self.MODEL_ID, self._passes_config())
+        
+        if max_workers <= 1:
+            results = [self._extract_one(doc, prompt, examples, fingerprint) for doc in documents]
+        else:
+            # Concurrent mode: at most max_workers LLM requests in flight,
+            # results come back in input order (executor.map preserves order)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lambda doc: self._extract_one(doc, prompt, examples, fingerprint), documents))
+        
+        if self.ADAPTIVE_PASSES:
+            stats = self.passes.stats()
+            print(f"🔁 Extraction passes: {stats['passes_run']} run, {stats['passes_saved']} saved "
+                  f"of {stats['passes_budget']} ({stats['saved_ratio']:.0%})")
+        return results
+    
+    def _extract_tiered(self, documents: List[Dict], threshold: float, max_workers: int = 1) -> List[Dict]:
+        """Rules first; documents with rule confidence below threshold are re-extracted by LangExtract"""
+        results = self._enhanced_regex_extraction(documents)
+        confidences = self.rules.confidence_batch(documents, [r['metadata'] for r in results])
+        to_llm = self.router.route(confidences, threshold)
+        METRICS.inc("extraction_documents_total", len(documents) - len(to_llm), pipeline="rag_en", method="rules")
+        if to_llm:
+            for i, result in zip(to_llm, self.extract_metadata([documents[i] for i in to_llm], max_workers)):
+                results[i] = result
+        
+        stats = self.router.stats()
+        print(f"🧭 Tiered extraction: {len(to_llm)}/{len(documents)} documents sent to LangExtract "
+              f"(overall LLM call rate {stats['llm_call_rate']:.0%})")
+        return results
+    
+    def _passes_config(self):
+        """extraction_passes as recorded in the cache fingerprint"""
+        return self.passes.label() if self.ADAPTIVE_PASSES else self.EXTRACTION_PASSES
+
+    def _extract_one(self, doc: Dict, prompt: str, examples: List, fingerprint: Optional[str] = None) -> Dict:
+        """Extract metadata for a single document or chunk, falling back to regex on failure"""
+        print(f"📄 Processing: {doc['title']}")
         
-        for doc in documents:
-            print(f"📄 Processing: {doc['title']}")
-            
+        # Chunks carry their heading path as context so they can be extracted on their own
+        source = dict(doc, content=extraction_text(doc))
+        with METRICS.time("extraction_seconds", pipeline="rag_en", method="llm") as labels:
             try:
-                result = self.lx.extract(
-                    text_or_documents=doc['content'],
-                    prompt_description=prompt,
-                    examples=examples,
-                    model_id="gemini-2.5-flash",
-                    extraction_passes=2
-                )
+                extractions = self._cached_extract(source['content'], prompt, examples, fingerprint)
                 
                 # Process and normalize extractions
-                metadata = self._process_and_normalize(result.extractions, doc)
+                metadata = self._process_and_normalize(extractions, source)
                 
             except Exception as e:
                 print(f"  ⚠️  LangExtract failed: {e}")
-                metadata = self._enhanced_regex_extraction([doc])[0]['metadata']
-            
-            extracted_docs.append({
-                'id': doc['id'],
-                'title': doc['title'],
-                'content': doc['content'],
-                'metadata': metadata
-            })
+                metadata = self._enhanced_regex_extraction([source])[0]['metadata']
+                labels['method'] = 'fallback'
+        METRICS.inc("extraction_documents_total", pipeline="rag_en", method=labels['method'])
         
-        return extracted_docs
+        # Chunk fields (parent_id, chunk_index, ...) pass through unchanged
+        return dict(doc, metadata=metadata)
+    
+    def _cached_extract(self, content: str, prompt: str, examples: List, fingerprint: Optional[str] = None):
+        """Return LangExtract extractions for content, consulting the cache first"""
+        key = None
+        if self.cache is not None and fingerprint is not None:
+            key = self.cache.make_key(fingerprint, content)
+            cached = self.cache.get_extractions(key)
+            if cached is not None:
+                return cached
+        
+        if self.ADAPTIVE_PASSES:
+            extractions = self.passes.run(lambda: self._extract_passes(content, prompt, examples, 1))
+        else:
+            extractions = self._extract_passes(content, prompt, examples, self.EXTRACTION_PASSES)
+        if key is not None:
+            self.cache.put_extractions(key, extractions)
+        return extractions
+    
+    def _extract_passes(self, content: str, prompt: str, examples: List, passes: int) -> List:
+        """Call LangExtract once with the given number of passes"""
+        result = self.gateway.call(
+            self.lx.extract,
+            text_or_documents=content,
+            prompt_description=prompt,
+            examples=examples,
+            model_id=self.MODEL_ID,
+            extraction_passes=passes
+        )
+        return result.extractions
    
     
     def _process_and_normalize(self, extractions, doc: Dict) -> Dict:
@@ -225,110 +325,375 @@ class FixedLangExtractProcessor:
         return metadata
     
     def _enhanced_regex_extraction(self, documents: List[Dict]) -> List[Dict]:
-        """Enhanced regex-based extraction with better patterns"""
-        
-        extracted_docs = []
+        """Enhanced regex-based extraction with better patterns (precompiled, see rule_extractor.py)"""
         
-        for doc in documents:
-            metadata = {
-                'service': 'unknown',
-                'version': 'unknown',
-                'doc_type': 'reference', 
-                'rate_limits': [],
-                'deprecated': False
-            }
-            
-            title = doc.get('title', '')
-            content = doc['content']
-            
-            # Extract service name from title
-            service_match = re.search(r'([\w\s]+(?:API|Service))', title)
-            if service_match:
-                metadata['service'] = service_match.group(1).strip()
-            
-            # Extract version number
-            version_match = re.search(r'v?([\d.]+)', title)
-            if version_match:
-                metadata['version'] = version_match.group(1)
-            
-            # Determine document type
-            if 'troubleshooting' in title.lower():
-                metadata['doc_type'] = 'troubleshooting'
-            elif 'guide' in title.lower():
-                metadata['doc_type'] = 'guide'
-            else:
-                metadata['doc_type'] = 'reference'
-            
-            # Extract rate limits
-            rate_matches = re.findall(r'(\d+)\s*(?:requests?|req)[/\s]*(?:per\s*)?min', content.lower())
-            metadata['rate_limits'] = [f"{r} req/min" for r in rate_matches]
-            
-            # Check for deprecation
-            if 'deprecated' in content.lower():
-                metadata['deprecated'] = True
-            
-            extracted_docs.append({
-                'id': doc['id'],
-                'title': doc['title'], 
-                'content': doc['content'],
-                'metadata': metadata
-            })
-        
-        return extracted_docs
+        metadatas = self.rules.extract_batch(documents)
+        return [dict(doc, metadata=metadata) for doc, metadata in zip(documents, metadatas)]
 
 
 class SmartVectorStore:
     """Vector store with fuzzy metadata matching"""
     
-    def __init__(self):
+    # Identifies this store type in saved index manifests
+    STORE_KIND = "SmartVectorStore/en"
+    
+    # Metadata fields with facet indexes, and the value used when a field is missing
+    FACET_FIELDS = {'service': 'unknown', 'version': 'unknown', 'doc_type': 'reference'}
+    
+    # Tombstoned documents are dropped by a background rebuild once they make up
+    # COMPACT_RATIO of all stored documents (and number at least COMPACT_MIN_TOMBSTONES)
+    COMPACT_RATIO = 0.3
+    COMPACT_MIN_TOMBSTONES = 1000
+    
+    # With ann=True the IVF index is trained once IVF_MIN_DOCS vectors are stored, and
+    # retrained whenever the corpus has grown IVF_RETRAIN_GROWTH times since the last training
+    IVF_MIN_DOCS = 1000
+    IVF_RETRAIN_GROWTH = 2.0
+    
+    def __init__(self, dense: bool = False, embedder=None, ann: bool = False):
+        # Dense-vector mode is opt-in; HashingEmbedder is the offline default.
+        # ann=True adds an IVF approximate index on top of the dense vectors.
+        self.embedder = embedder or (HashingEmbedder() if dense or ann else None)
+        self.ann = ann
+        # Writers and the compaction swap hold _lock; _compact_lock allows one compaction at a time
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compactor = None
+        # Background IVF (re)training thread, see _maybe_train_ivf
+        self._ivf_trainer = None
+        # Bumped by every _reset; a compaction started before a full re-index is discarded
+        self._generation = 0
+        self._reset()
+    
+    def _reset(self):
+        """Empty every internal structure"""
+        self._generation += 1
         self.documents = []
+        self.index = InvertedIndex()
+        self.facets = FacetIndex(self.FACET_FIELDS)
+        self.ranker = BM25Index(word_tokens)
+        self.vectors = DenseIndex(self.embedder) if self.embedder is not None else None
+        # Slots of deleted/replaced documents, skipped by every query until compaction
+        self.tombstones = set()
+        self._tombstone_bits = None
+        # Document id -> live slot; None until first needed (e.g. after load)
+        self._slots = {}
+    
+    def _empty_like(self) -> "SmartVectorStore":
+        return type(self)(embedder=self.embedder, ann=self.ann)
     
     def add_documents(self, docs: List[Dict]):
-        """Add documents with metadata"""
-        self.documents = docs
+        """Add documents with metadata (replaces the current corpus)"""
+        with self._lock:
+            self._reset()
+            self._append(docs)
+            self._maybe_train_ivf()
+            self._report_size()
         print(f"✅ Indexed {len(docs)} documents")
     
-    def search(self, query: str, filters: Dict = None) -> List[Dict]:
-        """Search with smart metadata filtering"""
-        if not filters:
-            # No filters - return all matching documents
-            return [doc for doc in self.documents 
-                   if any(word.lower() in doc['content'].lower() for word in query.split())]
+    def _append(self, docs: List[Dict], vecs=None):
+        """Index docs into new slots at the end of every structure"""
+        # Build token -> postings index so queries only touch matching documents,
+        # and per-field facet bitmaps so filters become bitmap intersections
+        for slot, doc in enumerate(docs, len(self.documents)):
+            self.documents.append(doc)
+            self.index.add(slot, doc['content'])
+            self.facets.add(slot, doc['metadata'])
+            self.ranker.add(slot, doc['content'])
+            if self._slots is not None:
+                self._slots[doc['id']] = slot
+        if self.vectors is not None and docs:
+            if vecs is None:
+                self.vectors.add([doc['content'] for doc in docs])
+            else:
+                self.vectors.add_vectors(vecs)
+    
+    def upsert(self, docs: List[Dict]):
+        """Insert documents, replacing any stored document with the same id
         
-        # Apply smart filters
-        filtered_docs = []
+        Only the given documents are indexed, so the cost does not depend on corpus size.
+        A replaced document's old slot is tombstoned rather than rewritten.
+        """
+        # Within one batch the last version of an id wins, as if upserted one by one
+        latest = {}
+        for doc in docs:
+            latest.pop(doc['id'], None)
+            latest[doc['id']] = doc
+        docs = list(latest.values())
+        with self._lock:
+            slots = self._slot_map()
+            for doc in docs:
+                if doc['id'] in slots:
+                    self._tombstone(slots[doc['id']])
+            self._append(docs)
+            self._maybe_train_ivf()
+            self._report_size()
+            self._maybe_compact()
+        print(f"✅ Upserted {len(docs)} documents")
+    
+    def delete(self, ids: Iterable[Any]) -> int:
+        """Delete documents by id; returns how many were found"""
+        deleted = 0
+        with self._lock:
+            slots = self._slot_map()
+            for doc_id in ids:
+                slot = slots.pop(doc_id, None)
+                if slot is not None:
+                    self._tombstone(slot)
+                    deleted += 1
+            self._report_size()
+            self._maybe_compact()
+        return deleted
+    
+    def _slot_map(self) -> Dict[Any, int]:
+        if self._slots is None:
+            self._slots = {}
+            for slot in range(len(self.documents)):
+                if slot not in self.tombstones:
+                    self._slots[self.documents[slot]['id']] = slot
+        return self._slots
+    
+    def _tombstone(self, slot: int):
+        self.tombstones.add(slot)
+        self._tombstone_bits = None
+    
+    def _live_bits(self) -> int:
+        """Bitmap of documents that are not tombstoned"""
+        bits = self.facets.all_bits()
+        if self.tombstones:
+            if self._tombstone_bits is None:
+                self._tombstone_bits = FacetIndex.from_ids(self.tombstones)
+            bits &= ~self._tombstone_bits
+        return bits
+    
+    def _report_size(self):
+        """Publish live document / tombstone counts (no-op while metrics are off)"""
+        if METRICS.enabled:
+            METRICS.set_gauge("index_documents", len(self.documents) - len(self.tombstones), store=self.STORE_KIND)
+            METRICS.set_gauge("index_tombstones", len(self.tombstones), store=self.STORE_KIND)
+    
+    def _maybe_train_ivf(self):
+        """With ann=True, (re)train the IVF index in a background thread once it is due; caller holds _lock"""
+        if not self.ann or self.vectors is None:
+            return
+        if not self.vectors.ivf_due(self.IVF_MIN_DOCS, self.IVF_RETRAIN_GROWTH):
+            return
+        if self._ivf_trainer is None or not self._ivf_trainer.is_alive():
+            self._ivf_trainer = threading.Thread(target=self._train_ivf, daemon=True)
+            self._ivf_trainer.start()
+    
+    def _train_ivf(self):
+        # Only the snapshot is taken under the lock. k-means runs outside it, so queries keep
+        # using exact search (or the previous IVF index) until the new index is swapped in.
+        with self._lock:
+            vectors = self.vectors
+            if vectors is None or not vectors.ivf_due(self.IVF_MIN_DOCS, self.IVF_RETRAIN_GROWTH):
+                return
+            size, segments = vectors.snapshot()
+        ivf = vectors.train_ivf(segments)
+        with self._lock:
+            # add_documents or a compaction replaced the vectors meanwhile; this index is stale
+            if self.vectors is vectors:
+                vectors.install_ivf(ivf, size)
+    
+    def wait_for_ivf(self, timeout: Optional[float] = None) -> bool:
+        """Block until background IVF training finishes; returns False on timeout"""
+        thread = self._ivf_trainer
+        if thread is None:
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
+    
+    def _maybe_compact(self):
+        n = len(self.tombstones)
+        if n < self.COMPACT_MIN_TOMBSTONES or n <= self.COMPACT_RATIO * len(self.documents):
+            return
+        if self._compactor is None or not self._compactor.is_alive():
+            self._compactor = self.compact(background=True)
+    
+    def compact(self, background: bool = False) -> Optional[threading.Thread]:
+        """Rebuild every structure from the live documents, dropping tombstones
         
-        for doc in self.documents:
-            match = True
-            
-            # Smart service matching
-            if 'service' in filters:
-                query_service = filters['service'].lower()
-                doc_service = doc['metadata']['service'].lower()
-                # Allow partial matches
-                if query_service not in doc_service and doc_service not in query_service:
-                    # Try keyword matching
-                    query_keywords = set(query_service.replace('api', '').replace('service', '').split())
-                    doc_keywords = set(doc_service.replace('api', '').replace('service', '').split())
-                    if not query_keywords.intersection(doc_keywords):
-                        match = False
-            
-            # Exact version matching
-            if 'version' in filters:
-                if filters['version'] != doc['metadata']['version']:
-                    match = False
-            
-            # Document type matching
-            if 'doc_type' in filters:
-                if filters['doc_type'] != doc['metadata']['doc_type']:
-                    match = False
-            
-            if match:
-                # Also check if content matches query
-                if any(word.lower() in doc['content'].lower() for word in query.split()):
-                    filtered_docs.append(doc)
+        The rebuild runs outside the lock, so queries and writes continue meanwhile;
+        writes that land during the rebuild are replayed before the new structures
+        are swapped in (add_documents replacing the corpus discards the rebuild instead).
+        With background=True it runs in a daemon thread, which is returned.
+        """
+        if background:
+            thread = threading.Thread(target=self.compact, daemon=True)
+            thread.start()
+            return thread
+        with self._compact_lock:
+            self._compact()
+        return None
+    
+    def _compact(self):
+        # Caller holds _compact_lock
+        with self._lock:
+            generation = self._generation
+            documents, vectors = self.documents, self.vectors
+            end = len(documents)
+            tombstones = set(self.tombstones)
+        # Slots below `end` are never rewritten, so they can be read without the lock
+        live = [slot for slot in range(end) if slot not in tombstones]
+        fresh = self._empty_like()
+        fresh._append([documents[slot] for slot in live],
+                      vectors.take(live) if vectors is not None else None)
+        # The compaction thread is already off the lock, so the fresh index trains here
+        if fresh.ann and fresh.vectors is not None:
+            fresh.vectors.maybe_train_ivf(self.IVF_MIN_DOCS, self.IVF_RETRAIN_GROWTH)
+        with self._lock:
+            if self._generation != generation:
+                # add_documents replaced the corpus meanwhile; this rebuild is stale
+                return
+            tail = list(range(end, len(self.documents)))
+            fresh._append([self.documents[slot] for slot in tail],
+                          self.vectors.take(tail) if self.vectors is not None else None)
+            new_slot = {old: new for new, old in enumerate(live + tail)}
+            for slot in self.tombstones - tombstones:
+                fresh._tombstone(new_slot[slot])
+            fresh._slots = (None if self._slots is None else
+                            {doc_id: new_slot[slot] for doc_id, slot in self._slots.items()})
+            for attr in ('documents', 'index', 'facets', 'ranker', 'vectors',
+                         'tombstones', '_tombstone_bits', '_slots'):
+                setattr(self, attr, getattr(fresh, attr))
+            self._maybe_train_ivf()
+            self._report_size()
+    
+    def _match_query(self, query: str) -> List[int]:
+        """Ids of documents whose content contains any query word, in corpus order"""
+        return sorted(self.index.match_any(query.split()))
+    
+    def _filter_bitmap(self, filters: Dict) -> int:
+        """Bitmap of live documents whose metadata satisfies all filters"""
+        bits = self._live_bits()
+        
+        # Smart service matching, evaluated once per distinct service value
+        if 'service' in filters:
+            bits &= self.facets.select('service', lambda value: _service_matches(filters['service'], value))
         
-        return filtered_docs
+        # Exact version matching
+        if 'version' in filters:
+            bits &= self.facets.bitmap('version', filters['version'])
+        
+        # Document type matching
+        if 'doc_type' in filters:
+            bits &= self.facets.bitmap('doc_type', filters['doc_type'])
+        
+        return bits
+    
+    def search(self, query: str, filters: Dict = None, k: Optional[int] = None) -> List[Dict]:
+        """Search with smart metadata filtering
+        
+        k=None returns every matching document in corpus order (original behaviour);
+        with k set, documents are ranked by BM25 and only the top k are returned.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            if k is not None:
+                # Ranked mode: BM25 over the content, top-k via a bounded heap
+                allowed = set(FacetIndex.ids(self._filter_bitmap(filters))) if filters else None
+                stats = {}
+                results = [self.documents[i] for i, _ in self.ranker.top_k(query, k, allowed, self.tombstones, stats)]
+                scanned = stats['scanned']
+            else:
+                matched = self._match_query(query)
+                scanned = len(matched)
+                if filters:
+                    # Apply smart filters
+                    allowed = set(FacetIndex.ids(self._filter_bitmap(filters)))
+                    matched = [i for i in matched if i in allowed]
+                elif self.tombstones:
+                    matched = [i for i in matched if i not in self.tombstones]
+                results = [self.documents[i] for i in matched]
+        METRICS.record_search(self.STORE_KIND, 'bm25' if k is not None else 'match', bool(filters),
+                              time.perf_counter() - start, scanned, len(results))
+        return results
+    
+    def search_vectors(self, query: str, filters: Dict = None, k: int = 5,
+                       nprobe: Optional[int] = None) -> List[Dict]:
+        """Dense-vector search: top-k documents by embedding similarity"""
+        return self.search_vectors_batch([query], filters, k, nprobe)[0]
+    
+    def search_vectors_batch(self, queries: List[str], filters: Dict = None, k: int = 5,
+                             nprobe: Optional[int] = None) -> List[List[Dict]]:
+        """Dense-vector search for several queries with one matrix product
+        
+        Metadata filters are applied as a pre-filter mask before top-k selection.
+        With ann=True, nprobe trades recall for latency (more lists = higher recall).
+        """
+        with self._lock:
+            if self.vectors is None:
+                raise RuntimeError("Dense mode is off - create SmartVectorStore(dense=True) or pass an embedder")
+            mask = None
+            if filters or self.tombstones:
+                mask = bitmap_to_mask(self._filter_bitmap(filters or {}), len(self.documents))
+            hits = self.vectors.search(queries, k, mask, nprobe)
+            return [[self.documents[i] for i, _ in row] for row in hits]
+    
+    def facet_counts(self, field: str, query: str = None, filters: Dict = None) -> Dict[str, int]:
+        """Document count per value of a metadata field, optionally within a query/filter result"""
+        with self._lock:
+            within = None
+            if query is not None:
+                within = FacetIndex.from_ids(self._match_query(query))
+            if filters or self.tombstones:
+                bits = self._filter_bitmap(filters or {})
+                within = bits if within is None else within & bits
+            return self.facets.counts(field, within)
+    
+    def save(self, path: str):
+        """Write the store to a directory in the versioned on-disk format (see index_format.py)
+        
+        Tombstones are compacted away first, so only live documents are written.
+        """
+        with self._compact_lock, self._lock:
+            if self.tombstones:
+                self._compact()
+            with staged_directory(path) as tmp:
+                write_documents(tmp, self.documents)
+                self.index.save(os.path.join(tmp, "inverted"))
+                self.facets.save(os.path.join(tmp, "facets"))
+                write_manifest(tmp, {
+                    "store": self.STORE_KIND,
+                    "num_docs": len(self.documents),
+                    "bm25": self.ranker.save(os.path.join(tmp, "bm25")),
+                    "dense": self.vectors.save(tmp) if self.vectors is not None else None,
+                    "ann": self.ann,
+                })
+            print(f"💾 Saved {len(self.documents)} documents to {path}")
+    
+    @classmethod
+    def load(cls, path: str, embedder=None) -> "SmartVectorStore":
+        """Open a saved store via mmap; data is paged in lazily as queries touch it"""
+        manifest = read_manifest(path)
+        if manifest["store"] != cls.STORE_KIND:
+            raise ValueError(f"{path} holds a {manifest['store']} index, not {cls.STORE_KIND}")
+        store = cls()
+        store.documents = LayeredList(FrozenDocuments(path))
+        store._slots = None
+        store.index = InvertedIndex.load(os.path.join(path, "inverted"))
+        store.facets = FacetIndex.load(os.path.join(path, "facets"))
+        store.ranker = BM25Index.load(os.path.join(path, "bm25"), manifest["bm25"], word_tokens)
+        if manifest["dense"]:
+            store.vectors = DenseIndex.load(path, manifest["dense"], embedder)
+            store.embedder = store.vectors.embedder
+            store.ann = manifest.get("ann", store.vectors.ivf is not None)
+        store._report_size()
+        return store
+
+
+def _service_matches(query_service: str, doc_service: str) -> bool:
+    """Fuzzy service-name match used by the service filter"""
+    query_service = query_service.lower()
+    doc_service = doc_service.lower()
+    # Allow partial matches
+    if query_service in doc_service or doc_service in query_service:
+        return True
+    # Try keyword matching
+    query_keywords = set(query_service.replace('api', '').replace('service', '').split())
+    doc_keywords = set(doc_service.replace('api', '').replace('service', '').split())
+    return bool(query_keywords.intersection(doc_keywords))
 
 def extract_smart_filters(query: str) -> Dict:
     """Extract metadata filters with better service matching"""
@@ -368,10 +733,14 @@ def main():
     print("📚 Loading documents...")
     documents = get_sample_documents()
     
+    # Step 1b: Split into heading/paragraph chunks; each chunk keeps a link to its parent document
+    chunks = chunk_documents(documents, chunk_markdown)
+    print(f"✂️  Split {len(documents)} documents into {len(chunks)} chunks")
+    
     # Step 2: Extract metadata
     print("\n🔍 Extracting metadata with improved system...")
     extractor = FixedLangExtractProcessor()
-    extracted_docs = extractor.extract_metadata(documents)
+    extracted_docs = extractor.extract_metadata(chunks, max_workers=4)
     
     # Display extracted metadata
     print("\n📊 Extracted & Normalized Metadata:")
@@ -413,12 +782,17 @@ def main():
         if with_results:
             for r in with_results:
                 print(f"      - {r['id']}: {r['metadata']['service']} v{r['metadata']['version']} ({r['metadata']['doc_type']})")
+            print(f"   📎 Parent documents: {[parent_id for parent_id, _ in group_by_parent(with_results)]}")
         print("\nActual documents retrieved: ", with_results)
 
         # Search WITHOUT metadata
         without_results = vector_store.search(query, None)
         print(f"\n ❌ Without filtering: Found {len(without_results)} documents")
         print("\n: Actual documents retrieved: ", without_results)
+
+        # Ranked top-k (BM25)
+        ranked = vector_store.search(query, filters, k=3)
+        print(f"\n 🏆 Ranked top-3 (BM25): {[r['id'] for r in ranked]}")
         
 
 if __name__ == "__main__":
@@ -7,7 +7,7 @@ https://github.com/PromtEngineer/LangExtract-RAG
 
 LangExtract + RAG 演示（中文大众点评评论场景）
 结构与原示例保持一致：
-- Documents：由 get_sample_documents() 返回静态样本（未 chunk）
+- Documents：由 get_sample_documents() 返回静态样本，按句切块（chunking.chunk_sentences）后抽取与索引
 - LangExtract：尝试使用 langextract，失败回退到正则抽取；抽取后规范化 metadata
 - Vector DB：未真正向量化，仅用 SmartVectorStore 在内存列表中模拟索引
 - 检索：基于元数据模糊匹配与子串匹配
@@ -17,18 +17,29 @@ LangExtract + RAG 演示（中文大众点评评论场景）
 
 import os
 import re
-from typing import List, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, List, Dict, Optional
 from dotenv import load_dotenv
 
-# aliyun
-from langextract.providers.openai import OpenAILanguageModel
+from adaptive_passes import PassScheduler
+from chunking import chunk_documents, chunk_sentences, extraction_text, group_by_parent
+from extraction_cache import ExtractionCache
+from dense_index import DenseIndex, HashingEmbedder, bitmap_to_mask
+from index_format import (FrozenDocuments, LayeredList, read_manifest, staged_directory, write_documents,
+                          write_manifest)
+from metrics import METRICS
+from model_gateway import ModelGateway, shared_gateway
+from model_providers import get_model, langextract_available, load_langextract
+from review_packing import PACK_INSTRUCTION, ReviewPacker, request_overhead
+from rule_extractor import ReviewRuleExtractor
+from smart_index import BM25Index, FacetIndex, NGramIndex, cjk_bigrams
+from tiered_extraction import ConfidenceRouter
 
-apikey = 'sk-xxxx' # 修改成你自己的key
-model= OpenAILanguageModel(
-            model_id='qwen-plus',
-            base_url='https://dashscope.aliyuncs.com/compatible-mode/v1',
-            api_key=apikey
-            )
+# aliyun：模型在第一次调用 langextract 时才构建（见 model_providers.py）
+apikey = os.getenv('QWEN_API_KEY', 'sk-xxxx') # 修改成你自己的key
+MODEL_ID = os.getenv('QWEN_MODEL_ID', 'qwen-plus')
 
 
 
@@ -63,20 +74,50 @@ def get_sample_documents():
 class FixedLangExtractProcessor:
     """面向中文点评的元数据抽取器；优先使用 langextract（若存在），否则使用正则回退"""
 
-    def __init__(self):
-        try:
-            import langextract as lx
-            self.lx = lx
+    EXTRACTION_PASSES = 2
+    # 自适应轮数：先抽一轮，只有缺少下列类别的文档才补跑（False 时恢复固定 EXTRACTION_PASSES 轮）
+    ADAPTIVE_PASSES = True
+    REQUIRED_CLASSES = ("shop_name", "rating", "sentiment")
+    # 打包模式下每条评论至多出现一次的类别，用于把抽取结果分回各条评论
+    PACK_UNIQUE_CLASSES = ("shop_name", "rating", "review_date", "review_focus", "tags", "sentiment")
+
+    def __init__(self, cache: Optional[ExtractionCache] = None, gateway: Optional[ModelGateway] = None):
+        # 可选的 LLM 抽取结果磁盘缓存（见 extraction_cache.py）
+        self.cache = cache
+        # 所有 langextract 调用都经过限流/重试/熔断网关（见 model_gateway.py），默认与其他抽取器共用
+        self.gateway = gateway or shared_gateway()
+        self.rules = ReviewRuleExtractor()
+        self.passes = PassScheduler(self.REQUIRED_CLASSES, self.EXTRACTION_PASSES, pipeline="rag_cn")
+        self.router = ConfidenceRouter(pipeline="rag_cn")
+        # 只检查是否安装；langextract、examples 与模型都在第一次抽取时才加载/构建
+        self._examples = None
+        if langextract_available():
             self.setup_complete = True
-            print("✅ LangExtract 已初始化（中文模式）")
-        except ImportError:
+            print("✅ LangExtract 已就绪（中文模式）")
+        else:
             print("⚠️  未安装 langextract，使用正则回退逻辑")
             self.setup_complete = False
 
-    def extract_metadata(self, documents: List[Dict]) -> List[Dict]:
-        """对多个文档抽取并规范化 metadata"""
+    @property
+    def lx(self):
+        return load_langextract()
+
+    @property
+    def model(self):
+        return get_model('qwen', model_id=MODEL_ID, api_key=apikey)
+
+    def extract_metadata(self, documents: List[Dict], max_workers: int = 1,
+                         pack_tokens: Optional[int] = None, route_threshold: Optional[float] = None) -> List[Dict]:
+        """对多个文档抽取并规范化 metadata；max_workers > 1 时并发调用 langextract（结果保持输入顺序）。
+        pack_tokens 不为 None 时启用打包模式：多条短评按该 token 预算合并为一次请求（见 review_packing.py）；
+        route_threshold 不为 None 时先跑规则，只有规则置信度低于阈值的评论才调用 langextract（见 tiered_extraction.py）"""
         if not self.setup_complete:
-            return self._enhanced_regex_extraction(documents)
+            results = self._enhanced_regex_extraction(documents)
+            METRICS.inc("extraction_documents_total", len(results), pipeline="rag_cn", method="fallback")
+            return results
+
+        if route_threshold is not None:
+            return self._extract_tiered(list(documents), route_threshold, max_workers, pack_tokens)
 
         # 这里给 langextract 的 prompt（中文描述）
         prompt = """
@@ -90,43 +131,182 @@ class FixedLangExtractProcessor:
         请尽量精确，只输出字段值，不要额外解释。
         """
 
-        examples = [
-            self.lx.data.ExampleData(
-                text="店名：示例店\n评分：5星\n时间：2024-01-01\n评价：味道很好，服务热情。标签：味道好, 服务好",
-                extractions=[
-                    self.lx.data.Extraction(extraction_class="shop_name", extraction_text="示例店", attributes={}),
-                    self.lx.data.Extraction(extraction_class="rating", extraction_text="5", attributes={}),
-                    self.lx.data.Extraction(extraction_class="review_date", extraction_text="2024-01-01", attributes={}),
-                    self.lx.data.Extraction(extraction_class="review_focus", extraction_text="口味", attributes={}),
-                    self.lx.data.Extraction(extraction_class="tags", extraction_text="味道好, 服务好", attributes={}),
-                    self.lx.data.Extraction(extraction_class="sentiment", extraction_text="positive", attributes={}),
-                ]
-            )
-        ]
-
-        extracted_docs = []
-        for doc in documents:
-            print(f"📄 处理文档: {doc['title']}")
+        examples = self._build_examples()
+
+        fingerprint = None
+        if self.cache is not None:
+            fingerprint = self.cache.config_fingerprint(
+                prompt, examples, getattr(self.model, 'model_id', None), self._passes_config())
+
+        if pack_tokens:
+            results = self._extract_packed(list(documents), prompt, examples, fingerprint, pack_tokens, max_workers)
+        elif max_workers <= 1:
+            results = [self._extract_one(doc, prompt, examples, fingerprint) for doc in documents]
+        else:
+            # 并发模式：最多 max_workers 个请求同时在途，executor.map 保证结果与输入顺序一致
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lambda doc: self._extract_one(doc, prompt, examples, fingerprint), documents))
+
+        if self.ADAPTIVE_PASSES:
+            stats = self.passes.stats()
+            print(f"🔁 抽取轮数：实际 {stats['passes_run']} 轮，节省 {stats['passes_saved']} / {stats['passes_budget']} 轮"
+                  f"（{stats['saved_ratio']:.0%}）")
+        return results
+
+    def _extract_packed(self, documents: List[Dict], prompt: str, examples: List, fingerprint: Optional[str],
+                        pack_tokens: int, max_workers: int = 1) -> List[Dict]:
+        """打包模式：缓存未命中的评论按 token 预算分包，每包调用一次 langextract，结果按字符偏移分回各条评论；
+        分回后缺少必需字段的评论再单独走 _extract_one，整包失败时这一包回退到正则抽取"""
+        pack_prompt = prompt + PACK_INSTRUCTION
+        pack_fingerprint = None
+        if self.cache is not None:
+            pack_fingerprint = self.cache.config_fingerprint(
+                pack_prompt, examples, getattr(self.model, 'model_id', None), 1)
+        sources = [dict(doc, content=extraction_text(doc)) for doc in documents]
+        results: List[Optional[Dict]] = [None] * len(documents)
+
+        pending = []
+        for i, source in enumerate(sources):
+            cached = None
+            if pack_fingerprint is not None:
+                # 打包抽取的缓存优先，其次是之前逐条抽取（含打包后补抽）的缓存
+                cached = self.cache.get_extractions(self.cache.make_key(pack_fingerprint, source['content']))
+                if cached is None and fingerprint is not None:
+                    cached = self.cache.get_extractions(self.cache.make_key(fingerprint, source['content']))
+            if cached is not None:
+                results[i] = dict(documents[i], metadata=self._process_and_normalize(cached, source))
+            else:
+                pending.append(i)
+
+        packer = ReviewPacker(pack_tokens)
+        plan = packer.plan([sources[i]['content'] for i in pending], request_overhead(pack_prompt, examples))
+        packs = [[pending[j] for j in pack] for pack in plan]
+
+        def run(pack: List[int]):
+            if len(pack) == 1:
+                results[pack[0]] = self._extract_one(documents[pack[0]], prompt, examples, fingerprint)
+                return
+            print(f"📦 打包抽取 {len(pack)} 条评论")
             try:
-                result = self.lx.extract(
-                    text_or_documents=doc['content'],
-                    prompt_description=prompt,
-                    examples=examples,
-                    model= model,
-                    extraction_passes=2
+                per_doc = packer.extract([sources[i]['content'] for i in pack],
+                                         lambda text: self._extract_passes(text, pack_prompt, examples, 1,
+                                                                           max_char_buffer=len(text)),
+                                         unique_classes=self.PACK_UNIQUE_CLASSES)
+            except Exception as e:
+                print(f"  ⚠️ 打包抽取失败，回退到正则抽取: {e}")
+                per_doc = [None] * len(pack)
+            for i, extractions in zip(pack, per_doc):
+                if extractions is None:
+                    results[i] = dict(documents[i], metadata=self._enhanced_regex_extraction([sources[i]])[0]['metadata'])
+                    METRICS.inc("extraction_documents_total", pipeline="rag_cn", method="fallback")
+                elif self.passes.missing(extractions):
+                    results[i] = self._extract_one(documents[i], prompt, examples, fingerprint)
+                else:
+                    if pack_fingerprint is not None:
+                        self.cache.put_extractions(self.cache.make_key(pack_fingerprint, sources[i]['content']), extractions)
+                    results[i] = dict(documents[i], metadata=self._process_and_normalize(extractions, sources[i]))
+                    METRICS.inc("extraction_documents_total", pipeline="rag_cn", method="llm")
+
+        if max_workers <= 1:
+            for pack in packs:
+                run(pack)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(run, packs))
+
+        stats = packer.stats()
+        print(f"📦 打包模式：{stats['documents']} 条评论合并为 {stats['requests']} 次请求"
+              f"（{stats['unattributed']} 条抽取无法归属，已丢弃）")
+        return results
+
+    def _extract_tiered(self, documents: List[Dict], threshold: float, max_workers: int = 1,
+                        pack_tokens: Optional[int] = None) -> List[Dict]:
+        """分级抽取：先全部跑规则，规则置信度低于 threshold 的评论再交给 langextract（可与打包模式同时使用）"""
+        results = self._enhanced_regex_extraction(documents)
+        confidences = self.rules.confidence_batch(documents, [r['metadata'] for r in results])
+        to_llm = self.router.route(confidences, threshold)
+        METRICS.inc("extraction_documents_total", len(documents) - len(to_llm), pipeline="rag_cn", method="rules")
+        if to_llm:
+            llm_results = self.extract_metadata([documents[i] for i in to_llm], max_workers, pack_tokens)
+            for i, result in zip(to_llm, llm_results):
+                results[i] = result
+
+        stats = self.router.stats()
+        print(f"🧭 分级抽取：{len(to_llm)}/{len(documents)} 条评论送入 LLM（累计调用率 {stats['llm_call_rate']:.0%}）")
+        return results
+
+    def _passes_config(self):
+        """写入缓存指纹的 extraction_passes 配置"""
+        return self.passes.label() if self.ADAPTIVE_PASSES else self.EXTRACTION_PASSES
+
+    def _build_examples(self) -> List:
+        """few-shot 示例；第一次调用 langextract 前才构建，之后复用"""
+        if self._examples is None:
+            self._examples = [
+                self.lx.data.ExampleData(
+                    text="店名：示例店\n评分：5星\n时间：2024-01-01\n评价：味道很好，服务热情。标签：味道好, 服务好",
+                    extractions=[
+                        self.lx.data.Extraction(extraction_class="shop_name", extraction_text="示例店", attributes={}),
+                        self.lx.data.Extraction(extraction_class="rating", extraction_text="5", attributes={}),
+                        self.lx.data.Extraction(extraction_class="review_date", extraction_text="2024-01-01", attributes={}),
+                        self.lx.data.Extraction(extraction_class="review_focus", extraction_text="口味", attributes={}),
+                        self.lx.data.Extraction(extraction_class="tags", extraction_text="味道好, 服务好", attributes={}),
+                        self.lx.data.Extraction(extraction_class="sentiment", extraction_text="positive", attributes={}),
+                    ]
                 )
-                metadata = self._process_and_normalize(result.extractions, doc)
+            ]
+        return self._examples
+
+    def _extract_one(self, doc: Dict, prompt: str, examples: List, fingerprint: Optional[str] = None) -> Dict:
+        """对单条文档（或 chunk）调用 langextract，失败时回退到正则抽取"""
+        print(f"📄 处理文档: {doc['title']}")
+        # chunk 带有表头（店名/评分）作为上下文，单独抽取时也能得到完整字段
+        source = dict(doc, content=extraction_text(doc))
+        with METRICS.time("extraction_seconds", pipeline="rag_cn", method="llm") as labels:
+            try:
+                extractions = self._cached_extract(source['content'], prompt, examples, fingerprint)
+                metadata = self._process_and_normalize(extractions, source)
             except Exception as e:
                 print(f"  ⚠️ LangExtract 抽取失败: {e}")
-                metadata = self._enhanced_regex_extraction([doc])[0]['metadata']
-
-            extracted_docs.append({
-                'id': doc['id'],
-                'title': doc['title'],
-                'content': doc['content'],
-                'metadata': metadata
-            })
-        return extracted_docs
+                metadata = self._enhanced_regex_extraction([source])[0]['metadata']
+                labels['method'] = 'fallback'
+        METRICS.inc("extraction_documents_total", pipeline="rag_cn", method=labels['method'])
+
+        # parent_id / chunk_index 等 chunk 字段原样保留
+        return dict(doc, metadata=metadata)
+
+    def _cached_extract(self, content: str, prompt: str, examples: List, fingerprint: Optional[str] = None):
+        """返回 langextract 的 extractions；若配置了缓存则先查缓存，未命中再调用模型并写回"""
+        key = None
+        if self.cache is not None and fingerprint is not None:
+            key = self.cache.make_key(fingerprint, content)
+            cached = self.cache.get_extractions(key)
+            if cached is not None:
+                return cached
+
+        if self.ADAPTIVE_PASSES:
+            extractions = self.passes.run(lambda: self._extract_passes(content, prompt, examples, 1))
+        else:
+            extractions = self._extract_passes(content, prompt, examples, self.EXTRACTION_PASSES)
+        if key is not None:
+            self.cache.put_extractions(key, extractions)
+        return extractions
+
+    def _extract_passes(self, content: str, prompt: str, examples: List, passes: int,
+                        max_char_buffer: Optional[int] = None) -> List:
+        """以指定轮数调用一次 langextract（经过网关），返回 extractions；
+        max_char_buffer 为 langextract 的分块长度（默认 1000 字符，超出即拆成多次请求）"""
+        kwargs = {"max_char_buffer": max_char_buffer} if max_char_buffer else {}
+        result = self.gateway.call(
+            self.lx.extract,
+            text_or_documents=content,
+            prompt_description=prompt,
+            examples=examples,
+            model=self.model,
+            extraction_passes=passes,
+            **kwargs
+        )
+        return result.extractions
 
     def _process_and_normalize(self, extractions, doc: Dict) -> Dict:
         """处理 langextract 的抽取结果并做规范化"""
@@ -175,146 +355,389 @@ class FixedLangExtractProcessor:
         return metadata
 
     def _enhanced_regex_extraction(self, documents: List[Dict]) -> List[Dict]:
-        """针对中文点评的正则抽取逻辑"""
-        extracted_docs = []
-        for doc in documents:
-            metadata = {
-                'shop': '未知',
-                'rating': 'unknown',
-                'date': '',
-                'focus': '口味',
-                'tags': [],
-                'sentiment': 'neutral'
-            }
-            title = doc.get('title', '')
-            content = doc.get('content', '')
-
-            # 店名优先从 content 中的 "店名：XXX" 提取，其次尝试从 title 提取 "店名 - 描述"
-            shop_match = re.search(r'店名[:：]\s*([^\n]+)', content)
-            if shop_match:
-                metadata['shop'] = shop_match.group(1).strip()
-            else:
-                # title 中可能是 "店名 - 描述"
-                title_match = re.match(r'([\u4e00-\u9fff\w\s]+)\s*[-–—]\s*', title)
-                if title_match:
-                    metadata['shop'] = title_match.group(1).strip()
-
-            # 评分：寻找 "5星", "评分：5" 或单独数字（1-5）
-            rating_match = re.search(r'(\d)\s*星|评分[:：]\s*(\d)', content)
-            if rating_match:
-                metadata['rating'] = rating_match.group(1) if rating_match.group(1) else rating_match.group(2)
-            else:
-                # 尝试在 title 中找
-                r2 = re.search(r'(\d)\s*星', title)
-                if r2:
-                    metadata['rating'] = r2.group(1)
-
-            # 日期：简单匹配 YYYY-MM-DD
-            date_match = re.search(r'(\d{4}-\d{1,2}-\d{1,2})', content)
-            if date_match:
-                metadata['date'] = date_match.group(1)
-
-            # tags：寻找 "标签：" 或句中常见短语
-            tags_match = re.search(r'标签[:：]\s*([^\n]+)', content)
-            if tags_match:
-                tags = [t.strip() for t in re.split(r'[，,；;]', tags_match.group(1)) if t.strip()]
-                metadata['tags'] = tags
-            else:
-                # 简单关键词识别作为 tags
-                possible_tags = []
-                for kw in ['环境好', '服务好', '味道棒', '味道一般', '偏贵', '食材新鲜', '上菜慢', '适合聚餐']:
-                    if kw in content:
-                        possible_tags.append(kw)
-                metadata['tags'] = possible_tags
-
-            # 关注点（focus）：根据关键词判断
-            if any(k in content for k in ['味', '口味', '好吃', '难吃']):
-                metadata['focus'] = '口味'
-            elif any(k in content for k in ['环境', '雅致', '干净', '嘈杂']):
-                metadata['focus'] = '环境'
-            elif any(k in content for k in ['服务', '上菜', '态度']):
-                metadata['focus'] = '服务'
-            elif any(k in content for k in ['价格', '偏贵', '便宜', '人均']):
-                metadata['focus'] = '价格'
-
-            # 情感判定（粗略）
-            if any(p in content for p in ['很好', '棒', '推荐', '满意', '愉快', '喜欢']):
-                metadata['sentiment'] = 'positive'
-            elif any(n in content for n in ['差', '失望', '不满', '不好', '太贵', '一般']):
-                metadata['sentiment'] = 'negative'
-            else:
-                metadata['sentiment'] = 'neutral'
-
-            extracted_docs.append({
-                'id': doc['id'],
-                'title': doc['title'],
-                'content': doc['content'],
-                'metadata': metadata
-            })
-        return extracted_docs
+        """针对中文点评的正则抽取逻辑（预编译规则，见 rule_extractor.py）"""
+        metadatas = self.rules.extract_batch(documents)
+        return [dict(doc, metadata=metadata) for doc, metadata in zip(documents, metadatas)]
 
 
 class SmartVectorStore:
     """内存级别的“智能”索引：基于元数据的模糊匹配 + 文本子串匹配（未做向量化）"""
 
-    def __init__(self):
+    # 索引 manifest 中标识本 store 类型
+    STORE_KIND = "SmartVectorStore/cn"
+
+    # 建立分面位图索引的元数据字段，以及字段缺失时的默认值
+    FACET_FIELDS = {'shop': '未知', 'rating': '0', 'focus': None, 'sentiment': None}
+
+    # 墓碑（已删除/被替换的文档）占全部文档的比例超过 COMPACT_RATIO
+    # 且数量不少于 COMPACT_MIN_TOMBSTONES 时，在后台线程中压缩重建
+    COMPACT_RATIO = 0.3
+    COMPACT_MIN_TOMBSTONES = 1000
+
+    # ann=True 时，向量数达到 IVF_MIN_DOCS 才训练 IVF 索引（之前为暴力检索），
+    # 此后文档数增长到上次训练时的 IVF_RETRAIN_GROWTH 倍即重新训练
+    IVF_MIN_DOCS = 1000
+    IVF_RETRAIN_GROWTH = 2.0
+
+    def __init__(self, ngram_size: int = 2, dense: bool = False, embedder=None, ann: bool = False):
+        # 稠密向量检索为可选模式；未指定 embedder 时使用离线的 HashingEmbedder；
+        # ann=True 时在向量之上再建 IVF 近似最近邻索引
+        self.embedder = embedder or (HashingEmbedder() if dense or ann else None)
+        self.ann = ann
+        self.ngram_size = ngram_size
+        # 写入与压缩后的结构替换持有 _lock；_compact_lock 保证同一时间只有一个压缩任务
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compactor = None
+        # 后台 IVF（重新）训练线程，见 _maybe_train_ivf
+        self._ivf_trainer = None
+        # 每次 _reset 加一；全量重建索引之前开始的压缩会被丢弃
+        self._generation = 0
+        self._reset()
+
+    def _reset(self):
+        """清空全部内部结构"""
+        self._generation += 1
         self.documents = []
+        self.index = NGramIndex(n=self.ngram_size, text_of=self._content_lower)
+        self.facets = FacetIndex(self.FACET_FIELDS)
+        self.ranker = BM25Index(cjk_bigrams)
+        self.vectors = DenseIndex(self.embedder) if self.embedder is not None else None
+        # 已删除/被替换文档的槽位，压缩前所有查询都会跳过
+        self.tombstones = set()
+        self._tombstone_bits = None
+        # 文档 id -> 有效槽位；为 None 时按需重建（如 load 之后）
+        self._slots = {}
+
+    def _content_lower(self, slot: int) -> str:
+        """n-gram 索引校验子串用的文档正文（小写）；索引不另存正文副本，mmap 加载的文档只解码 content 一列"""
+        base = getattr(self.documents, 'base', None)
+        if isinstance(base, FrozenDocuments) and slot < len(base):
+            return base.contents[slot].lower()
+        return self.documents[slot]['content'].lower()
+
+    def _empty_like(self) -> "SmartVectorStore":
+        return type(self)(ngram_size=self.ngram_size, embedder=self.embedder, ann=self.ann)
 
     def add_documents(self, docs: List[Dict]):
-        self.documents = docs
+        """全量入库（替换现有全部文档）"""
+        with self._lock:
+            self._reset()
+            self._append(docs)
+            self._maybe_train_ivf()
+            self._report_size()
         print(f"✅ 已索引 {len(docs)} 条评论")
 
-    def search(self, query: str, filters: Dict = None) -> List[Dict]:
-        """基于 query 的简单检索；若提供 filters 则做元数据过滤"""
-        if not filters:
-            return [doc for doc in self.documents if any(word.lower() in doc['content'].lower() for word in query.split())]
-
-        filtered_docs = []
-        for doc in self.documents:
-            match = True
-            md = doc.get('metadata', {})
-
-            # 店铺模糊匹配（支持部分关键词匹配）
-            if 'shop' in filters:
-                q_shop = filters['shop'].lower()
-                doc_shop = md.get('shop', '未知').lower()
-                if q_shop not in doc_shop and doc_shop not in q_shop:
-                    q_keywords = set(re.sub(r'(店|餐厅|馆|酒楼|烧烤|面馆)', '', q_shop).split())
-                    doc_keywords = set(re.sub(r'(店|餐厅|馆|酒楼|烧烤|面馆)', '', doc_shop).split())
-                    if not q_keywords.intersection(doc_keywords):
-                        match = False
-
-            # 评分精确匹配或大于等于
-            if 'rating' in filters:
-                try:
-                    target = int(filters['rating'])
-                    try:
-                        doc_rating = int(md.get('rating', '0'))
-                    except:
-                        doc_rating = 0
-                    if doc_rating < target:
-                        match = False
-                except:
-                    # 非数字则做包含匹配
-                    if filters['rating'] != md.get('rating'):
-                        match = False
-
-            # 关注点匹配（exact）
-            if 'focus' in filters:
-                if filters['focus'] != md.get('focus'):
-                    match = False
-
-            # 情感过滤（positive/negative/neutral）
-            if 'sentiment' in filters:
-                if filters['sentiment'] != md.get('sentiment'):
-                    match = False
-
-            if match:
-                # 最后再做一次内容关键词匹配，确保与 query 语义相关（基于子串）
-                if any(word.lower() in doc['content'].lower() for word in query.split()):
-                    filtered_docs.append(doc)
-
-        return filtered_docs
+    def _append(self, docs: List[Dict], vecs=None):
+        """把 docs 追加到各结构末尾的新槽位"""
+        # 中文评论没有空格分词，按字符 n-gram 建索引，查询时对 n-gram 倒排表求交后再校验子串；
+        # 元数据按字段建位图索引，过滤时做位图求与
+        for slot, doc in enumerate(docs, len(self.documents)):
+            self.documents.append(doc)
+            self.index.add(slot, doc['content'].lower())
+            self.facets.add(slot, doc.get('metadata', {}))
+            self.ranker.add(slot, doc['content'])
+            if self._slots is not None:
+                self._slots[doc['id']] = slot
+        if self.vectors is not None and docs:
+            if vecs is None:
+                self.vectors.add([doc['content'] for doc in docs])
+            else:
+                self.vectors.add_vectors(vecs)
+
+    def upsert(self, docs: List[Dict]):
+        """按 id 插入或替换文档：只索引传入的文档，代价与语料规模无关；
+        被替换的旧版本标记为墓碑，不做原地改写"""
+        # 同一批中 id 重复时以最后一条为准（与逐条写入的结果一致）
+        latest = {}
+        for doc in docs:
+            latest.pop(doc['id'], None)
+            latest[doc['id']] = doc
+        docs = list(latest.values())
+        with self._lock:
+            slots = self._slot_map()
+            for doc in docs:
+                if doc['id'] in slots:
+                    self._tombstone(slots[doc['id']])
+            self._append(docs)
+            self._maybe_train_ivf()
+            self._report_size()
+            self._maybe_compact()
+        print(f"✅ 已写入 {len(docs)} 条评论（新增或更新）")
+
+    def delete(self, ids: Iterable[Any]) -> int:
+        """按 id 删除文档，返回实际删除的条数"""
+        deleted = 0
+        with self._lock:
+            slots = self._slot_map()
+            for doc_id in ids:
+                slot = slots.pop(doc_id, None)
+                if slot is not None:
+                    self._tombstone(slot)
+                    deleted += 1
+            self._report_size()
+            self._maybe_compact()
+        return deleted
+
+    def _slot_map(self) -> Dict[Any, int]:
+        if self._slots is None:
+            self._slots = {}
+            for slot in range(len(self.documents)):
+                if slot not in self.tombstones:
+                    self._slots[self.documents[slot]['id']] = slot
+        return self._slots
+
+    def _tombstone(self, slot: int):
+        self.tombstones.add(slot)
+        self._tombstone_bits = None
+
+    def _live_bits(self) -> int:
+        """未被删除的文档位图"""
+        bits = self.facets.all_bits()
+        if self.tombstones:
+            if self._tombstone_bits is None:
+                self._tombstone_bits = FacetIndex.from_ids(self.tombstones)
+            bits &= ~self._tombstone_bits
+        return bits
+
+    def _report_size(self):
+        """上报有效文档数与墓碑数（指标关闭时为空操作）"""
+        if METRICS.enabled:
+            METRICS.set_gauge("index_documents", len(self.documents) - len(self.tombstones), store=self.STORE_KIND)
+            METRICS.set_gauge("index_tombstones", len(self.tombstones), store=self.STORE_KIND)
+
+    def _maybe_train_ivf(self):
+        """ann=True 且达到（重新）训练条件时，在后台线程训练 IVF 索引；调用方需持有 _lock"""
+        if not self.ann or self.vectors is None:
+            return
+        if not self.vectors.ivf_due(self.IVF_MIN_DOCS, self.IVF_RETRAIN_GROWTH):
+            return
+        if self._ivf_trainer is None or not self._ivf_trainer.is_alive():
+            self._ivf_trainer = threading.Thread(target=self._train_ivf, daemon=True)
+            self._ivf_trainer.start()
+
+    def _train_ivf(self):
+        # 锁内只取向量快照；k-means 在锁外进行，期间查询照常使用暴力检索（或旧的 IVF 索引），训练完再加锁换上
+        with self._lock:
+            vectors = self.vectors
+            if vectors is None or not vectors.ivf_due(self.IVF_MIN_DOCS, self.IVF_RETRAIN_GROWTH):
+                return
+            size, segments = vectors.snapshot()
+        ivf = vectors.train_ivf(segments)
+        with self._lock:
+            # 训练期间 add_documents 或压缩换掉了向量索引，这次训练已经过时
+            if self.vectors is vectors:
+                vectors.install_ivf(ivf, size)
+
+    def wait_for_ivf(self, timeout: Optional[float] = None) -> bool:
+        """等待后台 IVF 训练结束；超时返回 False"""
+        thread = self._ivf_trainer
+        if thread is None:
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def _maybe_compact(self):
+        n = len(self.tombstones)
+        if n < self.COMPACT_MIN_TOMBSTONES or n <= self.COMPACT_RATIO * len(self.documents):
+            return
+        if self._compactor is None or not self._compactor.is_alive():
+            self._compactor = self.compact(background=True)
+
+    def compact(self, background: bool = False) -> Optional[threading.Thread]:
+        """用有效文档重建全部结构，清除墓碑。
+
+        重建在锁外进行，期间查询与写入照常；重建期间发生的写入会在替换前补放到新结构上；
+        期间 add_documents 替换了整个语料时，这次重建直接丢弃。
+        background=True 时在守护线程中执行并返回该线程。
+        """
+        if background:
+            thread = threading.Thread(target=self.compact, daemon=True)
+            thread.start()
+            return thread
+        with self._compact_lock:
+            self._compact()
+        return None
+
+    def _compact(self):
+        # 调用方需持有 _compact_lock
+        with self._lock:
+            generation = self._generation
+            documents, vectors = self.documents, self.vectors
+            end = len(documents)
+            tombstones = set(self.tombstones)
+        # end 之前的槽位不会被改写，可以在锁外读取
+        live = [slot for slot in range(end) if slot not in tombstones]
+        fresh = self._empty_like()
+        fresh._append([documents[slot] for slot in live],
+                      vectors.take(live) if vectors is not None else None)
+        # 压缩线程本来就在锁外，新结构的 IVF 直接在这里训练
+        if fresh.ann and fresh.vectors is not None:
+            fresh.vectors.maybe_train_ivf(self.IVF_MIN_DOCS, self.IVF_RETRAIN_GROWTH)
+        with self._lock:
+            if self._generation != generation:
+                # 重建期间 add_documents 替换了整个语料，这次重建已经过时
+                return
+            tail = list(range(end, len(self.documents)))
+            fresh._append([self.documents[slot] for slot in tail],
+                          self.vectors.take(tail) if self.vectors is not None else None)
+            new_slot = {old: new for new, old in enumerate(live + tail)}
+            for slot in self.tombstones - tombstones:
+                fresh._tombstone(new_slot[slot])
+            fresh._slots = (None if self._slots is None else
+                            {doc_id: new_slot[slot] for doc_id, slot in self._slots.items()})
+            for attr in ('documents', 'index', 'facets', 'ranker', 'vectors',
+                         'tombstones', '_tombstone_bits', '_slots'):
+                setattr(self, attr, getattr(fresh, attr))
+            self._maybe_train_ivf()
+            self._report_size()
+
+    def _match_query(self, query: str) -> List[int]:
+        """返回内容包含任一查询词（子串）的文档下标，保持原始顺序"""
+        matched = set()
+        for word in query.split():
+            matched |= self.index.search(word.lower())
+        return sorted(matched)
+
+    def _filter_bitmap(self, filters: Dict) -> int:
+        """返回满足全部过滤条件的（未删除）文档位图"""
+        bits = self._live_bits()
+
+        # 店铺模糊匹配（支持部分关键词匹配），对每个不同店名只判断一次
+        if 'shop' in filters:
+            bits &= self.facets.select('shop', lambda value: _shop_matches(filters['shop'], value))
+
+        # 评分精确匹配或大于等于
+        if 'rating' in filters:
+            bits &= self.facets.select('rating', lambda value: _rating_matches(filters['rating'], value))
+
+        # 关注点匹配（exact）
+        if 'focus' in filters:
+            bits &= self.facets.bitmap('focus', filters['focus'])
+
+        # 情感过滤（positive/negative/neutral）
+        if 'sentiment' in filters:
+            bits &= self.facets.bitmap('sentiment', filters['sentiment'])
+
+        return bits
+
+    def search(self, query: str, filters: Dict = None, k: Optional[int] = None) -> List[Dict]:
+        """基于 query 的简单检索；若提供 filters 则做元数据过滤
+
+        k=None 时返回全部命中文档（按原始顺序，与原实现一致）；
+        指定 k 时按 BM25（字符 bigram）排序，只返回得分最高的 k 条。
+        """
+        start = time.perf_counter()
+        with self._lock:
+            if k is not None:
+                # 排序模式：BM25 打分 + 有界堆取 top-k
+                allowed = set(FacetIndex.ids(self._filter_bitmap(filters))) if filters else None
+                stats = {}
+                results = [self.documents[i] for i, _ in self.ranker.top_k(query, k, allowed, self.tombstones, stats)]
+                scanned = stats['scanned']
+            else:
+                matched = self._match_query(query)
+                scanned = len(matched)
+                if filters:
+                    allowed = set(FacetIndex.ids(self._filter_bitmap(filters)))
+                    matched = [i for i in matched if i in allowed]
+                elif self.tombstones:
+                    matched = [i for i in matched if i not in self.tombstones]
+                results = [self.documents[i] for i in matched]
+        METRICS.record_search(self.STORE_KIND, 'bm25' if k is not None else 'match', bool(filters),
+                              time.perf_counter() - start, scanned, len(results))
+        return results
+
+    def search_vectors(self, query: str, filters: Dict = None, k: int = 5,
+                       nprobe: Optional[int] = None) -> List[Dict]:
+        """稠密向量检索：按向量相似度返回 top-k 条评论"""
+        return self.search_vectors_batch([query], filters, k, nprobe)[0]
+
+    def search_vectors_batch(self, queries: List[str], filters: Dict = None, k: int = 5,
+                             nprobe: Optional[int] = None) -> List[List[Dict]]:
+        """多条查询一次矩阵乘法完成向量检索；元数据过滤作为掩码在取 top-k 之前生效。
+        启用 ann 时，nprobe 越大召回越高、延迟越高"""
+        with self._lock:
+            if self.vectors is None:
+                raise RuntimeError("未启用向量检索：请使用 SmartVectorStore(dense=True) 或传入 embedder")
+            mask = None
+            if filters or self.tombstones:
+                mask = bitmap_to_mask(self._filter_bitmap(filters or {}), len(self.documents))
+            hits = self.vectors.search(queries, k, mask, nprobe)
+            return [[self.documents[i] for i, _ in row] for row in hits]
+
+    def facet_counts(self, field: str, query: str = None, filters: Dict = None) -> Dict[str, int]:
+        """统计某个元数据字段每个取值的文档数，可限定在某次查询/过滤的结果范围内（用于下钻展示）"""
+        with self._lock:
+            within = None
+            if query is not None:
+                within = FacetIndex.from_ids(self._match_query(query))
+            if filters or self.tombstones:
+                bits = self._filter_bitmap(filters or {})
+                within = bits if within is None else within & bits
+            return self.facets.counts(field, within)
+
+    def save(self, path: str):
+        """将索引写入目录（版本化磁盘格式，见 index_format.py）；有墓碑时先压缩，只写入有效文档"""
+        with self._compact_lock, self._lock:
+            if self.tombstones:
+                self._compact()
+            with staged_directory(path) as tmp:
+                write_documents(tmp, self.documents)
+                self.index.save(os.path.join(tmp, "ngram"))
+                self.facets.save(os.path.join(tmp, "facets"))
+                write_manifest(tmp, {
+                    "store": self.STORE_KIND,
+                    "num_docs": len(self.documents),
+                    "ngram_size": self.ngram_size,
+                    "bm25": self.ranker.save(os.path.join(tmp, "bm25")),
+                    "dense": self.vectors.save(tmp) if self.vectors is not None else None,
+                    "ann": self.ann,
+                })
+            print(f"💾 已保存 {len(self.documents)} 条评论到 {path}")
+
+    @classmethod
+    def load(cls, path: str, embedder=None) -> "SmartVectorStore":
+        """以 mmap 方式打开已保存的索引，打开耗时与索引大小无关，数据在查询访问时按页读入"""
+        manifest = read_manifest(path)
+        if manifest["store"] != cls.STORE_KIND:
+            raise ValueError(f"{path} 是 {manifest['store']} 索引，不是 {cls.STORE_KIND}")
+        store = cls(ngram_size=manifest["ngram_size"])
+        store.documents = LayeredList(FrozenDocuments(path))
+        store._slots = None
+        store.index = NGramIndex.load(os.path.join(path, "ngram"), n=manifest["ngram_size"],
+                                      text_of=store._content_lower, size=len(store.documents))
+        store.facets = FacetIndex.load(os.path.join(path, "facets"))
+        store.ranker = BM25Index.load(os.path.join(path, "bm25"), manifest["bm25"], cjk_bigrams)
+        if manifest["dense"]:
+            store.vectors = DenseIndex.load(path, manifest["dense"], embedder)
+            store.embedder = store.vectors.embedder
+            store.ann = manifest.get("ann", store.vectors.ivf is not None)
+        store._report_size()
+        return store
+
+
+def _shop_matches(q_shop: str, doc_shop: str) -> bool:
+    """店铺模糊匹配：互相包含，或去掉店铺类型词后有共同关键词"""
+    q_shop = q_shop.lower()
+    doc_shop = doc_shop.lower()
+    if q_shop in doc_shop or doc_shop in q_shop:
+        return True
+    q_keywords = set(re.sub(r'(店|餐厅|馆|酒楼|烧烤|面馆)', '', q_shop).split())
+    doc_keywords = set(re.sub(r'(店|餐厅|馆|酒楼|烧烤|面馆)', '', doc_shop).split())
+    return bool(q_keywords.intersection(doc_keywords))
+
+
+def _rating_matches(target_rating: str, doc_rating) -> bool:
+    """评分过滤：数字目标按 >= 比较，非数字目标做精确匹配"""
+    try:
+        target = int(target_rating)
+    except (TypeError, ValueError):
+        return target_rating == doc_rating
+    try:
+        return int(doc_rating) >= target
+    except (TypeError, ValueError):
+        return 0 >= target
 
 
 def extract_smart_filters(query: str) -> Dict:
@@ -366,10 +789,14 @@ def main():
     print("📚 正在加载样本评论...")
     documents = get_sample_documents()
 
+    # Step 1b: 按句切块，每个 chunk 保留指向原评论的 parent_id
+    chunks = chunk_documents(documents, chunk_sentences)
+    print(f"✂️  {len(documents)} 条评论切分为 {len(chunks)} 个 chunk")
+
     # Step 2: 抽取 metadata
     print("\n🔍 使用增强抽取系统提取元数据...")
     extractor = FixedLangExtractProcessor()
-    extracted_docs = extractor.extract_metadata(documents)
+    extracted_docs = extractor.extract_metadata(chunks, max_workers=4)
 
     # 显示抽取结果
     print("\n📊 抽取并规范化的元数据：")
@@ -411,12 +838,17 @@ def main():
             for r in with_results:
                 md = r['metadata']
                 print(f"      - {r['id']}: {md['shop']} {md['rating']}星 （关注点: {md['focus']}，情感: {md['sentiment']})")
+            print(f"   📎 所属评论: {[parent_id for parent_id, _ in group_by_parent(with_results)]}")
         print("\n 实际返回文档: ", with_results)
 
         without_results = vector_store.search(query, None)
         print(f"\n ❌ 不使用过滤条件检索到: {len(without_results)} 条评论")
         print("\n 实际返回文档: ", without_results)
 
+        # BM25 排序后的 top-k
+        ranked = vector_store.search(query, filters, k=3)
+        print(f"\n 🏆 BM25 排序 top-3: {[r['id'] for r in ranked]}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,225 @@
+"""
+分阶段指标采集与导出（Prometheus 文本格式 / JSON 快照）
+
+说明：
+- 全局注册表 METRICS，默认关闭（环境变量 RAG_METRICS=1 或调用 METRICS.enable() 开启）。
+  关闭时 inc / observe / set_gauge / time 都在第一行直接返回，埋点开销只有一次属性判断与函数调用。
+- 三种指标：计数器（counter）、仪表（gauge）、直方图（histogram，固定桶，累计计数），按 (名称, 标签) 区分序列。
+- 已埋点的指标见 METRIC_HELP：
+  - 每篇文档的抽取耗时与方式（llm / fallback，即 extract_triples 里 used_model 的统计口径）
+  - ExtractionCache 命中/未命中
+  - SmartVectorStore.search 延迟直方图、扫描的候选数与返回数
+  - 索引中的有效文档数与墓碑数
+- to_prometheus() 输出 Prometheus 文本格式；snapshot() 返回 JSON 友好的字典，并附带
+  LLM 占比、缓存命中率、候选/返回比等派生值；write_json(path) 直接写文件。
+"""
+
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 延迟直方图的默认桶（秒）：覆盖规则抽取的微秒级到 LLM 调用的十秒级
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_HELP = {
+    "extraction_seconds": ("histogram", "每篇文档（或 chunk）的抽取耗时"),
+    "extraction_documents_total": ("counter", "按方式（llm / fallback / rules）统计的抽取文档数"),
+    "extraction_passes_total": ("counter", "自适应多轮抽取实际调用的轮数"),
+    "extraction_passes_saved_total": ("counter", "自适应多轮抽取相对固定轮数节省的轮数"),
+    "tiered_routing_total": ("counter", "分级抽取中采用规则结果（rules）与送入 LLM（llm）的文档数"),
+    "model_gateway_requests_total": ("counter", "模型网关的调用结果（calls / ok / retries / failed / short_circuited）"),
+    "deadline_calls_total": ("counter", "截止时间模式下的调用结果（model / hedged / deadline / error）"),
+    "extraction_cache_requests_total": ("counter", "LLM 抽取缓存的查询次数（hit / miss）"),
+    "search_seconds": ("histogram", "SmartVectorStore.search 的延迟"),
+    "search_requests_total": ("counter", "SmartVectorStore.search 的调用次数"),
+    "search_candidates_scanned_total": ("counter", "检索时扫描（匹配或打分）的候选文档数"),
+    "search_results_returned_total": ("counter", "检索返回的文档数"),
+    "index_documents": ("gauge", "索引中的有效文档数（不含墓碑）"),
+    "index_tombstones": ("gauge", "索引中尚未压缩掉的墓碑数"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_value(value: float) -> str:
+    """整数值按整数输出，其余用 repr 保留全部精度"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[int]:
+        out, total = [], 0
+        for c in self.counts:
+            total += c
+            out.append(total)
+        return out
+
+
+class MetricsRegistry:
+    """线程安全的指标注册表；enabled=False 时所有记录操作都是空操作"""
+
+    def __init__(self, enabled: bool = False, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    # ------------------------------------------------------------------
+    # 记录
+    # ------------------------------------------------------------------
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = _Histogram(self.buckets)
+            hist.observe(value)
+
+    @contextlib.contextmanager
+    def _timer(self, name: str, labels: Dict):
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def time(self, name: str, **labels):
+        """with METRICS.time("extraction_seconds", pipeline=...) as labels: ...；块内可修改 labels（如方式）"""
+        if not self.enabled:
+            return contextlib.nullcontext(labels)
+        return self._timer(name, labels)
+
+    def record_search(self, store: str, mode: str, filtered: bool, seconds: float, scanned: int, returned: int):
+        """一次检索的延迟、扫描候选数与返回数"""
+        if not self.enabled:
+            return
+        labels = {"store": store, "mode": mode, "filtered": "true" if filtered else "false"}
+        self.observe("search_seconds", seconds, **labels)
+        self.inc("search_requests_total", **labels)
+        self.inc("search_candidates_scanned_total", scanned, **labels)
+        self.inc("search_results_returned_total", returned, **labels)
+
+    # ------------------------------------------------------------------
+    # 导出
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ""
+        escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                   for k, v in items)
+        return "{" + ",".join(escaped) + "}"
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式（text/plain; version=0.0.4）"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            hists = {k: (h.buckets, h.cumulative(), h.sum, h.count) for k, h in self._histograms.items()}
+        lines = []
+        names = sorted({k[0] for k in counters} | {k[0] for k in gauges} | {k[0] for k in hists})
+        for name in names:
+            kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{self._format_labels(labels)} {_format_value(value)}")
+            for (n, labels), value in sorted(gauges.items()):
+                if n == name:
+                    lines.append(f"{name}{self._format_labels(labels)} {_format_value(value)}")
+            for (n, labels), (buckets, cumulative, total, count) in sorted(hists.items()):
+                if n != name:
+                    continue
+                for le, c in zip(buckets, cumulative):
+                    lines.append(f"{name}_bucket{self._format_labels(labels, ('le', f'{le:g}'))} {c}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, ('le', '+Inf'))} {count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict:
+        """JSON 友好的快照：原始序列 + 派生比率"""
+        with self._lock:
+            counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self._counters.items())]
+            gauges = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self._gauges.items())]
+            hists = [{"name": n, "labels": dict(l), "buckets": list(h.buckets), "counts": h.cumulative(),
+                      "sum": h.sum, "count": h.count, "mean": h.sum / h.count if h.count else 0.0}
+                     for (n, l), h in sorted(self._histograms.items())]
+        return {"timestamp": time.time(), "counters": counters, "gauges": gauges, "histograms": hists,
+                "derived": self._derived(counters)}
+
+    @staticmethod
+    def _derived(counters: List[Dict]) -> Dict:
+        def total(name, **match):
+            return sum(c["value"] for c in counters
+                       if c["name"] == name and all(c["labels"].get(k) == v for k, v in match.items()))
+
+        derived: Dict = {}
+        for pipeline in sorted({c["labels"].get("pipeline") for c in counters
+                                if c["name"] == "extraction_documents_total"}):
+            llm = total("extraction_documents_total", pipeline=pipeline, method="llm")
+            docs = total("extraction_documents_total", pipeline=pipeline)
+            derived[f"llm_ratio[{pipeline}]"] = llm / docs if docs else 0.0
+        lookups = total("extraction_cache_requests_total")
+        if lookups:
+            derived["cache_hit_rate"] = total("extraction_cache_requests_total", result="hit") / lookups
+        returned = total("search_results_returned_total")
+        scanned = total("search_candidates_scanned_total")
+        if scanned:
+            derived["search_returned_per_scanned"] = returned / scanned
+        return derived
+
+    def write_json(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+
+METRICS = MetricsRegistry(enabled=os.getenv("RAG_METRICS") == "1")
@@ -0,0 +1,373 @@
+"""
+本地 LLM 替身：离线压测抽取路径（并发、重试、缓存）
+
+说明：
+- 返回确定性的抽取结果：同一段文本永远得到同样的 extractions，内容由本仓库的规则抽取器生成
+  （点评元数据 -> rule_extractor.ReviewRuleExtractor，技术文档 -> DocRuleExtractor，
+  观点三元组 -> EnhancedOpinionExtractorV7._fallback_extract）。任务类型按 examples / prompt 中的抽取类别名判断。
+- MockBehavior 控制"服务端"表现：延迟分布（对数正态，median_ms 为中位数，sigma=0 时为固定延迟）、
+  错误率（MockServerError / HTTP 500）、限流（令牌桶 rate_limit_rps，或按 throttle_rate 随机；
+  MockRateLimitError / HTTP 429 + Retry-After），并统计调用数、错误数、被限流数、最大并发。
+  随机数由 seed 决定，同样的调用顺序得到同样的延迟与错误序列。
+- MockLangExtract 与 langextract 一样按 max_char_buffer（默认 1000 字符）在句子边界分块，每块每轮记一次请求，
+  因此长文本（如打包的多条评论）不传足够大的 max_char_buffer 时，调用数会如实反映被拆成的多次请求。
+- 三种接入方式：
+  1. 进程内替身模块：model_providers.set_langextract(MockLangExtract(behavior))，之后构造的
+     FixedLangExtractProcessor / EnhancedOpinionExtractorV7 会把它当作 langextract（无需安装 langextract）。
+  2. 替身模型：model_providers.get_model("mock", ...) 得到 MockLanguageModel，实现 langextract 模型的
+     infer(batch_prompts)，可与真实 langextract 一起使用。
+  3. HTTP 服务：`python mock_llm.py --port 8000`，提供 OpenAI 兼容的 POST /v1/chat/completions 与 GET /v1/models；
+     设置 QWEN_BASE_URL=http://127.0.0.1:8000/v1 后，内置的 qwen 提供器就会请求本地服务。
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from rule_extractor import DocRuleExtractor, ReviewRuleExtractor
+
+
+class MockServerError(RuntimeError):
+    """模拟的服务端错误（HTTP 500）"""
+
+
+class MockRateLimitError(RuntimeError):
+    """模拟的限流（HTTP 429）；retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+class MockBehavior:
+    """替身服务的延迟/错误/限流设置与调用统计（线程安全）"""
+
+    def __init__(self, median_ms: float = 50.0, sigma: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rps: Optional[float] = None, throttle_rate: float = 0.0, seed: int = 0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rate_limit_rps = rate_limit_rps
+        self.throttle_rate = throttle_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = rate_limit_rps or 0.0
+        self._refilled = time.monotonic()
+        self._in_flight = 0
+        self.stats = {"calls": 0, "ok": 0, "errors": 0, "throttled": 0, "max_in_flight": 0}
+
+    def _take_token(self) -> Optional[float]:
+        """令牌桶：取到令牌返回 None，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        rps = self.rate_limit_rps
+        self._tokens = min(rps, self._tokens + (now - self._refilled) * rps)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return None
+        return (1 - self._tokens) / rps
+
+    def call(self):
+        """模拟一次请求：可能立即被限流（MockRateLimitError），否则等待一段延迟后成功或抛出 MockServerError"""
+        with self._lock:
+            self.stats["calls"] += 1
+            retry_after = self._take_token() if self.rate_limit_rps else None
+            if retry_after is None and self._rng.random() < self.throttle_rate:
+                retry_after = 1.0
+            if retry_after is not None:
+                self.stats["throttled"] += 1
+                raise MockRateLimitError(retry_after)
+            delay = self.median_ms / 1000 * math.exp(self.sigma * self._rng.gauss(0, 1))
+            failed = self._rng.random() < self.error_rate
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+        try:
+            time.sleep(delay)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self.stats["errors" if failed else "ok"] += 1
+        if failed:
+            raise MockServerError("mock server error")
+
+
+# ----------------------------------------------------------------------
+# 确定性抽取结果
+# ----------------------------------------------------------------------
+_review_rules = ReviewRuleExtractor()
+_doc_rules = DocRuleExtractor()
+_opinion_extractor = None
+
+
+def _opinion_triples(text: str) -> List[Dict]:
+    global _opinion_extractor
+    if _opinion_extractor is None:
+        from langextract_opinion_extraction import EnhancedOpinionExtractorV7
+
+        _opinion_extractor = EnhancedOpinionExtractorV7(qwen_apikey="mock")
+    return _opinion_extractor._fallback_extract(text)
+
+
+def detect_task(classes: Sequence[str]) -> str:
+    """按抽取类别名判断任务：review / doc / opinion / unknown"""
+    classes = set(classes)
+    if "shop_name" in classes:
+        return "review"
+    if "service_name" in classes:
+        return "doc"
+    if "opinion_triple" in classes:
+        return "opinion"
+    return "unknown"
+
+
+_PACK_HEADER_RE = re.compile(r"【评论 (\d+)】\n")
+
+
+def mock_extractions(text: str, task: str) -> List[Tuple[str, str, Dict]]:
+    """返回 [(extraction_class, extraction_text, attributes), ...]，与各抽取器 examples 中的类别一致；
+    打包的多条评论（见 review_packing.py）逐条抽取后按顺序拼接，并按 PACK_INSTRUCTION 在 attributes 中标注 review 编号"""
+    if _PACK_HEADER_RE.search(text):
+        parts = _PACK_HEADER_RE.split(text)
+        return [(cls, txt, {"review": int(number)})
+                for number, part in zip(parts[1::2], parts[2::2]) if part.strip()
+                for cls, txt in _single_extractions(part.strip(), task)]
+    return [(cls, txt, {}) for cls, txt in _single_extractions(text, task)]
+
+
+def _single_extractions(text: str, task: str) -> List[Tuple[str, str]]:
+    """单条文本的 [(extraction_class, extraction_text), ...]"""
+    if task == "review":
+        md = _review_rules.extract("", text)
+        out = []
+        if md["shop"] != "未知":
+            out.append(("shop_name", md["shop"]))
+        if md["rating"] != "unknown":
+            out.append(("rating", md["rating"]))
+        if md["date"]:
+            out.append(("review_date", md["date"]))
+        out.append(("review_focus", md["focus"]))
+        if md["tags"]:
+            out.append(("tags", ", ".join(md["tags"])))
+        out.append(("sentiment", md["sentiment"]))
+        return out
+    if task == "doc":
+        # 文档正文的第一行通常是标题（"# Authentication API v2.0"）
+        title = text.lstrip("# ").split("\n", 1)[0]
+        md = _doc_rules.extract(title, text)
+        out = []
+        if md["service"] != "unknown":
+            out.append(("service_name", md["service"]))
+        if md["version"] != "unknown":
+            out.append(("version_number", md["version"]))
+        out.append(("document_category", md["doc_type"]))
+        out.extend(("rate_limits", r) for r in md["rate_limits"])
+        if md["deprecated"]:
+            out.append(("deprecated_items", "deprecated"))
+        return out
+    if task == "opinion":
+        return [("opinion_triple", json.dumps(t, ensure_ascii=False)) for t in _opinion_triples(text)]
+    return []
+
+
+# ----------------------------------------------------------------------
+# 接入方式 1：进程内替身模块（代替 langextract）
+# ----------------------------------------------------------------------
+class _Extraction:
+    def __init__(self, extraction_class: str, extraction_text: str, attributes: Optional[Dict] = None, **kwargs):
+        self.extraction_class = extraction_class
+        self.extraction_text = extraction_text
+        self.attributes = attributes or {}
+
+
+class _ExampleData:
+    def __init__(self, text: str, extractions: List[_Extraction]):
+        self.text = text
+        self.extractions = extractions
+
+
+DEFAULT_MAX_CHAR_BUFFER = 1000  # 与 langextract.extract 的默认值一致
+_SENTENCE_END_RE = re.compile(r"(?<=[。！？!?\n])")
+
+
+def count_chunks(text: str, max_char_buffer: int = DEFAULT_MAX_CHAR_BUFFER) -> int:
+    """按 langextract 的分块方式估算请求块数：句子依次装入不超过 max_char_buffer 的块，超长句子按长度硬切"""
+    chunks, used = 0, 0
+    for sentence in _SENTENCE_END_RE.split(text):
+        if not sentence:
+            continue
+        if len(sentence) > max_char_buffer:
+            full, used_rest = divmod(len(sentence), max_char_buffer)
+            chunks += full + (1 if used else 0)
+            used = used_rest
+        elif used + len(sentence) > max_char_buffer:
+            chunks += 1
+            used = len(sentence)
+        else:
+            used += len(sentence)
+    return max(1, chunks + (1 if used else 0))
+
+
+class MockLangExtract:
+    """与 langextract 模块接口相同的替身：extract(...) 与 data.ExampleData / data.Extraction"""
+
+    data = SimpleNamespace(ExampleData=_ExampleData, Extraction=_Extraction)
+
+    def __init__(self, behavior: Optional[MockBehavior] = None):
+        self.behavior = behavior or MockBehavior()
+
+    def extract(self, text_or_documents: str, prompt_description: str = "", examples=None,
+                model=None, model_id: Optional[str] = None, extraction_passes: int = 1,
+                max_char_buffer: int = DEFAULT_MAX_CHAR_BUFFER, **kwargs):
+        # 真实服务上每个分块、每一轮（extraction_passes）都是一次请求
+        for _ in range(max(1, extraction_passes) * count_chunks(text_or_documents, max_char_buffer)):
+            self.behavior.call()
+        classes = [ex.extraction_class for example in (examples or []) for ex in example.extractions]
+        extractions = [_Extraction(cls, txt, attrs)
+                       for cls, txt, attrs in mock_extractions(text_or_documents, detect_task(classes))]
+        return SimpleNamespace(extractions=extractions, text=text_or_documents)
+
+
+# ----------------------------------------------------------------------
+# 接入方式 2/3 共用：从 langextract 生成的 prompt 中取出待抽取文本并格式化输出
+# ----------------------------------------------------------------------
+_CLASS_NAMES = ("shop_name", "service_name", "opinion_triple")
+
+
+def answer_prompt(prompt: str) -> str:
+    """
+    langextract 的 prompt 形如 "<描述> ... Q: <示例> A: <示例输出> ... Q: <待抽取文本> A:"，
+    取最后一个 "Q:" 之后的文本抽取，按 langextract 默认的 fenced JSON 格式返回。
+    """
+    text = prompt.rsplit("Q:", 1)[-1]
+    text = re.sub(r"\s*A:\s*$", "", text).strip()
+    task = detect_task([name for name in _CLASS_NAMES if name in prompt])
+    items = [{cls: txt, f"{cls}_attributes": attrs} for cls, txt, attrs in mock_extractions(text, task)]
+    return "```json\n" + json.dumps({"extractions": items}, ensure_ascii=False, indent=2) + "\n```"
+
+
+class MockLanguageModel:
+    """langextract 模型接口的替身：infer(batch_prompts) 逐条给出 [ScoredOutput]"""
+
+    def __init__(self, model_id: str = "mock", behavior: Optional[MockBehavior] = None, **kwargs):
+        self.model_id = model_id
+        self.behavior = behavior or MockBehavior()
+
+    def infer(self, batch_prompts: Sequence[str], **kwargs) -> Iterator[List]:
+        try:
+            from langextract.core.types import ScoredOutput
+        except ImportError:
+            try:
+                from langextract.inference import ScoredOutput
+            except ImportError:
+                ScoredOutput = lambda score, output: SimpleNamespace(score=score, output=output)  # noqa: E731
+        for prompt in batch_prompts:
+            self.behavior.call()
+            yield [ScoredOutput(score=1.0, output=answer_prompt(prompt))]
+
+
+# ----------------------------------------------------------------------
+# 接入方式 3：OpenAI 兼容的本地 HTTP 服务
+# ----------------------------------------------------------------------
+class _MockHandler(BaseHTTPRequestHandler):
+    behavior: MockBehavior = MockBehavior()
+    model_id = "mock"
+
+    def _send(self, status: int, body: Dict, headers: Optional[Dict] = None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send(200, {"object": "list", "data": [{"id": self.model_id, "object": "model", "owned_by": "mock"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send(200, self.behavior.stats)
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        try:
+            self.behavior.call()
+        except MockRateLimitError as e:
+            self._send(429, {"error": {"message": str(e), "type": "rate_limit_exceeded"}},
+                       {"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+            return
+        except MockServerError as e:
+            self._send(500, {"error": {"message": str(e), "type": "server_error"}})
+            return
+        prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+        content = answer_prompt(prompt)
+        self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", self.model_id),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(content),
+                      "total_tokens": len(prompt) + len(content)},
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8000, behavior: Optional[MockBehavior] = None) -> ThreadingHTTPServer:
+    """构建（不启动）本地服务；port=0 时由系统分配端口（server.server_address[1]）"""
+    handler = type("MockHandler", (_MockHandler,), {"behavior": behavior or MockBehavior()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_background(host: str = "127.0.0.1", port: int = 0,
+                        behavior: Optional[MockBehavior] = None) -> Tuple[ThreadingHTTPServer, str]:
+    """在后台线程启动服务，返回 (server, base_url)；用完调用 server.shutdown()"""
+    server = make_server(host, port, behavior)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地 LLM 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--median-ms", type=float, default=300.0, help="延迟中位数（毫秒）")
+    parser.add_argument("--sigma", type=float, default=0.5, help="对数正态延迟的 sigma，0 为固定延迟")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 HTTP 500 的比例")
+    parser.add_argument("--rps", type=float, help="令牌桶限流（每秒请求数），超出返回 HTTP 429")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="随机返回 HTTP 429 的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    behavior = MockBehavior(args.median_ms, args.sigma, args.error_rate, args.rps, args.throttle_rate, args.seed)
+    server = make_server(args.host, args.port, behavior)
+    print(f"🧪 Mock LLM 服务已启动：http://{args.host}:{args.port}/v1 "
+          f"（export QWEN_BASE_URL=http://{args.host}:{args.port}/v1）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 {behavior.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+模型调用网关：令牌桶限流 + 抖动指数退避重试 + 熔断
+
+说明：
+- 各抽取器对 lx.extract 的调用都经过同一个网关（默认共享 shared_gateway()），限流与熔断状态全局一致：
+  一个抽取器发现服务不可用，其他抽取器也立即回退到规则，而不是每篇文档各自等待超时。
+- 令牌桶（TokenBucket）：rate 为每秒请求数，burst 为桶容量；取不到令牌时阻塞等待。rate=None 不限流。
+- 重试：429（限流）与 5xx / 超时 / 连接错误视为可重试；等待时间为 base_delay * 2^attempt（不超过 max_delay），
+  乘以 [0.5, 1) 的随机抖动，服务端给出 Retry-After 时以它为准。其他异常（如解析失败）直接抛出，不重试。
+- 熔断（CircuitBreaker）：连续 failure_threshold 次服务端错误（5xx / 超时 / 连接错误，不含 429）后断开，
+  断开期间调用立即抛出 CircuitOpenError，调用方照常走回退逻辑；recovery_timeout 秒后放行一次探测请求
+  （半开），成功则恢复，失败则继续断开并重新计时。
+- stats() 给出调用数、重试数、失败数、被熔断拦下的次数与熔断状态；指标开启时计入 model_gateway_*（见 metrics.py）。
+"""
+
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from metrics import METRICS
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器断开，调用未发出"""
+
+
+# ----------------------------------------------------------------------
+# 错误分类
+# ----------------------------------------------------------------------
+_THROTTLE_NAMES = ("ratelimit", "toomanyrequests", "resourceexhausted")
+_SERVER_NAMES = ("servererror", "internalserver", "serviceunavailable", "timeout", "connection", "apierror")
+
+
+def _status_of(exc: BaseException) -> Optional[int]:
+    for attr in ("status_code", "http_status", "status", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def classify_error(exc: BaseException) -> Optional[str]:
+    """
+    返回 "throttle"（429）、"server"（5xx / 超时 / 连接错误）或 None（不可重试）。
+    langextract 会把 provider 的异常包装一层，这里沿 __cause__ / original 链逐层检查。
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        status = _status_of(exc)
+        if status == 429:
+            return "throttle"
+        if status is not None and 500 <= status < 600:
+            return "server"
+        name = type(exc).__name__.lower()
+        if any(n in name for n in _THROTTLE_NAMES):
+            return "throttle"
+        if any(n in name for n in _SERVER_NAMES) or isinstance(exc, (TimeoutError, ConnectionError)):
+            return "server"
+        exc = getattr(exc, "original", None) or exc.__cause__
+    return None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+# ----------------------------------------------------------------------
+# 限流与熔断
+# ----------------------------------------------------------------------
+class TokenBucket:
+    """令牌桶：平均 rate 次/秒，允许 burst 次突发"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不够时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """closed -> (连续失败) -> open -> (recovery_timeout 后) half_open -> 探测成功 closed / 失败 open"""
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行一次调用；半开状态下同一时间只放行一个探测请求"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"🔌 模型服务连续失败 {self._failures} 次，熔断 {self.recovery_timeout:.0f}s，期间全部使用回退规则")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def release_probe(self):
+        """探测请求以不计入健康状态的方式结束（如不可重试的错误）时，允许下一次探测"""
+        with self._lock:
+            self._probing = False
+
+
+class ModelGateway:
+    """限流、重试与熔断的组合；call(fn, *args, **kwargs) 代替直接调用 fn"""
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None, max_retries: int = 3,
+                 base_delay: float = 0.5, max_delay: float = 8.0, failure_threshold: int = 5,
+                 recovery_timeout: float = 30.0, seed: Optional[int] = None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.breaker = CircuitBreaker(failure_threshold, recovery_timeout)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "ok": 0, "retries": 0, "failed": 0, "short_circuited": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+        METRICS.inc("model_gateway_requests_total", outcome=key)
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        with self._lock:
+            jitter = self._rng.uniform(0.5, 1.0)
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * jitter
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """经限流调用 fn；可重试的错误按退避重试，熔断断开时立即抛出 CircuitOpenError"""
+        self._count("calls")
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                raise CircuitOpenError("模型服务熔断中，跳过调用")
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == "server":
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release_probe()
+                if kind is None or attempt == self.max_retries:
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt, e))
+                continue
+            self.breaker.record_success()
+            self._count("ok")
+            return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, circuit=self.breaker.state)
+
+
+_shared: Optional[ModelGateway] = None
+_shared_lock = threading.Lock()
+
+
+def shared_gateway() -> ModelGateway:
+    """各抽取器默认共用的网关（首次调用时按默认参数创建）"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ModelGateway()
+        return _shared
+
+
+def configure_shared_gateway(**kwargs) -> ModelGateway:
+    """用新参数替换共享网关（如 rate=20, failure_threshold=3）；之后构造的抽取器使用新网关"""
+    global _shared
+    with _shared_lock:
+        _shared = ModelGateway(**kwargs)
+        return _shared
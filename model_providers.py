@@ -0,0 +1,144 @@
+"""
+模型提供器注册表：按需（首次使用时）构建 LLM 模型实例
+
+说明：
+- 之前 langextract_rag_cn.py 在导入时就 import langextract.providers.openai 并构建 OpenAILanguageModel，
+  langextract_opinion_extraction.py 在 __init__ 中构建模型与 examples；只想用规则回退、或只是 import 一下模块
+  （命令行启动、ingest_pipeline / 多进程工作进程）也要付出这笔开销，且没有网络配置时无法导入。
+- register_provider(name, factory)：登记一个工厂函数，登记时什么都不构建；
+  get_model(name, **kwargs)：首次调用时才执行工厂，相同参数的实例缓存复用（线程安全）。
+- 内置 "qwen"：DashScope 的 OpenAI 兼容接口，model_id / base_url / api_key 未显式传入时
+  分别读取 QWEN_MODEL_ID（再缺省为 qwen-turbo）/ QWEN_BASE_URL / QWEN_API_KEY，显式参数优先；"mock"：mock_llm.MockLanguageModel，离线压测用。
+- load_langextract()：按需导入 langextract；langextract_available() 只检查是否安装，不执行导入；
+  set_langextract(stand_in) 可换成替身（如 mock_llm.MockLangExtract），无需安装 langextract、不访问网络。
+- 运行 `python model_providers.py` 在新进程中测量各脚本模块的导入耗时，超出预算或导入时加载了 langextract 即返回非 0。
+"""
+
+import importlib
+import importlib.util
+import os
+import subprocess
+import sys
+import threading
+from typing import Any, Callable, Dict, Optional, Sequence
+
+_factories: Dict[str, Callable[..., Any]] = {}
+_instances: Dict[tuple, Any] = {}
+_lock = threading.Lock()
+_langextract_override = None
+
+
+def register_provider(name: str, factory: Callable[..., Any]):
+    """登记模型工厂；同名重复登记会覆盖，并丢弃已缓存的实例"""
+    with _lock:
+        _factories[name] = factory
+        for key in [k for k in _instances if k[0] == name]:
+            del _instances[key]
+
+
+def available_providers() -> Sequence[str]:
+    return sorted(_factories)
+
+
+def get_model(name: str, **kwargs) -> Any:
+    """返回 name 对应的模型实例；首次调用时构建，之后相同参数直接返回缓存的实例"""
+    key = (name, tuple(sorted(kwargs.items())))
+    with _lock:
+        if key not in _instances:
+            if name not in _factories:
+                raise KeyError(f"未登记的模型提供器: {name}（可用: {', '.join(available_providers())}）")
+            _instances[key] = _factories[name](**kwargs)
+        return _instances[key]
+
+
+def langextract_available() -> bool:
+    """langextract 是否已安装（只查找模块，不导入）；设置了替身时总为 True"""
+    return _langextract_override is not None or importlib.util.find_spec("langextract") is not None
+
+
+def load_langextract():
+    """导入并返回 langextract 模块（重复调用由 sys.modules 缓存）；设置了替身时返回替身"""
+    if _langextract_override is not None:
+        return _langextract_override
+    return importlib.import_module("langextract")
+
+
+def set_langextract(module) -> None:
+    """
+    用一个与 langextract 接口相同的对象（extract(...) 与 data.ExampleData / data.Extraction）替换真实模块，
+    例如 mock_llm.MockLangExtract；传入 None 恢复。只影响之后构造的抽取器。
+    """
+    global _langextract_override
+    _langextract_override = module
+
+
+def _build_qwen(model_id: Optional[str] = None, api_key: Optional[str] = None, base_url: Optional[str] = None):
+    """Qwen（DashScope OpenAI 兼容模式）"""
+    from langextract.providers.openai import OpenAILanguageModel
+
+    key = api_key or os.getenv("QWEN_API_KEY")
+    if not key:
+        raise RuntimeError("未提供 qwen api key（参数 api_key 或环境变量 QWEN_API_KEY）")
+    return OpenAILanguageModel(
+        model_id=model_id or os.getenv("QWEN_MODEL_ID", "qwen-turbo"),
+        base_url=base_url or os.getenv("QWEN_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+        api_key=key
+    )
+
+
+def _build_mock(**kwargs):
+    """本地替身模型（见 mock_llm.py），不访问网络"""
+    from mock_llm import MockLanguageModel
+
+    return MockLanguageModel(**kwargs)
+
+
+register_provider("qwen", _build_qwen)
+register_provider("mock", _build_mock)
+
+
+# ----------------------------------------------------------------------
+# 导入耗时预算检查
+# ----------------------------------------------------------------------
+DEFAULT_IMPORT_MODULES = ("langextract_rag", "langextract_rag_cn", "langextract_opinion_extraction", "ingest_pipeline")
+
+_IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, int(any(m == "langextract" or m.startswith("langextract.") for m in sys.modules)))
+"""
+
+
+def measure_import(module: str, cwd: Optional[str] = None) -> Dict[str, Any]:
+    """在新的解释器进程中导入 module，返回导入耗时（毫秒）以及导入后 langextract 是否已被加载"""
+    out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE.format(module=module)],
+                         cwd=cwd or os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True).stdout.split()
+    return {"module": module, "ms": float(out[-2]) * 1000, "langextract_loaded": out[-1] == "1"}
+
+
+def check_import_budget(modules: Sequence[str] = DEFAULT_IMPORT_MODULES, budget_ms: float = 500.0,
+                        repeat: int = 3) -> bool:
+    """每个模块取 repeat 次中最快的导入耗时，全部不超过 budget_ms 且未在导入时加载 langextract 时返回 True"""
+    ok = True
+    for module in modules:
+        runs = [measure_import(module) for _ in range(repeat)]
+        best = min(r["ms"] for r in runs)
+        loaded = any(r["langextract_loaded"] for r in runs)
+        passed = best <= budget_ms and not loaded
+        ok = ok and passed
+        note = "，导入时加载了 langextract" if loaded else ""
+        print(f"{'✅' if passed else '❌'} {module}: {best:.1f} ms（预算 {budget_ms:.0f} ms）{note}")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="检查各脚本模块的导入耗时")
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_IMPORT_MODULES))
+    parser.add_argument("--budget-ms", type=float, default=500.0)
+    args = parser.parse_args()
+    sys.exit(0 if check_import_budget(args.modules, args.budget_ms) else 1)
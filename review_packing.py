@@ -0,0 +1,182 @@
+"""
+多条短评合并为一次 LLM 请求（packing）
+
+说明：
+- 大众点评的评论很短，单条抽取时每次请求都要重发 prompt 与 few-shot examples，这部分开销远大于评论本身。
+- ReviewPacker 按 token 预算把多条评论拼成一段文本（每条前加 "【评论 N】" 作为边界），一次 lx.extract 抽取；
+  预算 = prompt + examples 的估算 token（request_overhead）+ 各条评论的估算 token，不超过 token_budget，
+  且每包不超过 max_docs 条。单条就超预算的评论单独成包。
+- 抽取结果映射回原评论：PACK_INSTRUCTION 要求模型在每条抽取的 attributes 中写明 review: N（评论编号），
+  优先按它归属；没有编号时用 langextract 对齐得到的 char_interval（落在边界标记上的丢弃）；
+  两者都没有时，只有非 unique_classes 的抽取文本（观点三元组取 JSON 中的 opinion）恰好出现在一条评论中才归属。
+  其余无法确定归属的抽取（如店名/评分这类短值、改写过的观点）直接丢弃并计入 unattributed，不按位置猜测：
+  猜错会把别的评论的结果写进这条评论的缓存。丢弃后缺字段的评论由调用方单独补抽。
+- token 数为粗略估算：中日韩字符按 1 个 token，其余字符按 4 个字符 1 个 token。
+"""
+
+import bisect
+import json
+import math
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+_WIDE_CHAR_RE = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+_REVIEW_NO_RE = re.compile(r'\d+')
+
+PACK_INSTRUCTION = """
+        输入包含多条相互独立的评论，每条以 "【评论 N】" 开头。请逐条抽取，按评论顺序输出；
+        每条抽取结果只能来自它所在的那条评论，不要跨评论合并。
+        每条抽取结果的 attributes 中必须加入 "review": N，N 为该结果所属评论的编号。
+        """
+SEPARATOR = "\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    wide = len(_WIDE_CHAR_RE.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def request_overhead(prompt: str, examples) -> int:
+    """prompt 与 few-shot examples 的估算 token 数（每次请求都会重发）"""
+    total = estimate_tokens(prompt)
+    for example in examples or []:
+        total += estimate_tokens(example.text)
+        for ex in example.extractions:
+            total += estimate_tokens(ex.extraction_class) + estimate_tokens(ex.extraction_text)
+    return total
+
+
+def _header(i: int) -> str:
+    return f"【评论 {i + 1}】\n"
+
+
+def pack_texts(texts: Sequence[str]) -> Tuple[str, List[Tuple[int, int]]]:
+    """拼接文本，返回 (packed, spans)；spans[i] 为第 i 条评论正文在 packed 中的 [start, end)"""
+    parts, spans, pos = [], [], 0
+    for i, text in enumerate(texts):
+        if i:
+            parts.append(SEPARATOR)
+            pos += len(SEPARATOR)
+        header = _header(i)
+        parts.append(header)
+        pos += len(header)
+        parts.append(text)
+        spans.append((pos, pos + len(text)))
+        pos += len(text)
+    return "".join(parts), spans
+
+
+def _anchor_texts(extraction) -> List[str]:
+    """用于在原文中定位的文本：extraction_text 本身，JSON 形式的观点三元组再加上其中的 opinion"""
+    txt = (getattr(extraction, "extraction_text", "") or "").strip()
+    anchors = [txt] if txt else []
+    if txt.startswith(("{", "[")):
+        try:
+            data = json.loads(txt)
+        except ValueError:
+            return anchors
+        for item in data if isinstance(data, list) else [data]:
+            if isinstance(item, dict):
+                opinion = item.get("opinion") or item.get("观点")
+                if opinion:
+                    anchors.append(str(opinion))
+    return anchors
+
+
+def review_number(extraction) -> Optional[int]:
+    """抽取结果 attributes 中的评论编号（1 起），没有或无法解析时返回 None"""
+    attributes = getattr(extraction, "attributes", None) or {}
+    value = attributes.get("review")
+    if value is None:
+        return None
+    m = _REVIEW_NO_RE.search(str(value))
+    return int(m.group()) if m else None
+
+
+def split_extractions(extractions, packed: str, spans: List[Tuple[int, int]],
+                      unique_classes: Sequence[str] = ()) -> Tuple[List[List], int]:
+    """
+    把整包的 extractions 分回各条评论，返回 (per_doc, unattributed)。
+    归属顺序：attributes 中的评论编号 > char_interval 字符偏移 > 抽取文本只出现在一条评论中。
+    unique_classes 为每条评论至多出现一次的类别（如 shop_name / rating），这类值往往很短（"5"、"口味"），
+    在别的评论里也常出现，不按原文查找。无法归属的抽取丢弃，计入 unattributed。
+    """
+    starts = [start for start, _ in spans]
+    per_doc: List[List] = [[] for _ in spans]
+    unique_classes = set(unique_classes)
+    unattributed = 0
+
+    def doc_at(pos: int) -> Optional[int]:
+        i = bisect.bisect_right(starts, pos) - 1
+        return i if i >= 0 and pos < spans[i][1] else None
+
+    def find(anchor: str) -> Optional[int]:
+        found = [i for i, (start, end) in enumerate(spans) if packed.find(anchor, start, end) >= 0]
+        return found[0] if len(found) == 1 else None
+
+    for ex in extractions:
+        doc = None
+        number = review_number(ex)
+        interval = getattr(ex, "char_interval", None)
+        start = getattr(interval, "start_pos", None) if interval is not None else None
+        if number is not None:
+            doc = number - 1 if 1 <= number <= len(spans) else None
+        elif start is not None:
+            doc = doc_at(start)
+        elif ex.extraction_class not in unique_classes:
+            doc = next((i for i in map(find, _anchor_texts(ex)) if i is not None), None)
+        if doc is None:
+            unattributed += 1
+            continue
+        per_doc[doc].append(ex)
+    return per_doc, unattributed
+
+
+class ReviewPacker:
+    """按 token 预算分包并执行整包抽取；统计请求数与文档数（线程安全）"""
+
+    def __init__(self, token_budget: int = 8000, max_docs: int = 32):
+        self.token_budget = token_budget
+        self.max_docs = max_docs
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.documents = 0
+        self.unattributed = 0
+
+    def plan(self, texts: Sequence[str], overhead: int) -> List[List[int]]:
+        """贪心分包：按输入顺序装入，装不下（超出预算或条数上限）就开新包"""
+        packs: List[List[int]] = []
+        current: List[int] = []
+        used = overhead
+        for i, text in enumerate(texts):
+            cost = estimate_tokens(_header(i) + text) + 1
+            if current and (used + cost > self.token_budget or len(current) >= self.max_docs):
+                packs.append(current)
+                current, used = [], overhead
+            current.append(i)
+            used += cost
+        if current:
+            packs.append(current)
+        return packs
+
+    def extract(self, texts: Sequence[str], call: Callable[[str], List],
+                unique_classes: Sequence[str] = ()) -> List[List]:
+        """对一包评论调用 call(packed_text) -> extractions，返回按评论拆分后的 extractions（无法归属的已丢弃）"""
+        packed, spans = pack_texts(texts)
+        extractions = call(packed)
+        per_doc, unattributed = split_extractions(extractions, packed, spans, unique_classes)
+        with self._lock:
+            self.requests += 1
+            self.documents += len(texts)
+            self.unattributed += unattributed
+        return per_doc
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "documents": self.documents,
+                "unattributed": self.unattributed,
+                "docs_per_request": self.documents / self.requests if self.requests else 0.0,
+            }
@@ -0,0 +1,397 @@
+"""
+SmartVectorStore 使用的内存索引结构
+
+说明：
+- NGramIndex：字符 n-gram -> 条目 id 集合，用于快速找出"包含某个子串"的条目；
+  查询时先对 n-gram 倒排表求交得到候选集，再做一次子串校验，结果与直接子串扫描完全一致。
+  校验用的文本可由调用方通过 text_of(item_id) 提供（如 store 中的文档正文），索引不再另存一份副本；
+  不传时索引自己保存文本（InvertedIndex 的词表即如此）。
+- InvertedIndex：词 -> 文档 id 倒排表（postings），词为按空白切分并小写化的 token。
+  原有检索语义是"查询词是文档内容的子串"，由于查询词本身不含空白，它只可能出现在某一个
+  token 内部，因此只需在词表上找出包含该查询词的 token（借助 NGramIndex），再对这些 token
+  的 postings 求并即可，不必扫描全部文档。
+- FacetIndex：元数据字段 -> 取值 -> 位图（bitmap），过滤条件变为位图求与；
+  每个取值的文档数（facet counts）可直接由位图计数得到。
+- BM25Index：带词频的倒排表 + 预计算的文档长度归一化与 IDF，用有界堆取 top-k，
+  用于排序检索（只返回最相关的 k 篇）。
+- 各索引的倒排表/字符串都存放在 index_format 的 Layered* 容器中，可通过 save/load
+  写入磁盘并以 mmap 方式打开；加载后仍可继续追加。
+"""
+
+import heapq
+import json
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from index_format import (FrozenPostings, FrozenStrings, LayeredList, LayeredPostings,
+                          load_ints, open_mmap, write_ints, write_postings, write_strings)
+
+
+class NGramIndex:
+    """字符 n-gram 倒排索引，支持子串查询（候选求交 + 校验）"""
+
+    def __init__(self, n: int = 2, text_of: Optional[Callable[[int], str]] = None):
+        if n < 2:
+            raise ValueError("n 至少为 2")
+        self.n = n
+        self.grams = LayeredPostings()
+        # text_of 为 None 时自己保存文本（texts），否则校验时向调用方取文本，不保存副本
+        self.text_of = text_of
+        self.texts = LayeredList() if text_of is None else None
+        self.size = 0
+
+    def _grams(self, text: str) -> Set[str]:
+        # 同时索引单字，使长度小于 n 的查询也能走索引
+        grams = set(text)
+        grams.update(text[i:i + self.n] for i in range(len(text) - self.n + 1))
+        return grams
+
+    def add(self, item_id: int, text: str):
+        """索引一个条目；text 应为已小写化的文本，item_id 需按 0, 1, 2... 顺序追加"""
+        if item_id != self.size:
+            raise ValueError(f"item_id 应为 {self.size}，实际为 {item_id}")
+        if self.texts is not None:
+            self.texts.append(text)
+        self.size += 1
+        for g in self._grams(text):
+            self.grams.append(g, item_id)
+
+    def candidates(self, pattern: str) -> Set[int]:
+        """返回可能包含 pattern 的条目 id（未校验）"""
+        if len(pattern) < self.n:
+            keys = set(pattern)
+        else:
+            keys = {pattern[i:i + self.n] for i in range(len(pattern) - self.n + 1)}
+        postings = []
+        for k in keys:
+            p = self.grams.get(k)
+            if not p:
+                return set()
+            postings.append(p)
+        # 从最短的倒排表开始求交，尽早收缩候选集
+        postings.sort(key=len)
+        result = set(postings[0])
+        for p in postings[1:]:
+            result.intersection_update(p)
+            if not result:
+                break
+        return result
+
+    def search(self, pattern: str) -> Set[int]:
+        """返回确实包含 pattern 的条目 id"""
+        if not pattern:
+            return set(range(self.size))
+        text_of = self.text_of or self.texts.__getitem__
+        return {i for i in self.candidates(pattern) if pattern in text_of(i)}
+
+    def save(self, prefix: str):
+        write_postings(prefix + ".grams", self.grams)
+        if self.texts is not None:
+            write_strings(prefix + ".texts.str", self.texts)
+
+    @classmethod
+    def load(cls, prefix: str, n: int, text_of: Optional[Callable[[int], str]] = None,
+             size: Optional[int] = None) -> "NGramIndex":
+        """text_of 为 None 时读取保存的文本；否则需给出条目数 size（文本由调用方提供）"""
+        index = cls(n=n, text_of=text_of)
+        index.grams = LayeredPostings(FrozenPostings(prefix + ".grams"))
+        if text_of is None:
+            index.texts = LayeredList(FrozenStrings(prefix + ".texts.str"))
+            index.size = len(index.texts)
+        else:
+            index.size = size
+        return index
+
+
+class InvertedIndex:
+    """token -> 文档 id 倒排表；任一查询词匹配（子串语义）通过 postings 求并完成"""
+
+    # 查询词扩展缓存的最大条目数（LRU）；键来自用户输入，不设上限会随查询流量无限增长
+    EXPANSION_CACHE_SIZE = 4096
+
+    def __init__(self, n: int = 3):
+        self.postings = LayeredPostings()
+        # 词表上的 n-gram 索引：term_id -> term（texts 即词表）
+        self._term_grams = NGramIndex(n=n)
+        # 查询词 -> 匹配 token 的 LRU 缓存，词表变化时清空
+        self._expansions: "OrderedDict[str, List[str]]" = OrderedDict()
+
+    @staticmethod
+    def tokenize(text: str) -> Set[str]:
+        return set(text.lower().split())
+
+    def add(self, doc_id: int, text: str):
+        """索引一篇文档；doc_id 需单调递增，以保证 postings 有序"""
+        for token in self.tokenize(text):
+            if token not in self.postings:
+                self._term_grams.add(len(self._term_grams.texts), token)
+                self._expansions.clear()
+            self.postings.append(token, doc_id)
+
+    def expand(self, word: str) -> List[str]:
+        """返回词表中包含 word 的所有 token"""
+        word = word.lower()
+        terms = self._expansions.get(word)
+        if terms is not None:
+            self._expansions.move_to_end(word)
+            return terms
+        vocab = self._term_grams.texts
+        terms = [vocab[i] for i in self._term_grams.search(word)]
+        self._expansions[word] = terms
+        if len(self._expansions) > self.EXPANSION_CACHE_SIZE:
+            self._expansions.popitem(last=False)
+        return terms
+
+    def match_any(self, words: Iterable[str]) -> Set[int]:
+        """返回内容中包含任一查询词（子串）的文档 id"""
+        matched: Set[int] = set()
+        for word in words:
+            for term in self.expand(word):
+                matched.update(self.postings.get(term))
+        return matched
+
+    def save(self, prefix: str):
+        write_postings(prefix + ".postings", self.postings)
+        self._term_grams.save(prefix + ".vocab")
+
+    @classmethod
+    def load(cls, prefix: str, n: int = 3) -> "InvertedIndex":
+        index = cls(n=n)
+        index.postings = LayeredPostings(FrozenPostings(prefix + ".postings"))
+        index._term_grams = NGramIndex.load(prefix + ".vocab", n=n)
+        return index
+
+
+class FacetIndex:
+    """
+    元数据分面索引：每个字段的每个取值对应一个位图，第 i 位表示第 i 篇文档取该值。
+
+    - 位图在写入时以 bytearray 维护（置位 O(1)），查询时转成 Python int 做按位与/或；
+      转换结果会缓存，直到下一次写入。从磁盘加载的位图是 mmap 上的只读切片，首次写入该取值时才复制。
+    - 对模糊匹配类过滤（如店名部分匹配、评分 >= 阈值），只需对字段的"不同取值"逐一判断，
+      再把命中取值的位图求或，代价与取值个数相关，而与文档数无关。
+    """
+
+    _NONZERO = re.compile(rb"[^\x00]")
+
+    def __init__(self, fields: Dict[str, Any]):
+        # fields：字段名 -> 元数据缺失该字段时使用的默认值
+        self.fields = dict(fields)
+        self.size = 0
+        self._bits: Dict[str, Dict[Any, Any]] = {f: {} for f in self.fields}
+        self._int_cache: Dict[tuple, int] = {}
+
+    def add(self, doc_id: int, metadata: Dict):
+        """写入一篇文档的元数据"""
+        byte, mask = doc_id >> 3, 1 << (doc_id & 7)
+        for field, default in self.fields.items():
+            value = metadata.get(field, default)
+            ba = self._bits[field].get(value)
+            if not isinstance(ba, bytearray):
+                ba = bytearray(ba or b"")
+                self._bits[field][value] = ba
+            if len(ba) <= byte:
+                ba.extend(bytes(byte + 1 - len(ba)))
+            ba[byte] |= mask
+        self.size = max(self.size, doc_id + 1)
+        self._int_cache.clear()
+
+    def values(self, field: str) -> List:
+        """字段的所有不同取值"""
+        return list(self._bits[field])
+
+    def all_bits(self) -> int:
+        """全部文档的位图"""
+        return (1 << self.size) - 1
+
+    def bitmap(self, field: str, value) -> int:
+        """字段取 value 的文档位图"""
+        key = (field, value)
+        bits = self._int_cache.get(key)
+        if bits is None:
+            ba = self._bits[field].get(value)
+            bits = int.from_bytes(ba, "little") if ba else 0
+            self._int_cache[key] = bits
+        return bits
+
+    def select(self, field: str, predicate: Callable[[Any], bool]) -> int:
+        """字段取值满足 predicate 的文档位图（各取值位图求或）"""
+        bits = 0
+        for value in self._bits[field]:
+            if predicate(value):
+                bits |= self.bitmap(field, value)
+        return bits
+
+    def counts(self, field: str, within: Optional[int] = None) -> Dict[Any, int]:
+        """每个取值的文档数；within 为限定范围的位图（如当前查询命中的文档）"""
+        result = {}
+        for value in self._bits[field]:
+            bits = self.bitmap(field, value)
+            if within is not None:
+                bits &= within
+            n = bin(bits).count("1")
+            if n:
+                result[value] = n
+        return result
+
+    def save(self, prefix: str):
+        """位图拼接写入 prefix.bin，取值与偏移写入 prefix.json"""
+        layout = {"fields": [], "size": self.size}
+        offset = 0
+        with open(prefix + ".bin", "wb") as f:
+            for field, default in self.fields.items():
+                values = []
+                for value, ba in self._bits[field].items():
+                    f.write(ba)
+                    values.append([value, offset, len(ba)])
+                    offset += len(ba)
+                layout["fields"].append({"name": field, "default": default, "values": values})
+        with open(prefix + ".json", "w", encoding="utf-8") as f:
+            json.dump(layout, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, prefix: str) -> "FacetIndex":
+        with open(prefix + ".json", encoding="utf-8") as f:
+            layout = json.load(f)
+        buf = open_mmap(prefix + ".bin")
+        index = cls({fd["name"]: fd["default"] for fd in layout["fields"]})
+        index.size = layout["size"]
+        for fd in layout["fields"]:
+            index._bits[fd["name"]] = {value: buf[off:off + length] for value, off, length in fd["values"]}
+        return index
+
+    @classmethod
+    def ids(cls, bits: int) -> List[int]:
+        """位图 -> 升序文档 id 列表；跳过全零字节，代价与置位数量相关"""
+        if not bits:
+            return []
+        data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+        result = []
+        for m in cls._NONZERO.finditer(data):
+            base, byte = m.start() << 3, data[m.start()]
+            for j in range(8):
+                if byte >> j & 1:
+                    result.append(base + j)
+        return result
+
+    @staticmethod
+    def from_ids(ids: Iterable[int]) -> int:
+        """文档 id 集合 -> 位图"""
+        ids = list(ids)
+        if not ids:
+            return 0
+        ba = bytearray((max(ids) >> 3) + 1)
+        for i in ids:
+            ba[i >> 3] |= 1 << (i & 7)
+        return int.from_bytes(ba, "little")
+
+
+_WORD_RE = re.compile(r"\w+(?:\.\w+)*")
+_SEGMENT_RE = re.compile(r"[\W_]+")
+
+
+def word_tokens(text: str) -> List[str]:
+    """英文分词：小写化后取字母数字串（保留 2.0 这类带点的版本号）"""
+    return _WORD_RE.findall(text.lower())
+
+
+def cjk_bigrams(text: str) -> List[str]:
+    """中文分词替代：按标点/空白切段，每段取字符 bigram（单字段保留单字）"""
+    tokens = []
+    for seg in _SEGMENT_RE.split(text.lower()):
+        if len(seg) == 1:
+            tokens.append(seg)
+        else:
+            tokens.extend(seg[i:i + 2] for i in range(len(seg) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    BM25 排序索引。
+
+    - postings：term -> [doc_id, tf, doc_id, tf, ...]，按 term-at-a-time 方式累加得分，只触及含查询词的文档
+    - 文档长度在写入时记录；IDF 与每篇文档的长度归一化项按需计算并缓存，写入后失效
+    - top_k 使用大小为 k 的有界堆（heapq.nlargest），时间与返回数据量都受 k 约束
+    """
+
+    def __init__(self, tokenizer: Callable[[str], List[str]] = word_tokens, k1: float = 1.5, b: float = 0.75):
+        self.tokenizer = tokenizer
+        self.k1 = k1
+        self.b = b
+        self.postings = LayeredPostings()
+        self.doc_len = LayeredList()
+        self.total_len = 0
+        self._idf: Dict[str, float] = {}
+        self._norm: Dict[int, float] = {}
+
+    def add(self, doc_id: int, text: str):
+        """doc_id 需按 0, 1, 2... 顺序追加"""
+        if doc_id != len(self.doc_len):
+            raise ValueError(f"doc_id 应为 {len(self.doc_len)}，实际为 {doc_id}")
+        tokens = self.tokenizer(text)
+        for term, tf in Counter(tokens).items():
+            self.postings.extend(term, (doc_id, tf))
+        self.doc_len.append(len(tokens))
+        self.total_len += len(tokens)
+        self._idf.clear()
+        self._norm.clear()
+
+    def _idf_of(self, term: str, postings) -> float:
+        idf = self._idf.get(term)
+        if idf is None:
+            n = len(self.doc_len)
+            df = len(postings) // 2
+            idf = self._idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        return idf
+
+    def _norm_of(self, doc_id: int) -> float:
+        # k1 * (1 - b + b * dl / avgdl)，每篇文档只算一次
+        norm = self._norm.get(doc_id)
+        if norm is None:
+            n = len(self.doc_len)
+            avgdl = self.total_len / n if n else 0.0
+            dl = self.doc_len[doc_id]
+            norm = self._norm[doc_id] = self.k1 * (1 - self.b + self.b * dl / avgdl) if avgdl else self.k1
+        return norm
+
+    def scores(self, query: str, allowed: Optional[Set[int]] = None,
+               excluded: Optional[Set[int]] = None) -> Dict[int, float]:
+        """返回含任一查询词的文档得分；allowed 不为 None 时只对其中的文档计分，excluded 中的文档（如已删除）跳过"""
+        scores: Dict[int, float] = {}
+        k1 = self.k1
+        for term in set(self.tokenizer(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf_of(term, postings)
+            for doc_id, tf in zip(postings[0::2], postings[1::2]):
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                if excluded and doc_id in excluded:
+                    continue
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + self._norm_of(doc_id))
+        return scores
+
+    def top_k(self, query: str, k: int = 10, allowed: Optional[Set[int]] = None,
+              excluded: Optional[Set[int]] = None, stats: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """返回得分最高的 k 篇文档 [(doc_id, score), ...]，按得分降序；传入 stats 字典时写入打分的候选数 scanned"""
+        scores = self.scores(query, allowed, excluded)
+        if stats is not None:
+            stats["scanned"] = len(scores)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, prefix: str) -> Dict:
+        write_postings(prefix + ".postings", self.postings)
+        write_ints(prefix + ".doclen.rag", self.doc_len)
+        return {"total_len": self.total_len, "k1": self.k1, "b": self.b}
+
+    @classmethod
+    def load(cls, prefix: str, params: Dict, tokenizer: Callable[[str], List[str]]) -> "BM25Index":
+        index = cls(tokenizer, k1=params["k1"], b=params["b"])
+        index.postings = LayeredPostings(FrozenPostings(prefix + ".postings"))
+        index.doc_len = LayeredList(load_ints(prefix + ".doclen.rag"))
+        index.total_len = params["total_len"]
+        return index
@@ -0,0 +1,29 @@
+"""chunking.chunk_documents：每篇文档至少产出一个 chunk，正文为空的文档也不会从索引中消失"""
+
+import pytest
+
+import langextract_rag_cn
+from chunking import chunk_documents, chunk_markdown, chunk_sentences
+
+
+@pytest.mark.parametrize("chunker", [chunk_markdown, chunk_sentences])
+@pytest.mark.parametrize("content", ["", "  \n\t "])
+def test_empty_content_yields_one_empty_chunk(chunker, content):
+    chunks = chunk_documents([{"id": 7, "title": "空文档", "content": content}], chunker)
+    assert chunks == [{"id": "7#0", "title": "空文档", "content": "", "parent_id": 7, "chunk_index": 0, "offset": 0}]
+
+
+def test_offsets_point_into_parent():
+    doc = {"id": 1, "content": "店名：老王烧烤\n评分：5星\n羊肉串很好吃。服务热情！\n\n环境一般。"}
+    chunks = chunk_documents([doc], chunk_sentences, max_chars=8)
+    assert [c["chunk_index"] for c in chunks] == list(range(len(chunks)))
+    for c in chunks:
+        assert doc["content"][c["offset"]:c["offset"] + len(c["content"])] == c["content"]
+
+
+def test_empty_document_still_matches_filters():
+    doc = {"id": "e", "title": "无正文", "content": " ", "metadata": {"shop": "老王烧烤"}}
+    chunks = [dict(c, metadata=doc["metadata"]) for c in chunk_documents([doc], chunk_sentences)]
+    store = langextract_rag_cn.SmartVectorStore(dense=True)
+    store.add_documents(chunks)
+    assert [d["parent_id"] for d in store.search_vectors("老王烧烤", {"shop": "老王烧烤"})] == ["e"]
@@ -0,0 +1,12 @@
+"""导入耗时预算：各脚本模块在新进程中导入不超过预算，且导入时不加载 langextract（见 model_providers.py）"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_budget():
+    proc = subprocess.run([sys.executable, "model_providers.py"], cwd=ROOT, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
@@ -0,0 +1,181 @@
+"""磁盘索引格式（index_format.py）与 SmartVectorStore.save / load：往返、加载后追加、保存回原路径、压缩后保存"""
+
+import contextlib
+import io
+import json
+import os
+
+import pytest
+
+import index_format
+import langextract_rag
+import langextract_rag_cn
+from benchmarks import DOC_QUERIES, REVIEW_QUERIES, synth_docs, synth_reviews
+from index_format import (FrozenDocuments, FrozenRagged, FrozenStrings, read_manifest, staged_directory,
+                          write_documents, write_manifest, write_ragged, write_strings)
+from rule_extractor import DocRuleExtractor, ReviewRuleExtractor
+
+STORES = {
+    "en": (langextract_rag, synth_docs, DOC_QUERIES, DocRuleExtractor, "service"),
+    "cn": (langextract_rag_cn, synth_reviews, REVIEW_QUERIES, ReviewRuleExtractor, "shop"),
+}
+
+
+@pytest.fixture(params=sorted(STORES))
+def corpus(request):
+    rag, synth, queries, rules, facet = STORES[request.param]
+    docs = list(synth(300, seed=1))
+    docs = [dict(doc, metadata=md) for doc, md in zip(docs, rules().extract_batch(docs))]
+    return rag, docs, queries, facet
+
+
+def quiet(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def ids(docs):
+    return [d["id"] for d in docs]
+
+
+def vector_scores(store, query, k=5):
+    """search_vectors 返回文档的得分（由 embedder 重新计算），按名次排列"""
+    hits = store.search_vectors(query, k=k)
+    if not hits:
+        return []
+    scores = store.embedder.embed([query]) @ store.embedder.embed([d["content"] for d in hits]).T
+    return [round(float(x), 5) for x in scores[0]]
+
+
+def snapshot(rag, store, queries, facet, bm25=True):
+    """一组有代表性的查询结果，用于比较两个 store 是否等价。
+    向量检索比较 top-k 得分（同分文档在底座/增量分块时的先后顺序不固定）；
+    BM25 的文档数/平均长度在压缩前包含墓碑文档，压缩前后比较时传 bm25=False"""
+    out = []
+    for q in queries:
+        filters = rag.extract_smart_filters(q)
+        out.append((
+            sorted(ids(quiet(store.search, q))),
+            sorted(ids(quiet(store.search, q, filters))),
+            ids(quiet(store.search, q, k=5)) if bm25 else None,
+            vector_scores(store, q),
+            store.facet_counts(facet, q),
+        ))
+    return out
+
+
+def test_frozen_tables_round_trip(tmp_path):
+    strings = ["", "abc", "中文评论", "emoji 🍢", "x" * 1000]
+    write_strings(str(tmp_path / "s.str"), strings)
+    frozen = FrozenStrings(str(tmp_path / "s.str"))
+    assert list(frozen) == strings
+    assert frozen[-1] == strings[-1]
+    assert frozen[1:3] == strings[1:3]
+    with pytest.raises(IndexError):
+        frozen[len(strings)]
+
+    rows = [[1, 2, 3], [], [7], list(range(100))]
+    write_ragged(str(tmp_path / "r.rag"), rows)
+    assert [list(r) for r in FrozenRagged(str(tmp_path / "r.rag"))] == rows
+
+    write_strings(str(tmp_path / "empty.str"), [])
+    assert len(FrozenStrings(str(tmp_path / "empty.str"))) == 0
+
+
+def test_documents_round_trip(tmp_path):
+    docs = [{"id": 1, "title": "t", "content": "c", "metadata": {"a": [1, 2]}},
+            {"id": "x", "title": "", "content": "正文", "metadata": {}, "parent_id": 1, "start": 5}]
+    write_documents(str(tmp_path), docs)
+    assert FrozenDocuments(str(tmp_path))[:] == docs
+
+
+def test_staged_directory_keeps_old_index_on_error(tmp_path):
+    target = tmp_path / "idx"
+    with staged_directory(str(target)) as tmp:
+        write_strings(os.path.join(tmp, "a.str"), ["old"])
+    with pytest.raises(RuntimeError):
+        with staged_directory(str(target)) as tmp:
+            write_strings(os.path.join(tmp, "a.str"), ["new"])
+            raise RuntimeError("boom")
+    assert list(FrozenStrings(str(target / "a.str"))) == ["old"]
+    assert os.listdir(tmp_path) == ["idx"]
+
+
+@pytest.mark.parametrize("field, value, message", [
+    ("format", "something-else", "不是 SmartVectorStore 索引目录"),
+    ("version", index_format.FORMAT_VERSION + 1, "不支持的索引格式版本"),
+    ("byteorder", "big" if index_format.sys.byteorder == "little" else "little", "字节序"),
+])
+def test_manifest_rejects_incompatible_index(tmp_path, field, value, message):
+    write_manifest(str(tmp_path), {"store": "x"})
+    path = tmp_path / "manifest.json"
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    manifest[field] = value
+    path.write_text(json.dumps(manifest), encoding="utf-8")
+    with pytest.raises(ValueError, match=message):
+        read_manifest(str(tmp_path))
+
+
+def test_load_rejects_other_store_kind(tmp_path):
+    store = langextract_rag.SmartVectorStore()
+    quiet(store.add_documents, [{"id": 1, "title": "t", "content": "c", "metadata": {}}])
+    quiet(store.save, str(tmp_path / "idx"))
+    with pytest.raises(ValueError):
+        langextract_rag_cn.SmartVectorStore.load(str(tmp_path / "idx"))
+
+
+def test_round_trip_and_append_after_load(tmp_path, corpus):
+    rag, docs, queries, facet = corpus
+    path = str(tmp_path / "idx")
+    store = rag.SmartVectorStore(dense=True)
+    quiet(store.add_documents, docs[:200])
+    quiet(store.save, path)
+    loaded = rag.SmartVectorStore.load(path)
+    assert snapshot(rag, loaded, queries, facet) == snapshot(rag, store, queries, facet)
+
+    # 加载后追加：与直接在内存中追加的结果一致
+    quiet(store.upsert, docs[200:])
+    quiet(loaded.upsert, docs[200:])
+    assert snapshot(rag, loaded, queries, facet) == snapshot(rag, store, queries, facet)
+
+
+def test_save_back_to_load_path(tmp_path, corpus):
+    rag, docs, queries, facet = corpus
+    path = str(tmp_path / "idx")
+    store = rag.SmartVectorStore(dense=True)
+    quiet(store.add_documents, docs[:200])
+    quiet(store.save, path)
+
+    loaded = rag.SmartVectorStore.load(path)
+    quiet(loaded.upsert, docs[200:250])
+    quiet(loaded.upsert, [dict(docs[0], content=docs[0]["content"] + " updated")])
+    quiet(loaded.save, path)
+    expected = snapshot(rag, loaded, queries, facet)
+
+    reloaded = rag.SmartVectorStore.load(path)
+    assert len(reloaded.documents) == 250
+    assert sorted(ids(reloaded.documents)) == sorted(ids(docs[:250]))
+    assert snapshot(rag, reloaded, queries, facet) == expected
+    assert os.listdir(tmp_path) == ["idx"]
+
+
+def test_delete_upsert_compact_then_save(tmp_path, corpus):
+    rag, docs, queries, facet = corpus
+    store = rag.SmartVectorStore(dense=True)
+    quiet(store.add_documents, docs[:200])
+    assert store.delete(ids(docs[:80])) == 80
+    quiet(store.upsert, docs[200:] + [dict(docs[100], content="replaced")])
+    before = snapshot(rag, store, queries, facet, bm25=False)
+    store.compact()
+    assert not store.tombstones
+    assert snapshot(rag, store, queries, facet, bm25=False) == before
+
+    quiet(store.save, str(tmp_path / "idx"))
+    loaded = rag.SmartVectorStore.load(str(tmp_path / "idx"))
+    assert snapshot(rag, loaded, queries, facet) == snapshot(rag, store, queries, facet)
+
+    # 直接用有效文档全量建索引，结果应与增量 + 压缩一致
+    live = [d for d in docs[80:200] if d["id"] != docs[100]["id"]] + docs[200:] + [dict(docs[100], content="replaced")]
+    fresh = rag.SmartVectorStore(dense=True)
+    quiet(fresh.add_documents, live)
+    assert snapshot(rag, fresh, queries, facet) == snapshot(rag, store, queries, facet)
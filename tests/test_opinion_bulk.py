@@ -0,0 +1,20 @@
+"""EnhancedOpinionExtractorV7.from_lexicons 与 extract_triples_bulk：工作进程中的抽取器与主进程回退抽取结果一致"""
+
+from langextract_opinion_extraction import EnhancedOpinionExtractorV7, build_test_documents
+
+
+def test_from_lexicons_matches_full_extractor():
+    full = EnhancedOpinionExtractorV7(qwen_apikey="sk-test")
+    bare = EnhancedOpinionExtractorV7.from_lexicons(full.lexicons)
+    assert bare.lexicons == full.lexicons
+    for doc in build_test_documents():
+        assert bare._fallback_extract(doc["content"]) == full._fallback_extract(doc["content"])
+
+
+def test_bulk_matches_fallback():
+    extractor = EnhancedOpinionExtractorV7(qwen_apikey="sk-test")
+    docs = build_test_documents() * 3
+    results = list(extractor.extract_triples_bulk(docs, processes=2, chunksize=4))
+    assert [r["id"] for r in results] == [d["id"] for d in docs]
+    assert [r["triples"] for r in results] == [extractor._fallback_extract(d["content"]) for d in docs]
+    assert not any(r["used_model"] for r in results)
@@ -0,0 +1,70 @@
+"""review_packing.split_extractions：打包抽取结果分回各条评论，无法确定归属的必须丢弃而不是猜测"""
+
+import json
+from types import SimpleNamespace
+
+from review_packing import ReviewPacker, pack_texts, split_extractions
+
+TEXTS = ["店名：老王烧烤\n评分：5星\n羊肉串很好吃，服务热情。", "店名：小南面馆\n评分：5星\n酒店离市中心较远，打车大概要半小时。"]
+
+
+def extraction(cls, text, attributes=None, start=None):
+    interval = SimpleNamespace(start_pos=start) if start is not None else None
+    return SimpleNamespace(extraction_class=cls, extraction_text=text, attributes=attributes or {},
+                           char_interval=interval)
+
+
+def split(extractions, unique_classes=("shop_name", "rating")):
+    packed, spans = pack_texts(TEXTS)
+    return split_extractions(extractions, packed, spans, unique_classes)
+
+
+def test_review_attribute_wins():
+    triple = json.dumps({"aspect": "位置", "opinion": "离市中心较远，打车约30分钟", "sentiment": "negative"},
+                        ensure_ascii=False)
+    per_doc, unattributed = split([extraction("opinion_triple", triple, {"review": "2"})])
+    assert [len(d) for d in per_doc] == [0, 1]
+    assert unattributed == 0
+
+
+def test_out_of_range_review_is_dropped():
+    per_doc, unattributed = split([extraction("opinion_triple", "羊肉串很好吃", {"review": 3}),
+                                   extraction("opinion_triple", "羊肉串很好吃", {"review": 0})])
+    assert per_doc == [[], []]
+    assert unattributed == 2
+
+
+def test_char_interval_on_header_is_dropped():
+    packed, spans = pack_texts(TEXTS)
+    header = packed.index("【评论 2】")
+    per_doc, unattributed = split([extraction("opinion_triple", "评论", start=header),
+                                   extraction("shop_name", "小南面馆", start=packed.index("小南面馆"))])
+    assert [[e.extraction_text for e in d] for d in per_doc] == [[], ["小南面馆"]]
+    assert unattributed == 1
+
+
+def test_unique_class_value_in_two_reviews_is_dropped():
+    # "5" 出现在两条评论中，不能按出现位置或输出顺序猜测归属
+    per_doc, unattributed = split([extraction("rating", "5"), extraction("rating", "5")])
+    assert per_doc == [[], []]
+    assert unattributed == 2
+
+
+def test_anchor_must_be_unique():
+    paraphrased = json.dumps({"aspect": "位置", "opinion": "打车约30分钟", "sentiment": "negative"},
+                             ensure_ascii=False)
+    per_doc, unattributed = split([extraction("opinion_triple", "羊肉串很好吃"),
+                                   extraction("opinion_triple", "5星"),
+                                   extraction("opinion_triple", paraphrased)])
+    assert [[e.extraction_text for e in d] for d in per_doc] == [["羊肉串很好吃"], []]
+    assert unattributed == 2
+
+
+def test_packer_counts_unattributed():
+    packer = ReviewPacker()
+    per_doc = packer.extract(TEXTS, lambda packed: [extraction("rating", "5"),
+                                                    extraction("shop_name", "老王烧烤", {"review": 1})],
+                             unique_classes=("shop_name", "rating"))
+    assert [len(d) for d in per_doc] == [1, 0]
+    assert packer.stats()["unattributed"] == 1
+    assert packer.stats()["requests"] == 1
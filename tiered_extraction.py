@@ -0,0 +1,51 @@
+"""
+分级抽取：先跑规则，只把低置信度的文档交给 LLM
+
+说明：
+- 默认流程是每篇文档先调 LLM，失败才回退到规则（_enhanced_regex_extraction / _fallback_extract）。
+  对高吞吐的数据流可以反过来：规则抽取每篇只要微秒级，先全部跑一遍，按每篇的置信度分流，
+  置信度低于阈值的文档才调用模型，其余直接采用规则结果。
+- 置信度由各抽取器给出（0~1）：
+  - 中文点评：rule_extractor.ReviewRuleExtractor.confidence（结构化字段命中比例 + 情感词密度，正负冲突记 0）
+  - 英文文档：rule_extractor.DocRuleExtractor.confidence（service / version / 文档类型命中比例）
+  - 观点三元组：EnhancedOpinionExtractorV7._fallback_with_confidence（命中方面词的句子比例 × 非中性三元组比例）
+- 入口：FixedLangExtractProcessor.extract_metadata(docs, route_threshold=0.6)、
+  EnhancedOpinionExtractorV7.extract_triples(docs, route_threshold=0.6)；阈值越高送入 LLM 的越多，
+  0 表示全部采用规则结果，大于 1 表示全部送入 LLM。
+- ConfidenceRouter 累计统计文档数与送入 LLM 的比例（llm_call_rate）；指标开启时计入
+  tiered_routing_total{route=rules|llm}（见 metrics.py）。
+"""
+
+import threading
+from typing import Dict, List, Sequence
+
+from metrics import METRICS
+
+
+class ConfidenceRouter:
+    """按置信度阈值分流，并累计统计（线程安全）"""
+
+    def __init__(self, pipeline: str = ""):
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.llm_calls = 0
+
+    def route(self, confidences: Sequence[float], threshold: float) -> List[int]:
+        """返回需要交给 LLM 的文档下标（置信度低于 threshold）"""
+        to_llm = [i for i, c in enumerate(confidences) if c < threshold]
+        with self._lock:
+            self.documents += len(confidences)
+            self.llm_calls += len(to_llm)
+        METRICS.inc("tiered_routing_total", len(confidences) - len(to_llm), pipeline=self.pipeline, route="rules")
+        METRICS.inc("tiered_routing_total", len(to_llm), pipeline=self.pipeline, route="llm")
+        return to_llm
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "documents": self.documents,
+                "llm_calls": self.llm_calls,
+                "rules_only": self.documents - self.llm_calls,
+                "llm_call_rate": self.llm_calls / self.documents if self.documents else 0.0,
+            }